@@ -1,97 +1,127 @@
 
-import sqlite3
-from flask import Flask, request, jsonify
+import db
+import lead_queries
+import lead_schema
+import metrics
+import migrations
+import rate_limit
+from flask import Flask, Response, request, jsonify
 from datetime import datetime
 import os
+import sqlite3
+import threading
 
 app = Flask(__name__)
+metrics.instrument_flask(app)
 DATABASE = 'leads.db'
+# Defer schema setup and the background threads from import to the first request
+# (serverless / autoscaled cold starts)
+FAST_START = os.getenv('FAST_START', 'false').lower() == 'true'
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """This thread's pooled connection (see db.py); don't close it"""
+    return db.get_connection(DATABASE)
+
+# Set up by init_db(): the /submit-lead path (lead_capture.py) into the LEAD_STORE
+# backend (lead_store.py), with its optional group-commit writer (one thread
+# batching concurrent inserts) and, for LEAD_STORE=fanout, the copier that puts
+# committed leads into the Excel workbook in ID order without submissions
+# waiting for it; and where lead_replicator.py does that copy instead, its lag
+capture = None
+excel_replication_lag = None
+service_ready = False
+service_lock = threading.Lock()
 
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS leads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            company TEXT,
-            role TEXT,
-            phone TEXT,
-            topic TEXT NOT NULL,
-            notes TEXT,
-            consent INTEGER NOT NULL,
-            source_page TEXT,
-            utm_source TEXT,
-            utm_medium TEXT,
-            utm_campaign TEXT,
-            utm_term TEXT,
-            utm_content TEXT,
-            submission_time TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Initialize the database when the app starts
-with app.app_context():
-    init_db()
+    """Bring leads.db up to the current schema, open the lead store and start the background threads, once per process"""
+    global capture, excel_replication_lag, service_ready
+    if service_ready:
+        return
+    with service_lock:
+        if service_ready:
+            return
+        # Only needed here, so a fast-start import doesn't load them
+        import group_commit
+        import lead_capture
+        import lead_replicator
+        import lead_store
+        migrations.migrate(get_db_connection())
+        capture = lead_capture.LeadCapture(lead_store.open_store(lead_store.LEAD_STORE, DATABASE), limiter,
+                                           on_stored=lead_stored)
+        if group_commit.GROUP_COMMIT_ENABLED:
+            capture.start_group_commit()
+        if isinstance(capture.store, lead_store.FanoutStore):
+            capture.store.start()
+        if lead_replicator.REPLICATOR_ENABLED:
+            lead_replicator.register_metrics(DATABASE)
+            excel_replication_lag = lead_replicator.replication_lag
+        # Last, with every connection open: a backfill's finish step changes the schema
+        migrations.ensure_migrated(DATABASE)
+        service_ready = True
+
+def lead_stored(submission):
+    """After each new lead"""
+    # In a real scenario, you would also send emails here
+    # For now, we'll just log that it would happen
+    print(f"Lead submitted: {submission.data['email']}. Confirmation and notification emails would be sent.")
+
+# Per-IP and global token buckets for /submit-lead (see rate_limit.py)
+limiter = rate_limit.SubmitRateLimiter()
+
+# Initialize the database and background threads when the app starts, or on the
+# first request in fast-start mode; large-table backfills continue in the background
+if FAST_START:
+    app.before_request(init_db)
+else:
+    with app.app_context():
+        init_db()
 
 @app.route('/submit-lead', methods=['POST'])
 def submit_lead():
-    data = request.get_json()
+    submission = capture.submit(request.remote_addr, request.headers,
+                                lambda: lead_schema.read_limited(request.stream, request.content_length))
+    return submission.body, submission.status, submission.headers
+
+@app.teardown_request
+def reset_db_connection(exc):
+    """Leave this thread's connection clean for the next request"""
+    db.reset_connection(DATABASE)
 
-    required_fields = ['firstName', 'lastName', 'email', 'topic', 'consent']
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    health = {'status': 'healthy', 'timestamp': datetime.now().isoformat(), 'rate_limit': limiter.stats()}
+    if capture.writer is not None:
+        health['group_commit'] = capture.writer.stats()
+    health['lead_store'] = capture.store.stats()
+    if excel_replication_lag is not None:
+        try:
+            health['excel_replication'] = excel_replication_lag(get_db_connection())
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+    return jsonify(health), 200
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Lead counts by topic, UTM, source page and day or week, from the lead store's rollups
+
+    Query parameters:
+      since, until         inclusive day range (YYYY-MM-DD)
+      bucket               day (default) or week
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO leads (
-                first_name, last_name, email, company, role, phone, topic, notes, consent,
-                source_page, utm_source, utm_medium, utm_campaign, utm_term, utm_content, submission_time
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                data['firstName'],
-                data['lastName'],
-                data['email'],
-                data.get('company'),
-                data.get('role'),
-                data.get('phone'),
-                data['topic'],
-                data.get('notes'),
-                1 if data['consent'] else 0, # Convert boolean to integer
-                data.get('sourcePage'),
-                data.get('utmSource'),
-                data.get('utmMedium'),
-                data.get('utmCampaign'),
-                data.get('utmTerm'),
-                data.get('utmContent'),
-                datetime.now().isoformat()
-            )
-        )
-        conn.commit()
-        conn.close()
-
-        # In a real scenario, you would also send emails here
-        # For now, we'll just log that it would happen
-        print(f"Lead submitted: {data['email']}. Confirmation and notification emails would be sent.")
-
-        return jsonify({'message': 'Lead submitted successfully'}), 200
+        return jsonify(capture.store.analytics(request.args)), 200
+    except lead_queries.QueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Database error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus-style request, stage and lead counters for this process"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     # For local development, allow all origins. In production, restrict this.
     from flask_cors import CORS
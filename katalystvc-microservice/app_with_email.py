@@ -1,258 +1,367 @@
-import sqlite3
-import smtplib
+import hmac
 import os
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import Flask, request, jsonify
+import tempfile
+import threading
+import json
+from flask import Flask, Response, request, jsonify, send_file
 from datetime import datetime
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+import db
+import lead_schema
+import lead_search
+import lead_store
+import metrics
+import migrations
+import notification_digest
+import outbox
+import rate_limit
+from smtp_pool import SMTPConnectionPool
+import lead_queries
+from email_templates import build_message
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+metrics.instrument_flask(app)
 
 DATABASE = 'leads.db'
 
+# Largest request body accepted, uploads included; anything bigger gets a 413
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))
+
+# /import-leads is off unless an admin token is set (lead_import.py imports from the
+# command line without one); IMPORT_MAX_ROWS caps the rows taken from one upload
+IMPORT_ADMIN_TOKEN = os.getenv('IMPORT_ADMIN_TOKEN', '')
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '50000'))
+
 # Email configuration - these should be set as environment variables
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
 EMAIL_USER = os.getenv('EMAIL_USER', 'support@katalystvc.com')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD', '')  # App password for Gmail
 INTERNAL_EMAIL = os.getenv('INTERNAL_EMAIL', 'support@katalystvc.com')
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'  # Disable for a local test relay
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '4'))
+SMTP_RATE_LIMIT = os.getenv('SMTP_RATE_LIMIT', '30/minute')  # Outbound sends per process; 0 = unlimited
+
+# Defer schema setup and the background threads from import to the first request
+# (serverless / autoscaled cold starts)
+FAST_START = os.getenv('FAST_START', 'false').lower() == 'true'
+
+# Authenticated SMTP sessions shared by every thread in this process
+smtp_pool = SMTPConnectionPool(SMTP_SERVER, SMTP_PORT, EMAIL_USER, EMAIL_PASSWORD,
+                               use_tls=SMTP_USE_TLS, max_size=SMTP_POOL_SIZE, send_rate=SMTP_RATE_LIMIT)
+
+# Per-IP and global token buckets for /submit-lead (see rate_limit.py)
+limiter = rate_limit.SubmitRateLimiter()
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """This thread's pooled connection (see db.py); don't close it"""
+    return db.get_connection(DATABASE)
+
+# Set up by init_db(): the /submit-lead path (lead_capture.py) into the LEAD_STORE
+# backend (lead_store.py), with its optional group-commit writer (one thread
+# batching concurrent inserts) and, for LEAD_STORE=fanout, the copier that puts
+# committed leads into the Excel workbook in ID order without submissions
+# waiting for it; and where lead_replicator.py does that copy instead, its lag.
+# The email outbox and dedupe keys stay in leads.db whichever store holds the leads.
+capture = None
+excel_replication_lag = None
+service_ready = False
+service_lock = threading.Lock()
 
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS leads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            company TEXT,
-            role TEXT,
-            phone TEXT,
-            topic TEXT NOT NULL,
-            notes TEXT,
-            consent INTEGER NOT NULL,
-            source_page TEXT,
-            utm_source TEXT,
-            utm_medium TEXT,
-            utm_campaign TEXT,
-            utm_term TEXT,
-            utm_content TEXT,
-            submission_time TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """Bring leads.db up to the current schema, open the lead store and start the background threads, once per process"""
+    global capture, excel_replication_lag, service_ready
+    if service_ready:
+        return
+    with service_lock:
+        if service_ready:
+            return
+        # Only needed here, so a fast-start import doesn't load them
+        import group_commit
+        import lead_capture
+        import lead_replicator
+        migrations.migrate(get_db_connection())
+        capture = lead_capture.LeadCapture(lead_store.open_store(lead_store.LEAD_STORE, DATABASE), limiter,
+                                           database=DATABASE, internal_email=INTERNAL_EMAIL if EMAIL_PASSWORD else None,
+                                           on_stored=lead_stored)
+        if group_commit.GROUP_COMMIT_ENABLED:
+            capture.start_group_commit()
+        if isinstance(capture.store, lead_store.FanoutStore):
+            capture.store.start()
+        if lead_replicator.REPLICATOR_ENABLED:
+            lead_replicator.register_metrics(DATABASE)
+            excel_replication_lag = lead_replicator.replication_lag
+        # Last, with every connection open: a backfill's finish step changes the schema
+        migrations.ensure_migrated(DATABASE)
+        if EMAIL_PASSWORD:
+            outbox.start_workers(DATABASE, deliver_email)
+            if notification_digest.DIGEST_ENABLED:
+                notification_digest.start_flusher(DATABASE, INTERNAL_EMAIL)
+        service_ready = True
+
+def deliver_email(to_email, subject, body, is_html=False, html_body=None):
+    """Send an email using SMTP, raising on failure (used by the outbox workers)"""
+    text = build_message(EMAIL_USER, to_email, subject, body, is_html, html_body).as_string()
+    try:
+        with metrics.stage('smtp_send'):
+            smtp_pool.sendmail(EMAIL_USER, to_email, text)
+    except Exception:
+        metrics.EMAIL_FAILURES.inc()
+        raise
+    metrics.EMAILS_SENT.inc()
 
-def send_email(to_email, subject, body, is_html=False):
+def send_email(to_email, subject, body, is_html=False, html_body=None):
     """Send an email using SMTP"""
     try:
-        msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        if is_html:
-            msg.attach(MIMEText(body, 'html'))
-        else:
-            msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_USER, to_email, text)
-        server.quit()
+        deliver_email(to_email, subject, body, is_html, html_body)
         return True
     except Exception as e:
         print(f"Email sending failed: {e}")
         return False
 
-def get_confirmation_email_template(first_name, topic):
-    """Generate confirmation email for the user"""
-    topic_mapping = {
-        'infra': 'AI-Ready Infrastructure Audit',
-        'fhir': 'FHIR/TEFCA 90-Day Sprint'
-    }
-    
-    topic_display = topic_mapping.get(topic, topic)
-    download_link = f"https://katalystvc.com/downloads/{topic}-brief.html"
-    
-    subject = "Your KatalystVC Inquiry Has Been Received - What's Next?"
-    
-    body = f"""Dear {first_name},
-
-Thank you for reaching out to KatalystVC. We've successfully received your inquiry regarding {topic_display}.
-
-We appreciate your interest in our specialized technical consulting services. Our team is currently reviewing your submission and will get back to you within 24-48 business hours to schedule your 20-minute diagnostic session.
-
-In the meantime, you can access your requested marketing brief here:
-{download_link}
-
-We look forward to connecting with you and exploring how KatalystVC can help you achieve your technical objectives with tight, efficient, and smart solutions.
-
-Best regards,
-
-The KatalystVC Team
-support@katalystvc.com"""
-    
-    return subject, body
-
-def get_internal_notification_template(lead_data):
-    """Generate internal notification email for the team"""
-    subject = f"NEW KatalystVC Lead: {lead_data['first_name']} {lead_data['last_name']} - {lead_data['topic']}"
-    
-    body = f"""Hello Team,
-
-A new lead has been submitted via the KatalystVC website. Please find the details below:
-
-**Lead Information:**
-• Name: {lead_data['first_name']} {lead_data['last_name']}
-• Email: {lead_data['email']}
-• Company: {lead_data.get('company', 'N/A')}
-• Role: {lead_data.get('role', 'N/A')}
-• Phone: {lead_data.get('phone', 'N/A')}
-• Topic of Interest: {lead_data['topic']}
-• Notes/Message: {lead_data.get('notes', 'N/A')}
-• Consent to Contact: {'Yes' if lead_data['consent'] else 'No'}
-
-**Tracking Information:**
-• Submission Date: {lead_data['submission_time']}
-• Source Page: {lead_data.get('source_page', 'N/A')}
-• UTM Source: {lead_data.get('utm_source', 'N/A')}
-• UTM Medium: {lead_data.get('utm_medium', 'N/A')}
-• UTM Campaign: {lead_data.get('utm_campaign', 'N/A')}
-• UTM Term: {lead_data.get('utm_term', 'N/A')}
-• UTM Content: {lead_data.get('utm_content', 'N/A')}
-
-**Action Required:**
-• Follow up with the lead within 24-48 business hours.
-• Lead ID in database: {lead_data.get('id', 'TBD')}
-
-Best regards,
-
-KatalystVC Automated System"""
-    
-    return subject, body
-
-# Initialize the database when the app starts
-with app.app_context():
-    init_db()
+def lead_stored(submission):
+    """After each new lead: wake the outbox workers for its queued emails"""
+    lead_id = submission.record['lead_id']
+    if EMAIL_PASSWORD:
+        outbox.notify()
+        print(f"Lead {lead_id} submitted. Confirmation and internal emails queued.")
+    else:
+        print(f"Lead {lead_id} submitted. Email credentials not configured - emails not sent.")
+
+# Initialize the database and background threads when the app starts, or on the
+# first request in fast-start mode; large-table backfills continue in the background
+if FAST_START:
+    app.before_request(init_db)
+else:
+    with app.app_context():
+        init_db()
 
 @app.route('/submit-lead', methods=['POST'])
 def submit_lead():
-    data = request.get_json()
+    submission = capture.submit(request.remote_addr, request.headers,
+                                lambda: lead_schema.read_limited(request.stream, request.content_length))
+    return submission.body, submission.status, submission.headers
+
+def read_leads(sql, params, args, limit):
+    """Rows for a /leads query: a cursor on leads.db, or, with a LEAD_STORE that has no leads table, its matching leads"""
+    if capture.sqlite is not None:
+        return get_db_connection().execute(sql, params)
+    return [lead_store.lead_row(record) for record in capture.store.query(args, limit)]
 
-    required_fields = ['firstName', 'lastName', 'email', 'topic', 'consent']
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
+def stream_leads_ndjson(sql, params, fields, args):
+    """Yield matching leads as newline-delimited JSON straight off the cursor"""
+    for row in read_leads(sql, params, args, None):
+        yield json.dumps({field: row[field] for field in fields}) + '\n'
 
+@app.route('/leads', methods=['GET'])
+def get_leads():
+    """Get leads from the lead store, newest first (for admin purposes)
+
+    Query parameters:
+      limit, after         keyset pagination; the next cursor is in X-Next-Cursor
+      topic, utm_source,
+      utm_campaign         equality filters
+      email                address, ignoring case and surrounding spaces
+      since, until         submission_time range (ISO 8601)
+      fields               comma-separated column projection
+      format=ndjson        stream every matching row as NDJSON (limit optional)
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO leads (
-                first_name, last_name, email, company, role, phone, topic, notes, consent,
-                source_page, utm_source, utm_medium, utm_campaign, utm_term, utm_content, submission_time
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                data['firstName'],
-                data['lastName'],
-                data['email'],
-                data.get('company'),
-                data.get('role'),
-                data.get('phone'),
-                data['topic'],
-                data.get('notes'),
-                1 if data['consent'] else 0,
-                data.get('sourcePage'),
-                data.get('utmSource'),
-                data.get('utmMedium'),
-                data.get('utmCampaign'),
-                data.get('utmTerm'),
-                data.get('utmContent'),
-                datetime.now().isoformat()
-            )
-        )
-        
-        # Get the ID of the inserted record
-        lead_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-
-        # Prepare lead data for email templates
-        lead_data = {
-            'id': lead_id,
-            'first_name': data['firstName'],
-            'last_name': data['lastName'],
-            'email': data['email'],
-            'company': data.get('company'),
-            'role': data.get('role'),
-            'phone': data.get('phone'),
-            'topic': data['topic'],
-            'notes': data.get('notes'),
-            'consent': data['consent'],
-            'source_page': data.get('sourcePage'),
-            'utm_source': data.get('utmSource'),
-            'utm_medium': data.get('utmMedium'),
-            'utm_campaign': data.get('utmCampaign'),
-            'utm_term': data.get('utmTerm'),
-            'utm_content': data.get('utmContent'),
-            'submission_time': datetime.now().isoformat()
-        }
-
-        # Send confirmation email to user
-        if EMAIL_PASSWORD:  # Only send emails if credentials are configured
-            conf_subject, conf_body = get_confirmation_email_template(data['firstName'], data['topic'])
-            user_email_sent = send_email(data['email'], conf_subject, conf_body)
-            
-            # Send internal notification email
-            int_subject, int_body = get_internal_notification_template(lead_data)
-            internal_email_sent = send_email(INTERNAL_EMAIL, int_subject, int_body)
-            
-            print(f"Lead {lead_id} submitted. User email sent: {user_email_sent}, Internal email sent: {internal_email_sent}")
+        fields = lead_queries.parse_fields(request.args.get('fields'))
+        streaming = request.args.get('format') == 'ndjson'
+        if streaming:
+            limit = request.args.get('limit')
+            limit = lead_queries.parse_limit(limit) if limit else None
         else:
-            print(f"Lead {lead_id} submitted. Email credentials not configured - emails not sent.")
+            limit = lead_queries.parse_limit(request.args.get('limit'))
+        sql, params = lead_queries.build_page_query(request.args, fields, limit, lookahead=not streaming)
+    except lead_queries.QueryError as e:
+        return jsonify({'error': str(e)}), 400
 
-        return jsonify({
-            'message': 'Lead submitted successfully',
-            'lead_id': lead_id
-        }), 200
+    if streaming:
+        return Response(stream_leads_ndjson(sql, params, fields, request.args), mimetype='application/x-ndjson')
+
+    try:
+        rows = list(read_leads(sql, params, request.args, limit + 1))
         
+        leads_list = [{field: row[field] for field in fields} for row in rows[:limit]]
+        
+        response = jsonify(leads_list)
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            response.headers['X-Next-Cursor'] = lead_queries.encode_cursor(last['submission_time'], last['id'])
+        return response, 200
     except Exception as e:
         print(f"Database error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/leads', methods=['GET'])
-def get_leads():
-    """Get all leads from the database (for admin purposes)"""
+@app.route('/leads/search', methods=['GET'])
+def search_leads():
+    """Full-text search over lead notes, company and role, best matches first
+
+    Query parameters:
+      q                    words (all must match), "phrases" and prefix* terms
+      limit, offset        page size and position in the ranking
+      topic, utm_source,
+      utm_campaign, email,
+      since, until, fields same as /leads
+    """
+    if capture.sqlite is None:
+        return jsonify({'error': f'Search needs the leads table; LEAD_STORE={capture.store.name} has none'}), 501
     try:
-        conn = get_db_connection()
-        leads = conn.execute('SELECT * FROM leads ORDER BY submission_time DESC').fetchall()
-        conn.close()
-        
-        leads_list = []
-        for lead in leads:
-            leads_list.append(dict(lead))
-        
-        return jsonify(leads_list), 200
+        sql, params, fields = lead_search.parse_search_args(request.args)
+    except lead_queries.QueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        rows = get_db_connection().execute(sql, params).fetchall()
+        return jsonify([lead_search.hit(row, fields) for row in rows]), 200
     except Exception as e:
         print(f"Database error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/leads/export', methods=['GET'])
+def export_leads():
+    """Export every lead matching the /leads filters, streamed from the database in chunks
+
+    Query parameters:
+      format               csv (default, streamed as it is written), xlsx or parquet
+      topic, utm_source,
+      utm_campaign, email,
+      since, until, fields same as /leads
+    """
+    import lead_export
+    fmt = request.args.get('format', 'csv')
+    try:
+        if fmt not in lead_export.FORMATS:
+            raise lead_queries.QueryError(f"format must be one of: {', '.join(lead_export.FORMATS)}")
+        fields = lead_queries.parse_fields(request.args.get('fields'))
+        sql, params = lead_export.build_export_query(request.args, fields)
+    except lead_queries.QueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = f'katalystvc_leads.{fmt}'
+    if capture.sqlite is not None:
+        chunks = lead_export.iter_chunks(get_db_connection(), sql, params)
+    else:
+        chunks = lead_export.iter_record_chunks(reversed(capture.store.query(request.args, None)), fields)
+    if fmt == 'csv':
+        return Response(lead_export.csv_stream(chunks, fields), mimetype=lead_export.FORMATS[fmt],
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+    # Zip containers and Parquet footers can't be streamed; spool to an anonymous temp file
+    spool = tempfile.TemporaryFile()
+    try:
+        lead_export.WRITERS[fmt](chunks, fields, spool)
+    except lead_export.ExportError as e:
+        spool.close()
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        spool.close()
+        print(f"Database error: {e}")
+        return jsonify({'error': str(e)}), 500
+    spool.seek(0)
+    return send_file(spool, mimetype=lead_export.FORMATS[fmt], as_attachment=True, download_name=filename)
+
+@app.teardown_request
+def reset_db_connection(exc):
+    """Leave this thread's connection clean for the next request"""
+    db.reset_connection(DATABASE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()}), 200
+    health = {
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'smtp_pool': smtp_pool.stats(),
+        'rate_limit': limiter.stats()
+    }
+    if capture.writer is not None:
+        health['group_commit'] = capture.writer.stats()
+    health['lead_store'] = capture.store.stats()
+    try:
+        conn = get_db_connection()
+        health['email_outbox'] = outbox.outbox_stats(conn)
+        health['search_index'] = lead_search.backfill_status(conn)
+        health['schema_version'] = migrations.schema_version(conn)
+        if excel_replication_lag is not None:
+            health['excel_replication'] = excel_replication_lag(conn)
+        if notification_digest.DIGEST_ENABLED:
+            waiting, age = notification_digest.pending(conn)
+            health['internal_digest'] = {'pending_leads': waiting, 'oldest_seconds': round(age, 1)}
+    except Exception as e:
+        print(f"Database error: {e}")
+    return jsonify(health), 200
+
+@app.route('/import-leads', methods=['POST'])
+def import_leads():
+    """Bulk-import leads from an NDJSON or CSV upload
+
+    Needs the IMPORT_ADMIN_TOKEN as a bearer token (Authorization: Bearer ...);
+    with no token configured the endpoint is off. Send the file as the raw
+    request body (Content-Type application/x-ndjson or text/csv, or
+    ?format=ndjson|csv) or as a multipart "file" field, up to MAX_CONTENT_LENGTH
+    bytes and IMPORT_MAX_ROWS rows. Rows are validated and inserted as they
+    stream in; the response lists rejected rows. Confirmation emails are only
+    queued (at a throttled rate) with ?emails=true.
+    """
+    import lead_import
+    if not IMPORT_ADMIN_TOKEN:
+        return jsonify({'error': 'Bulk import over HTTP is disabled; use lead_import.py'}), 403
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(authorization, f'Bearer {IMPORT_ADMIN_TOKEN}'.encode('utf-8')):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            stream, filename, content_type = upload.stream, upload.filename, upload.content_type
+        else:
+            stream, filename, content_type = request.stream, None, request.content_type
+        fmt = request.args.get('format') or lead_import.detect_format(filename, content_type)
+        if fmt not in ('ndjson', 'csv'):
+            return jsonify({'error': 'Upload NDJSON or CSV (set Content-Type or ?format=ndjson|csv)'}), 400
+
+        send_emails = bool(EMAIL_PASSWORD) and request.args.get('emails', 'false').lower() == 'true'
+        report = lead_import.import_leads(
+            get_db_connection(), lead_import.iter_rows(stream, fmt), max_rows=IMPORT_MAX_ROWS,
+            send_emails=send_emails, internal_email=INTERNAL_EMAIL, source=filename or f'{fmt} upload',
+            store=None if capture.sqlite is not None else capture.store
+        )
+    except lead_import.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'error': f"Upload is larger than {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+    except Exception as e:
+        print(f"Database error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    print(f"Bulk import: {report['imported']} leads imported, {report['rejected']} rejected")
+    return jsonify(report), 200
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Lead counts by topic, UTM, source page and day or week, from the lead store's rollups
+
+    Query parameters:
+      since, until         inclusive day range (YYYY-MM-DD)
+      bucket               day (default) or week
+    """
+    try:
+        return jsonify(capture.store.analytics(request.args)), 200
+    except lead_queries.QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Database error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus-style request, stage, lead and email counters for this process"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     print("KatalystVC CRM Microservice starting...")
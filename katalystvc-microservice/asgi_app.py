@@ -0,0 +1,443 @@
+"""
+KatalystVC CRM Microservice (asyncio variant)
+An ASGI entry point with the same /submit-lead, /leads, /leads/search, /health, /stats and /metrics
+contract as app_with_email.py, built on Starlette, aiosqlite and aiosmtplib so
+a single process can hold thousands of in-flight submissions without a thread
+per request. It shares leads.db (schema, outbox table, queries) with the Flask
+service, so both can run side by side:
+
+    gunicorn -w 2 app_with_email:app            # existing Flask service
+    uvicorn asgi_app:app --port 5001            # asyncio service
+
+Requires: starlette, aiosqlite, aiosmtplib, uvicorn
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+from datetime import datetime
+
+import aiosmtplib
+import aiosqlite
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import db
+import lead_capture
+import lead_dedupe
+import lead_queries
+import lead_schema
+import lead_search
+import lead_stats
+import lead_store
+import metrics
+import migrations
+import notification_digest
+import outbox
+import rate_limit
+from email_templates import build_message
+
+DATABASE = os.getenv('DATABASE', 'leads.db')
+
+# Email configuration - these should be set as environment variables
+SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+EMAIL_USER = os.getenv('EMAIL_USER', 'support@katalystvc.com')
+EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD', '')  # App password for Gmail
+INTERNAL_EMAIL = os.getenv('INTERNAL_EMAIL', 'support@katalystvc.com')
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'  # Disable for a local test relay
+SMTP_RATE_LIMIT = os.getenv('SMTP_RATE_LIMIT', '30/minute')  # Outbound sends per process; 0 = unlimited
+ASYNC_DB_READERS = int(os.getenv('ASYNC_DB_READERS', '4'))
+
+ROUTE_PATHS = {'/submit-lead', '/leads', '/leads/search', '/health', '/stats', '/metrics'}
+
+
+class AsyncLeadStore:
+    """SQLite access for the event loop.
+
+    Submissions go through lead_capture, which hands SQLite inserts to a
+    group_commit.GroupCommitWriter and awaits its futures, so a whole burst
+    costs one transaction and one thread hop per lead rather than a hop per
+    statement. Reads use a few aiosqlite connections, which WAL lets run
+    alongside the writer.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.readers = []
+        self._next_reader = 0
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.database, timeout=db.DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute('PRAGMA journal_mode=WAL')
+        await conn.execute('PRAGMA synchronous=NORMAL')
+        await conn.execute(f'PRAGMA busy_timeout={db.DB_BUSY_TIMEOUT_MS}')
+        await conn.execute(f'PRAGMA mmap_size={db.DB_MMAP_SIZE}')
+        return conn
+
+    async def open(self):
+        await asyncio.to_thread(init_db)
+        await asyncio.to_thread(capture.start_group_commit)
+        if isinstance(capture.store, lead_store.FanoutStore):
+            capture.store.start()
+        self.readers = [await self._connect() for _ in range(ASYNC_DB_READERS)]
+        # Only once every connection is open: a backfill's finish step changes the schema
+        await asyncio.to_thread(migrations.start_backfills, self.database)
+
+    async def close(self):
+        for conn in self.readers:
+            await conn.close()
+
+    def reader(self):
+        self._next_reader = (self._next_reader + 1) % len(self.readers)
+        return self.readers[self._next_reader]
+
+    async def find_duplicate(self, keys):
+        """lead_dedupe.find_duplicate on a reader connection."""
+        if not keys:
+            return None
+        lead_id = lead_dedupe.recent.get(keys.lookup)
+        if lead_id is not None:
+            return lead_id
+        sql, params = lead_dedupe.lookup_query(keys)
+        async with self.reader().execute(sql, params) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        lead_dedupe.remember(keys, row[0])
+        return row[0]
+
+
+class AsyncOutboxSender:
+    """Drains email_outbox with aiosmtplib, keeping one SMTP session per task."""
+
+    def __init__(self, store, workers=outbox.OUTBOX_WORKERS):
+        self.store = store
+        self.workers = workers
+        self.wakeup = asyncio.Event()
+        self.throttle = rate_limit.make_buckets(SMTP_RATE_LIMIT, database='')
+        self._claim_lock = asyncio.Lock()
+        self._tasks = []
+        self.conn = None
+
+    async def start(self):
+        self.conn = await self.store._connect()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self.conn is not None:
+            await self.conn.close()
+
+    async def _claim(self):
+        async with self._claim_lock:
+            now = time.time()
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                async with self.conn.execute(outbox.SELECT_DUE_SQL, (outbox.PENDING, now, outbox.SENDING, now)) as cursor:
+                    row = await cursor.fetchone()
+                if row is not None:
+                    await self.conn.execute(outbox.LEASE_SQL, (outbox.SENDING, now + outbox.OUTBOX_LEASE_SECONDS, row['id']))
+                await self.conn.execute('COMMIT')
+            except Exception:
+                await self.conn.execute('ROLLBACK')
+                raise
+            return row
+
+    async def _record(self, sql, params):
+        # Shares the claim connection, so keep it out of any open claim transaction
+        async with self._claim_lock:
+            await self.conn.execute(sql, params)
+
+    async def _connect_smtp(self):
+        smtp = aiosmtplib.SMTP(hostname=SMTP_SERVER, port=SMTP_PORT, start_tls=SMTP_USE_TLS, timeout=30)
+        await smtp.connect()
+        if smtp.supports_extension('auth'):
+            await smtp.login(EMAIL_USER, EMAIL_PASSWORD)
+        return smtp
+
+    async def _run(self):
+        smtp = None
+        while True:
+            try:
+                row = await self._claim()
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                row = None
+            if row is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), outbox.OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            msg = build_message(EMAIL_USER, row['to_email'], row['subject'], row['body'],
+                                bool(row['is_html']), row['html_body'])
+
+            if self.throttle is not None:
+                delay = self.throttle.reserve('smtp')
+                if delay > 0:
+                    # Over the send rate: the message waits its turn instead of failing
+                    metrics.STAGE_SECONDS.observe(delay, stage='smtp_rate_wait')
+                    await asyncio.sleep(delay)
+
+            attempts = row['attempts'] + 1
+            start = time.perf_counter()
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect_smtp()
+                await smtp.send_message(msg)
+            except Exception as e:
+                smtp = None
+                metrics.EMAIL_FAILURES.inc()
+                if attempts >= outbox.OUTBOX_MAX_ATTEMPTS:
+                    await self._record(outbox.MARK_DEAD_SQL, (outbox.DEAD, str(e), row['id']))
+                    print(f"Outbox message {row['id']} dead after {attempts} attempts: {e}")
+                else:
+                    retry_at = time.time() + outbox.backoff_delay(attempts)
+                    await self._record(outbox.MARK_RETRY_SQL, (outbox.PENDING, str(e), retry_at, row['id']))
+                    print(f"Outbox message {row['id']} failed (attempt {attempts}), will retry: {e}")
+            else:
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage='smtp_send')
+                metrics.EMAILS_SENT.inc()
+                await self._record(outbox.MARK_SENT_SQL, (outbox.SENT, datetime.now().isoformat(), row['id']))
+
+
+def init_db():
+    """Bring the shared schema up to date (same as app_with_email.init_db)."""
+    conn = db.connect(DATABASE)
+    migrations.migrate(conn)
+    db.close(conn)
+
+
+store = AsyncLeadStore(DATABASE)
+sender = AsyncOutboxSender(store)
+# In memory this is a few microseconds; with RATE_LIMIT_DB it is one UPSERT (busy timeout 50 ms)
+limiter = rate_limit.SubmitRateLimiter()
+
+
+def lead_stored(submission):
+    """After each new lead: wake the outbox sender for its queued emails."""
+    if EMAIL_PASSWORD:
+        sender.wakeup.set()
+
+
+# The /submit-lead path into the LEAD_STORE backend; the email outbox stays in DATABASE
+capture = lead_capture.LeadCapture(lead_store.open_store(lead_store.LEAD_STORE, DATABASE), limiter,
+                                   database=DATABASE, internal_email=INTERNAL_EMAIL if EMAIL_PASSWORD else None,
+                                   on_stored=lead_stored)
+
+
+class RequestTimingMiddleware:
+    """ASGI counterpart of metrics.instrument_flask."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = scope['path'] if scope['path'] in ROUTE_PATHS else 'unmatched'
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                            method=scope['method'], status=str(status))
+
+
+async def read_limited_body(request, max_bytes=lead_schema.LEAD_MAX_BODY_BYTES):
+    """The request body, refusing anything over max_bytes without buffering the rest."""
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise lead_schema.PayloadTooLarge(f'Request body must be at most {max_bytes} bytes')
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise lead_schema.PayloadTooLarge(f'Request body must be at most {max_bytes} bytes')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def submit_lead(request):
+    submission = await capture.submit_async(request.client.host if request.client else None, request.headers,
+                                            lambda: read_limited_body(request), store.find_duplicate)
+    return JSONResponse(submission.body, status_code=submission.status, headers=submission.headers)
+
+
+async def stream_leads_ndjson(sql, params, fields):
+    async with store.reader().execute(sql, params) as cursor:
+        async for row in cursor:
+            yield json.dumps({field: row[field] for field in fields}) + '\n'
+
+
+async def get_leads(request):
+    """Same query parameters and response shape as app_with_email.get_leads."""
+    args = request.query_params
+    try:
+        fields = lead_queries.parse_fields(args.get('fields'))
+        streaming = args.get('format') == 'ndjson'
+        if streaming:
+            limit = lead_queries.parse_limit(args.get('limit')) if args.get('limit') else None
+        else:
+            limit = lead_queries.parse_limit(args.get('limit'))
+        sql, params = lead_queries.build_page_query(args, fields, limit, lookahead=not streaming)
+    except lead_queries.QueryError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    if capture.sqlite is None:
+        # No leads table in this LEAD_STORE: the store scans for matches in a worker thread
+        try:
+            records = await asyncio.to_thread(capture.store.query, args, None if streaming else limit + 1)
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+        rows = [lead_store.lead_row(record) for record in records]
+        if streaming:
+            return StreamingResponse((json.dumps({field: row[field] for field in fields}) + '\n' for row in rows),
+                                     media_type='application/x-ndjson')
+    elif streaming:
+        return StreamingResponse(stream_leads_ndjson(sql, params, fields), media_type='application/x-ndjson')
+    else:
+        try:
+            async with store.reader().execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    headers = {}
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        headers['X-Next-Cursor'] = lead_queries.encode_cursor(last['submission_time'], last['id'])
+    return JSONResponse([{field: row[field] for field in fields} for row in rows[:limit]], headers=headers)
+
+
+async def search_leads(request):
+    """Same query parameters and response shape as app_with_email.search_leads."""
+    if capture.sqlite is None:
+        return JSONResponse({'error': f'Search needs the leads table; LEAD_STORE={capture.store.name} has none'},
+                            status_code=501)
+    try:
+        sql, params, fields = lead_search.parse_search_args(request.query_params)
+    except lead_queries.QueryError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    try:
+        async with store.reader().execute(sql, params) as cursor:
+            rows = await cursor.fetchall()
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+    return JSONResponse([lead_search.hit(row, fields) for row in rows])
+
+
+async def health_check(request):
+    health = {
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'in_flight_submissions': capture.in_flight,
+        'rate_limit': limiter.stats(),
+        'lead_store': capture.store.stats()
+    }
+    if capture.writer is not None:
+        health['group_commit'] = capture.writer.stats()
+    try:
+        async with store.reader().execute(outbox.STATS_SQL) as cursor:
+            rows = await cursor.fetchall()
+        stats = {outbox.PENDING: 0, outbox.SENDING: 0, outbox.SENT: 0, outbox.DEAD: 0}
+        stats.update({row['status']: row['n'] for row in rows})
+        health['email_outbox'] = stats
+        async with store.reader().execute(lead_search.STATUS_SQL) as cursor:
+            row = await cursor.fetchone()
+        health['search_index'] = lead_search.status_from_row(row)
+        async with store.reader().execute('PRAGMA user_version') as cursor:
+            health['schema_version'] = (await cursor.fetchone())[0]
+        if notification_digest.DIGEST_ENABLED:
+            async with store.reader().execute(notification_digest.PENDING_SQL) as cursor:
+                waiting, oldest = await cursor.fetchone()
+            health['internal_digest'] = {'pending_leads': waiting,
+                                         'oldest_seconds': round(time.time() - oldest, 1) if oldest else 0.0}
+    except Exception as e:
+        print(f"Database error: {e}")
+    return JSONResponse(health)
+
+
+async def get_stats(request):
+    """Same query parameters and response shape as app_with_email.get_stats."""
+    args = request.query_params
+    try:
+        since, until, bucket = lead_stats.parse_stats_args(args)
+    except lead_queries.QueryError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    if capture.sqlite is None:
+        try:
+            return JSONResponse(await asyncio.to_thread(capture.store.analytics, args))
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    try:
+        reader = store.reader()
+        results = []
+        for sql, params in lead_stats.build_stats_queries(since, until, bucket):
+            async with reader.execute(sql, params) as cursor:
+                results.append([tuple(row) for row in await cursor.fetchall()])
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+    by_dimension, by_period, total = results
+    stats = lead_stats.build_stats(by_dimension, by_period, since, until, bucket)
+    stats['total_leads'] = total[0][0]
+    return JSONResponse(stats)
+
+
+async def get_metrics(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await store.open()
+    if EMAIL_PASSWORD:
+        await sender.start()
+        if notification_digest.DIGEST_ENABLED:
+            loop = asyncio.get_running_loop()
+            notification_digest.start_flusher(DATABASE, INTERNAL_EMAIL,
+                                              on_flush=lambda: loop.call_soon_threadsafe(sender.wakeup.set))
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(notification_digest.stop_flusher)
+        await sender.stop()
+        await store.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/submit-lead', submit_lead, methods=['POST']),
+        Route('/leads', get_leads, methods=['GET']),
+        Route('/leads/search', search_leads, methods=['GET']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/stats', get_stats, methods=['GET']),
+        Route('/metrics', get_metrics, methods=['GET'])
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+                Middleware(RequestTimingMiddleware)],
+    lifespan=lifespan
+)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Cold-start time of the Flask services, with and without FAST_START.
+Starts each service in a fresh interpreter (python -X importtime) against a
+database or journal that already exists, as a new serverless or autoscaled
+instance would, and times importing the app and serving its first
+/submit-lead through the test client. The -X importtime log gives the import
+cost of Flask and the other frameworks, which the services can't avoid, so
+the report also shows the services' own share (our modules plus startup
+work and the first request), the number the 100 ms target applies to. Also
+lists which heavy modules (openpyxl, smtplib, email.mime) were loaded before
+the first request. Reports medians of --runs cold starts.
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--services app,app_with_email,app_secure]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    'app': ROOT,
+    'app_with_email': ROOT,
+    'app_secure': os.path.join(ROOT, 'katalystvc-excel-api')
+}
+# Imported by the services but not ours to make faster
+FRAMEWORKS = ('flask', 'flask_cors', 'dotenv')
+# (ssl and email.utils are not listed: Werkzeug's http.client import loads them)
+HEAVY_MODULES = ('openpyxl', 'numpy', 'smtplib', 'email.mime', 'getpass')
+TARGET_MS = 100
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {path!r})
+import {module} as service
+imported = time.perf_counter()
+loaded = set(sys.modules)
+response = service.app.test_client().post('/submit-lead', json={payload!r})
+served = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'first_request_ms': (served - imported) * 1000,
+                  'status': response.status_code, 'loaded': sorted(loaded)}}))
+'''
+
+PAYLOAD = {
+    'firstName': 'Avery', 'lastName': 'Tester', 'email': 'avery.tester@example.com', 'company': 'Northwind Health',
+    'role': 'cto', 'phone': '', 'topic': 'infra', 'notes': 'Looking at a Q3 go-live.', 'consent': True,
+    'sourcePage': '/infra', 'utmSource': 'linkedin', 'utmMedium': 'cpc', 'utmCampaign': 'q1-infra'
+}
+
+
+def framework_ms(importtime_log):
+    """Cumulative import time (ms) of FRAMEWORKS in a -X importtime log.
+
+    Each is counted where it was first imported, which is where its cost was
+    paid, whichever of the service's modules imported it.
+    """
+    seen = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name in FRAMEWORKS and name not in seen:
+            seen[name] = int(cumulative)
+    return sum(seen.values()) / 1000
+
+
+def cold_start(module, workdir, fast_start):
+    env = dict(os.environ, FAST_START='true' if fast_start else 'false', EMAIL_PASSWORD='',
+               PYTHONDONTWRITEBYTECODE='1')
+    child = CHILD.format(path=SERVICES[module], module=module, payload=PAYLOAD)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', child], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    wall = (time.perf_counter() - start) * 1000
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['wall_ms'] = wall
+    report['framework_ms'] = framework_ms(result.stderr)
+    return report
+
+
+def interpreter_ms(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def measure(module, fast_start, runs):
+    workdir = tempfile.mkdtemp(prefix=f'katalystvc-cold-{module}-')
+    cold_start(module, workdir, fast_start)  # Creates the database or journal; not timed
+    samples = [cold_start(module, workdir, fast_start) for _ in range(runs)]
+
+    def median(key):
+        return round(statistics.median(sample[key] for sample in samples), 1)
+
+    to_first_request = [sample['import_ms'] + sample['first_request_ms'] for sample in samples]
+    own = [total - sample['framework_ms'] for total, sample in zip(to_first_request, samples)]
+    loaded = samples[-1]['loaded']
+    return {
+        'process_wall_ms': median('wall_ms'),
+        'import_ms': median('import_ms'),
+        'first_request_ms': median('first_request_ms'),
+        'to_first_request_ms': round(statistics.median(to_first_request), 1),
+        'framework_import_ms': median('framework_ms'),
+        'own_ms': round(statistics.median(own), 1),
+        'meets_target': statistics.median(own) < TARGET_MS,
+        'heavy_modules_at_startup': [name for name in HEAVY_MODULES if name in loaded],
+        'first_request_status': samples[-1]['status']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--services', default=','.join(SERVICES))
+    args = parser.parse_args()
+
+    report = {'runs': args.runs, 'target_ms': TARGET_MS, 'interpreter_ms': interpreter_ms(args.runs)}
+    for module in args.services.split(','):
+        report[module] = {mode: measure(module, mode == 'fast_start', args.runs)
+                          for mode in ('default', 'fast_start')}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
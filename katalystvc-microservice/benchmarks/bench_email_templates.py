@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Email rendering cost per lead.
+Renders the confirmation and internal notification emails for --leads
+synthetic leads with the original per-call f-string functions (text only,
+topic_mapping rebuilt every call) and with the compiled templates in
+email_templates (text only, text + HTML, and text + HTML plus building the
+multipart MIME message that goes over SMTP). Also times the template-set load
+and the hot-reload mtime check.
+
+Usage: python benchmarks/bench_email_templates.py [--leads 20000] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import email_templates  # noqa: E402
+
+TOPICS = ['infra', 'fhir', 'both', 'consolidation-divestiture', 'partnership']
+
+
+def legacy_confirmation(first_name, topic):
+    """The pre-template implementation, kept here as the baseline."""
+    topic_mapping = {
+        'infra': 'AI-Ready Infrastructure Audit',
+        'fhir': 'FHIR/TEFCA 90-Day Sprint'
+    }
+    topic_display = topic_mapping.get(topic, topic)
+    download_link = f"https://katalystvc.com/downloads/{topic}-brief.html"
+    subject = "Your KatalystVC Inquiry Has Been Received - What's Next?"
+    body = f"""Dear {first_name},
+
+Thank you for reaching out to KatalystVC. We've successfully received your inquiry regarding {topic_display}.
+
+We appreciate your interest in our specialized technical consulting services. Our team is currently reviewing your submission and will get back to you within 24-48 business hours to schedule your 20-minute diagnostic session.
+
+In the meantime, you can access your requested marketing brief here:
+{download_link}
+
+We look forward to connecting with you and exploring how KatalystVC can help you achieve your technical objectives with tight, efficient, and smart solutions.
+
+Best regards,
+
+The KatalystVC Team
+support@katalystvc.com"""
+    return subject, body
+
+
+def legacy_internal(lead_data):
+    subject = f"NEW KatalystVC Lead: {lead_data['first_name']} {lead_data['last_name']} - {lead_data['topic']}"
+    body = f"""Hello Team,
+
+A new lead has been submitted via the KatalystVC website. Please find the details below:
+
+**Lead Information:**
+• Name: {lead_data['first_name']} {lead_data['last_name']}
+• Email: {lead_data['email']}
+• Company: {lead_data.get('company', 'N/A')}
+• Role: {lead_data.get('role', 'N/A')}
+• Phone: {lead_data.get('phone', 'N/A')}
+• Topic of Interest: {lead_data['topic']}
+• Notes/Message: {lead_data.get('notes', 'N/A')}
+• Consent to Contact: {'Yes' if lead_data['consent'] else 'No'}
+
+**Tracking Information:**
+• Submission Date: {lead_data['submission_time']}
+• Source Page: {lead_data.get('source_page', 'N/A')}
+• UTM Source: {lead_data.get('utm_source', 'N/A')}
+• UTM Medium: {lead_data.get('utm_medium', 'N/A')}
+• UTM Campaign: {lead_data.get('utm_campaign', 'N/A')}
+• UTM Term: {lead_data.get('utm_term', 'N/A')}
+• UTM Content: {lead_data.get('utm_content', 'N/A')}
+
+**Action Required:**
+• Follow up with the lead within 24-48 business hours.
+• Lead ID in database: {lead_data.get('id', 'TBD')}
+
+Best regards,
+
+KatalystVC Automated System"""
+    return subject, body
+
+
+def make_leads(count, seed):
+    rng = random.Random(seed)
+    leads = []
+    for i in range(count):
+        data = {
+            'firstName': rng.choice(['Ada', 'Grace', 'Alan', 'Edsger', 'Barbara']),
+            'lastName': f'Tester{i}',
+            'email': f'lead{i}@example.com',
+            'company': rng.choice(['Example Health', 'Acme & Sons <Clinic>', None]),
+            'role': rng.choice(['CTO', 'VP Engineering', None]),
+            'phone': None,
+            'topic': rng.choice(TOPICS),
+            'notes': rng.choice(['Looking at Q3 "go-live"', None]),
+            'consent': True,
+            'sourcePage': '/infra',
+            'utmSource': 'linkedin',
+            'utmMedium': 'cpc',
+            'utmCampaign': 'q1-infra',
+            'utmTerm': None,
+            'utmContent': 'ad-a'
+        }
+        leads.append((data, email_templates.lead_template_data(i + 1, data, datetime.now().isoformat())))
+    return leads
+
+
+def legacy(data, lead_data):
+    legacy_confirmation(data['firstName'], data['topic'])
+    legacy_internal(lead_data)
+
+
+def compiled_text(data, lead_data):
+    email_templates.render_confirmation(data['firstName'], data['topic'], with_html=False)
+    email_templates.render_internal_notification(lead_data, with_html=False)
+
+
+def compiled(data, lead_data):
+    email_templates.render_confirmation(data['firstName'], data['topic'])
+    email_templates.render_internal_notification(lead_data)
+
+
+def compiled_mime(data, lead_data):
+    for email, to_email in ((email_templates.render_confirmation(data['firstName'], data['topic']), data['email']),
+                            (email_templates.render_internal_notification(lead_data), 'team@example.com')):
+        email_templates.build_message('support@example.com', to_email, email.subject, email.text,
+                                      html_body=email.html).as_string()
+
+
+def per_lead_us(function, leads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data, lead_data in leads:
+            function(data, lead_data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(leads) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--leads', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    leads = make_leads(args.leads, args.seed)
+
+    start = time.perf_counter()
+    template_set = email_templates.TemplateSet()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    checks = 2000
+    start = time.perf_counter()
+    for _ in range(checks):
+        template_set._changed()
+    check_us = (time.perf_counter() - start) / checks * 1e6
+
+    print(json.dumps({
+        'leads': args.leads,
+        'template_load_ms': round(load_ms, 3),
+        'reload_check_us': round(check_us, 2),
+        'reload_check_interval_seconds': email_templates.EMAIL_TEMPLATE_RELOAD_SECONDS,
+        'per_lead_us': {
+            'legacy_fstring_text_only': per_lead_us(legacy, leads, args.repeat),
+            'compiled_text_only': per_lead_us(compiled_text, leads, args.repeat),
+            'compiled_text_and_html': per_lead_us(compiled, leads, args.repeat),
+            'compiled_plus_mime_message': per_lead_us(compiled_mime, leads, args.repeat)
+        }
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
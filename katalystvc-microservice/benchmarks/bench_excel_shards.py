@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Excel API compaction cost as lead history grows.
+Fills a LeadJournal with --history leads spread over --months months, once
+with EXCEL_SHARD_BY=none (one workbook) and once with monthly shards, then
+times compacting a batch of --batch new leads for the current month. Without
+sharding every compaction rewrites the whole history; with it only the
+current month's file is rewritten. Also reports the size of the file written
+and a find_lead lookup for an old lead.
+
+Usage: python benchmarks/bench_excel_shards.py [--history 20000] [--months 12] [--batch 50]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Compactions are run explicitly below, not by the background compactor
+os.environ.update(JOURNAL_COMPACT_MAX_ROWS='1000000000', JOURNAL_COMPACT_INTERVAL_SECONDS='86400')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'katalystvc-excel-api'))
+from lead_journal import LEAD_FIELDS, LeadJournal  # noqa: E402
+
+
+def make_lead(i, month):
+    return {
+        'timestamp': f'{month}-{i % 28 + 1:02d}T12:00:00',
+        'first_name': 'Avery',
+        'last_name': f'Tester{i}',
+        'email': f'lead{i}@example.com',
+        'company': 'Northwind Health',
+        'role': 'cto',
+        'phone': '',
+        'topic': 'infra',
+        'notes': 'Looking at a Q3 go-live for the new data platform.',
+        'consent': 'Yes',
+        'source_page': '/infra',
+        'utm_source': 'linkedin',
+        'utm_medium': 'cpc',
+        'utm_campaign': 'q1-infra',
+        'utm_term': '',
+        'utm_content': 'ad-a'
+    }
+
+
+def run(shard_by, workdir, history, months, batch):
+    journal = LeadJournal(os.path.join(workdir, f'{shard_by}.jsonl'),
+                          os.path.join(workdir, f'{shard_by}.xlsx'), LEAD_FIELDS, shard_by=shard_by)
+    labels = [f'{2024 + m // 12}-{m % 12 + 1:02d}' for m in range(months)]
+    for i in range(history):
+        journal.append(make_lead(i, labels[i * months // history]))
+    start = time.perf_counter()
+    journal.compact()
+    initial = time.perf_counter() - start
+
+    for i in range(batch):
+        journal.append(make_lead(history + i, labels[-1]))
+    start = time.perf_counter()
+    journal.compact()
+    incremental = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = journal.find_lead(1)
+    lookup = time.perf_counter() - start
+    return {
+        'initial_compact_s': round(initial, 3),
+        'batch_compact_s': round(incremental, 3),
+        'rewritten_file_bytes': os.path.getsize(journal.shard_file(journal.shard_key(labels[-1] + '-01'))),
+        'files': len(journal.shard_files()),
+        'find_old_lead_ms': round(lookup * 1000, 1),
+        'found': found is not None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--history', type=int, default=20000)
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='katalystvc-shards-')
+    report = {'history': args.history, 'months': args.months, 'batch': args.batch}
+    for shard_by in ('none', 'month'):
+        report[shard_by] = run(shard_by, workdir, args.history, args.months, args.batch)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
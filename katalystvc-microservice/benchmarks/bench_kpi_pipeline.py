@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+KPI pipeline throughput on years of daily rows.
+Writes a synthetic kpis.csv in the same display format as data/kpis.csv
+("8.0%", "$125") for --years of days x --pages landing pages, plus a leads.db
+whose /stats rollups hold per-page daily lead counts, then times
+kpi_pipeline.build(), the Parquet round trip and date-range queries.
+
+Usage: python benchmarks/bench_kpi_pipeline.py [--years 5] [--pages 20] [--queries 100]
+Requires: pandas, numpy, pyarrow
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kpi_pipeline  # noqa: E402
+import migrations  # noqa: E402
+
+
+def write_fixtures(workdir, years, pages, seed):
+    rng = random.Random(seed)
+    page_names = ['/infra', '/fhir'] + [f'/brief-{i}' for i in range(max(0, pages - 2))]
+    first_day = date(2025, 1, 1)
+    days = [first_day + timedelta(days=i) for i in range(365 * years)]
+
+    kpis_path = os.path.join(workdir, 'kpis.csv')
+    rollups = []
+    with open(kpis_path, 'w') as f:
+        f.write('date,page,visits,bookings,wins,ctr,cvr,win_rate,cpl,cac\n')
+        for day in days:
+            for page in page_names:
+                visits = rng.randint(50, 400)
+                bookings = rng.randint(0, visits // 8)
+                wins = rng.randint(0, bookings)
+                spend = rng.randint(200, 3000)
+                ctr = f"{bookings / visits:.1%}"
+                cvr = f"{wins / bookings:.1%}" if bookings else '0.0%'
+                cpl = f"${spend / bookings:.0f}" if bookings else '$0'
+                cac = f"${spend / wins:.0f}" if wins else '$0'
+                f.write(f"{day.isoformat()},{page},{visits},{bookings},{wins},{ctr},{cvr},{cvr},{cpl},{cac}\n")
+                rollups.append(('source_page', page, day.isoformat(), rng.randint(0, bookings + 3)))
+
+    database = os.path.join(workdir, 'leads.db')
+    conn = sqlite3.connect(database)
+    migrations.migrate(conn)
+    conn.executemany('INSERT INTO lead_rollups (dimension, value, day, count) VALUES (?, ?, ?, ?)', rollups)
+    conn.commit()
+    conn.close()
+    return kpis_path, database, days
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='katalystvc-kpi-bench-')
+    kpis_path, database, days = write_fixtures(workdir, args.years, args.pages, args.seed)
+
+    frame, build_seconds = timed(kpi_pipeline.build, kpis_path, database)
+    parquet_path = os.path.join(workdir, 'kpis.parquet')
+    _, save_seconds = timed(kpi_pipeline.save, frame, parquet_path)
+    loaded, load_seconds = timed(kpi_pipeline.load, parquet_path)
+
+    rng = random.Random(args.seed)
+    query_seconds = []
+    for i in range(args.queries):
+        since, until = sorted(rng.sample(days, 2))
+        freq = ['W', 'M', None][i % 3]
+        _, elapsed = timed(kpi_pipeline.query, loaded, since.isoformat(), until.isoformat(), freq=freq)
+        query_seconds.append(elapsed)
+    query_seconds.sort()
+
+    print(json.dumps({
+        'rows': len(frame),
+        'pages': args.pages,
+        'days': len(days),
+        'build_seconds': round(build_seconds, 3),
+        'parquet_save_seconds': round(save_seconds, 3),
+        'parquet_load_seconds': round(load_seconds, 3),
+        'query_p50_ms': round(query_seconds[len(query_seconds) // 2] * 1000, 2),
+        'query_max_ms': round(query_seconds[-1] * 1000, 2)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
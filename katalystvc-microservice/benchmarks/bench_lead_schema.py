@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Lead payload parsing and validation cost per request.
+Decodes and validates --payloads synthetic /submit-lead bodies the original
+way (json.loads on the decoded text, then the required-field presence check)
+and through lead_schema (parse_body on the raw bytes with orjson and with the
+standard json module, then the compiled validate), plus the rejection paths:
+a payload with bad fields, a non-JSON body and an oversized body. Reports
+microseconds per request.
+
+Usage: python benchmarks/bench_lead_schema.py [--payloads 20000] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lead_schema  # noqa: E402
+
+LEGACY_REQUIRED = ['firstName', 'lastName', 'email', 'topic', 'consent']
+
+
+def make_bodies(count, seed):
+    rng = random.Random(seed)
+    bodies = []
+    for i in range(count):
+        payload = {
+            'firstName': rng.choice(['Avery', 'Jordan', 'Priya', 'Mateo']),
+            'lastName': f'Tester{i}',
+            'email': f'lead{i}@example.com',
+            'company': rng.choice(['Northwind Health', 'Contoso Clinics', '']),
+            'role': rng.choice(['cto', 'cio', 'other', '']),
+            'phone': '',
+            'topic': rng.choice(['infra', 'fhir', 'both']),
+            'notes': rng.choice(['', 'Looking at a Q3 go-live for the new data platform.']),
+            'consent': True,
+            'sourcePage': '/infra',
+            'utm_source': 'linkedin',
+            'utm_medium': 'cpc',
+            'utm_campaign': 'q1-infra',
+            'utm_term': '',
+            'utm_content': 'ad-a',
+            'submittedAt': '2025-01-01T12:00:00.000Z'
+        }
+        bodies.append(json.dumps(payload).encode('utf-8'))
+    return bodies
+
+
+def legacy(body):
+    data = json.loads(body.decode('utf-8'))
+    return all(field in data for field in LEGACY_REQUIRED)
+
+
+def schema_orjson(body):
+    lead_schema.validate(lead_schema.parse_body(body))
+
+
+def schema_stdlib(body):
+    lead_schema.validate(json.loads(body))
+
+
+def rejected(body):
+    try:
+        lead_schema.validate(lead_schema.parse_body(body))
+    except lead_schema.LeadValidationError:
+        return
+    raise AssertionError('expected a rejection')
+
+
+def per_request_us(function, bodies, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            function(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(bodies) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--payloads', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bodies = make_bodies(args.payloads, args.seed)
+    invalid = [body.replace(b'@example.com', b' at example').replace(b'"consent": true', b'"consent": "yes"')
+               for body in bodies]
+    not_json = [b'firstName=Avery&lastName=Tester'] * args.payloads
+    oversized = [b'{"notes": "' + b'x' * lead_schema.LEAD_MAX_BODY_BYTES + b'"}'] * min(args.payloads, 2000)
+
+    report = {
+        'payloads': args.payloads,
+        'average_body_bytes': round(sum(map(len, bodies)) / len(bodies)),
+        'orjson_available': lead_schema.orjson is not None,
+        'per_request_us': {
+            'legacy_json_presence_check': per_request_us(legacy, bodies, args.repeat),
+            'schema_stdlib_json': per_request_us(schema_stdlib, bodies, args.repeat),
+            'validate_only': per_request_us(lead_schema.validate, [json.loads(body) for body in bodies],
+                                            args.repeat),
+            'reject_invalid_fields': per_request_us(rejected, invalid, args.repeat),
+            'reject_not_json': per_request_us(rejected, not_json, args.repeat),
+            'reject_oversized': per_request_us(rejected, oversized, args.repeat)
+        }
+    }
+    if lead_schema.orjson is not None:
+        report['per_request_us']['schema_orjson'] = per_request_us(schema_orjson, bodies, args.repeat)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Lead full-text search latency.
+Builds a leads.db with --leads synthetic leads, migrates it to the search
+index (so every existing lead is pending backfill, as on a live database) and
+times the batched backfill. Then times /leads/search-shaped queries (a rare
+word, a common word, a prefix, a phrase, a word plus a topic filter) through
+the FTS5 index against the LIKE scan over notes/company/role that clients
+effectively did before. Reports milliseconds per query (median of --repeat).
+
+Usage: python benchmarks/bench_lead_search.py [--leads 1000000] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+import lead_search  # noqa: E402
+import migrations  # noqa: E402
+
+COMPANIES = ['Northwind Health', 'Contoso Clinics', 'Fabrikam Medical', 'Acmecorp Hospital Group',
+             'Tailspin Pediatrics', 'Litware Labs', 'Adventure Works Care', 'Wingtip Imaging']
+ROLES = ['cto', 'cio', 'vp engineering', 'director of informatics', 'head of data', 'other']
+NOTE_WORDS = ('looking at a go live for the new data platform we need fhir apis for our ehr and '
+              'a tefca onboarding plan budget approved for next quarter interested in the infrastructure '
+              'audit cloud migration kubernetes security review hl7 interfaces analytics warehouse').split()
+RARE_WORD = 'zanzibar'
+
+
+def build_database(path, count, seed):
+    rng = random.Random(seed)
+    conn = db.connect(path)
+    conn.execute(migrations.BASELINE_TABLES[0])
+    batch = []
+    for i in range(count):
+        notes = ' '.join(rng.choice(NOTE_WORDS) for _ in range(rng.randint(5, 30)))
+        if i % 50000 == 0:
+            notes += f' {RARE_WORD}'
+        batch.append(('Avery', f'Tester{i}', f'lead{i}@example.com', rng.choice(COMPANIES), rng.choice(ROLES),
+                      '', rng.choice(['infra', 'fhir', 'both']), notes, 1, None, None, None, None, None, None,
+                      f'2025-{i % 12 + 1:02d}-01T12:00:00'))
+        if len(batch) == 10000:
+            conn.executemany(db.INSERT_LEAD_SQL, batch)
+            batch = []
+    if batch:
+        conn.executemany(db.INSERT_LEAD_SQL, batch)
+    conn.commit()
+    return conn
+
+
+def median_ms(conn, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 2), len(rows)
+
+
+def like_scan(term, limit):
+    pattern = f'%{term}%'
+    return ('SELECT id, company FROM leads WHERE notes LIKE ? OR company LIKE ? OR role LIKE ? '
+            'ORDER BY submission_time DESC, id DESC LIMIT ?', [pattern, pattern, pattern, limit])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--leads', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='katalystvc-search-'), 'leads.db')
+    start = time.perf_counter()
+    conn = build_database(path, args.leads, args.seed)
+    report = {'leads': args.leads, 'build_s': round(time.perf_counter() - start, 1)}
+
+    migrations.migrate(conn)
+    start = time.perf_counter()
+    indexed = lead_search.backfill(conn)
+    report['backfill'] = {'indexed': indexed, 'seconds': round(time.perf_counter() - start, 1)}
+    start = time.perf_counter()
+    lead_search.optimize(conn)
+    report['optimize_s'] = round(time.perf_counter() - start, 1)
+    report['database_mb'] = round(os.path.getsize(path) / 1e6, 1)
+
+    queries = {
+        'rare_word': ({'q': RARE_WORD}, RARE_WORD),
+        'common_word': ({'q': 'fhir'}, 'fhir'),
+        'prefix': ({'q': 'acme*'}, 'acme'),
+        'phrase': ({'q': '"cloud migration"'}, 'cloud migration'),
+        'word_and_topic': ({'q': 'kubernetes', 'topic': 'infra'}, 'kubernetes')
+    }
+    report['query_ms'] = {}
+    for name, (query, term) in queries.items():
+        query = dict(query, limit=str(args.limit), fields='id,company')
+        sql, params, _ = lead_search.parse_search_args(query)
+        fts_ms, hits = median_ms(conn, sql, params, args.repeat)
+        scan_ms, _ = median_ms(conn, *like_scan(term, args.limit), max(1, args.repeat // 2))
+        report['query_ms'][name] = {'fts': fts_ms, 'like_scan': scan_ms, 'hits': hits}
+    db.close(conn)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Lead storage backend throughput (see lead_store.py).
+For each backend in --backends, in a fresh directory: --inserts single
+inserts (each committed or fsynced on its own, as /submit-lead does), then
+--bulk leads through insert_many in batches of --batch-size, then count(),
+next_id(), a full iterate() and a filtered query(). Excel reads happen after
+a compaction, which is timed separately. For fanout the insert numbers are
+the primary's plus waking the copying thread; the report adds how long the Excel
+replica took to catch up afterwards.
+
+Usage: python benchmarks/bench_lead_store.py [--backends sqlite,excel,jsonl,fanout] [--inserts 2000] [--bulk 20000]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Compactions are run explicitly below, not by the background compactor
+os.environ.update(JOURNAL_COMPACT_MAX_ROWS='1000000000', JOURNAL_COMPACT_INTERVAL_SECONDS='86400')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lead_store  # noqa: E402
+
+TOPICS = ['infra', 'fhir', 'both']
+
+
+def make_records(count, start, seed):
+    rng = random.Random(seed)
+    return [{
+        'timestamp': f'2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:00:{i % 60:02d}',
+        'lead_id': None,
+        'first_name': 'Avery',
+        'last_name': f'Tester{i}',
+        'email': f'lead{i}@example.com',
+        'company': 'Northwind Health',
+        'role': 'cto',
+        'phone': '',
+        'topic': rng.choice(TOPICS),
+        'notes': 'Looking at a Q3 go-live for the new data platform.',
+        'consent': 'Yes',
+        'source_page': '/infra',
+        'utm_source': rng.choice(['linkedin', 'google', 'newsletter']),
+        'utm_medium': 'cpc',
+        'utm_campaign': 'q1-infra',
+        'utm_term': '',
+        'utm_content': 'ad-a'
+    } for i in range(start, start + count)]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def open_backend(kind, workdir):
+    lead_store.EXCEL_FILE = os.path.join(workdir, 'katalystvc_leads.xlsx')
+    lead_store.JOURNAL_FILE = os.path.join(workdir, 'katalystvc_leads.journal.jsonl')
+    lead_store.JSONL_FILE = os.path.join(workdir, 'leads.jsonl')
+    return lead_store.open_store(kind, os.path.join(workdir, 'leads.db'))
+
+
+def run(kind, args):
+    workdir = tempfile.mkdtemp(prefix=f'katalystvc-store-{kind}-')
+    store = open_backend(kind, workdir)
+    report = {}
+
+    latencies = []
+    for record in make_records(args.inserts, 0, args.seed):
+        _, seconds = timed(store.insert, record)
+        latencies.append(seconds)
+    latencies.sort()
+    report['insert'] = {
+        'per_s': round(len(latencies) / sum(latencies)),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3)
+    }
+
+    records = make_records(args.bulk, args.inserts, args.seed + 1)
+    start = time.perf_counter()
+    for offset in range(0, len(records), args.batch_size):
+        store.insert_many(records[offset:offset + args.batch_size])
+    report['insert_many_per_s'] = round(len(records) / (time.perf_counter() - start))
+
+    if kind == 'fanout':
+        _, seconds = timed(store.flush)
+        report['replica_catch_up_s'] = round(seconds, 2)
+        report['replica'] = store.stats()
+    journal = getattr(store.replica if kind == 'fanout' else store, 'journal', None)
+    if journal is not None:
+        _, seconds = timed(journal.compact)
+        report['excel_compact_s'] = round(seconds, 2)
+
+    total, seconds = timed(store.count)
+    report['count'] = {'leads': total, 'ms': round(seconds * 1000, 2)}
+    _, seconds = timed(store.next_id)
+    report['next_id_ms'] = round(seconds * 1000, 2)
+    rows, seconds = timed(lambda: sum(1 for _ in store.iterate()))
+    report['iterate'] = {'leads': rows, 'per_s': round(rows / seconds)}
+    timings = []
+    for _ in range(args.repeat):
+        hits, seconds = timed(store.query, {'topic': 'fhir', 'utm_source': 'linkedin'}, 20)
+        timings.append(seconds)
+    report['query_ms'] = round(statistics.median(timings) * 1000, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backends', default='sqlite,excel,jsonl,fanout')
+    parser.add_argument('--inserts', type=int, default=2000)
+    parser.add_argument('--bulk', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    report = {'inserts': args.inserts, 'bulk': args.bulk, 'batch_size': args.batch_size}
+    for kind in args.backends.split(','):
+        report[kind] = run(kind, args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Schema migration cost on a large, pre-migrations leads.db.
+Builds a database with --leads rows in the original schema (no
+user_version, no submitted_at column, none of the newer indexes), then runs
+migrations.migrate() and the batched backfills while a writer thread keeps
+inserting leads the way /submit-lead does. Reports how long each migration
+and backfill took (as recorded in schema_migrations) and the writer's insert
+latency during the backfill, which is what "online" has to keep low.
+
+Usage: python benchmarks/bench_migrations.py [--leads 500000] [--batch-size 5000] [--write-interval-ms 10]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+ORIGINAL_COLUMNS = ('first_name, last_name, email, company, role, phone, topic, notes, consent, source_page, '
+                    'utm_source, utm_medium, utm_campaign, utm_term, utm_content, submission_time')
+
+PAYLOAD = {
+    'firstName': 'Avery', 'lastName': 'Tester', 'email': 'Avery.Tester@Example.com', 'company': 'Northwind Health',
+    'role': 'cto', 'phone': '', 'topic': 'infra', 'notes': 'Looking at a Q3 go-live.', 'consent': True,
+    'sourcePage': '/infra', 'utmSource': 'linkedin', 'utmMedium': 'cpc', 'utmCampaign': 'q1-infra'
+}
+
+
+def build_legacy_database(path, count):
+    conn = sqlite3.connect(path)
+    conn.execute(migrations.BASELINE_TABLES[0].replace(',\n        submitted_at REAL', ''))
+    rows = ((f'Lead{i}', 'Tester', f'lead{i}@example.com', 'Northwind Health', 'cto', '', 'infra', 'notes', 1,
+             f'/page{i % 20}', 'linkedin', 'cpc', 'q1', None, None, f'2025-{i % 12 + 1:02d}-01T12:00:00.{i % 999999:06d}')
+            for i in range(count))
+    conn.executemany(f'INSERT INTO leads ({ORIGINAL_COLUMNS}) VALUES ({", ".join("?" * 16)})', rows)
+    conn.commit()
+    conn.close()
+
+
+def writer(database, stop, latencies, interval):
+    conn = db.connect(database)
+    while not stop.is_set():
+        start = time.perf_counter()
+        db.insert_lead(conn.cursor(), PAYLOAD, datetime.now().isoformat())
+        conn.commit()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(interval)
+    db.close(conn)
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {'inserts': len(latencies),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+            'max_ms': round(latencies[-1] * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--leads', type=int, default=500000)
+    parser.add_argument('--batch-size', type=int, default=migrations.MIGRATION_BACKFILL_BATCH)
+    parser.add_argument('--pause-ms', type=int, default=migrations.MIGRATION_BACKFILL_PAUSE_MS)
+    parser.add_argument('--write-interval-ms', type=float, default=10,
+                        help='Pause between the writer thread\'s inserts')
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix='katalystvc-migrations-'), 'leads.db')
+    build_legacy_database(database, args.leads)
+
+    conn = db.connect(database)
+    start = time.perf_counter()
+    migrations.migrate(conn)
+    migrate_seconds = round(time.perf_counter() - start, 2)
+
+    stop, latencies = threading.Event(), []
+    thread = threading.Thread(target=writer, args=(database, stop, latencies, args.write_interval_ms / 1000))
+    thread.start()
+    start = time.perf_counter()
+    migrations.run_backfills(conn, args.batch_size, args.pause_ms)
+    backfill_seconds = round(time.perf_counter() - start, 2)
+    stop.set()
+    thread.join()
+
+    missing = conn.execute('SELECT COUNT(*) FROM leads WHERE submitted_at IS NULL').fetchone()[0]
+    plan = ' '.join(row[3] for row in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM leads WHERE lower(trim(email)) = ? ORDER BY submission_time DESC',
+        ('lead7@example.com',)))
+    report = {
+        'leads': args.leads,
+        'migrate_s': migrate_seconds,
+        'backfill_s': backfill_seconds,
+        'rows_missing_submitted_at': missing,
+        'email_lookup_plan': plan,
+        'inserts_during_backfill': summarize(latencies),
+        **migrations.status(conn)
+    }
+    db.close(conn)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
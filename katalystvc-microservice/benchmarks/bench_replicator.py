@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Write-behind replication from leads.db to the Excel workbook (see lead_replicator.py).
+Submits --leads leads through app.py's /submit-lead with the test client,
+first with no replicator and then with lead_replicator.py running in a
+separate process, and compares the submit latencies: the replicator's reads
+and journal appends must not show up in them. While the second run is going
+it samples the replication lag (as /metrics reports it) and afterwards times
+how long the replicator took to catch up. Finally times a bulk catch-up of
+--backlog leads already in leads.db, then compacts them into the workbook.
+
+Usage: python benchmarks/bench_replicator.py [--leads 2000] [--backlog 20000] [--batch-size 500] [--interval 0.2]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Compactions are run explicitly below, not by the background compactor
+os.environ.update(JOURNAL_COMPACT_MAX_ROWS='1000000000', JOURNAL_COMPACT_INTERVAL_SECONDS='86400',
+                  RATE_LIMIT_PER_IP='0', RATE_LIMIT_GLOBAL='0', DEDUPE_WINDOW_SECONDS='0')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import db  # noqa: E402
+import lead_replicator  # noqa: E402
+import lead_store  # noqa: E402
+
+
+def payload(i):
+    return {
+        'firstName': 'Avery', 'lastName': f'Tester{i}', 'email': f'lead{i}@example.com',
+        'company': 'Northwind Health', 'role': 'cto', 'phone': '', 'topic': 'infra',
+        'notes': 'Looking at a Q3 go-live for the new data platform.', 'consent': True, 'sourcePage': '/infra',
+        'utmSource': 'linkedin', 'utmMedium': 'cpc', 'utmCampaign': 'q1-infra'
+    }
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3)
+    }
+
+
+def submit(client, start, count, sample_lag=None):
+    latencies, lags = [], []
+    for i in range(start, start + count):
+        begin = time.perf_counter()
+        response = client.post('/submit-lead', json=payload(i))
+        latencies.append(time.perf_counter() - begin)
+        if response.status_code != 200:
+            raise RuntimeError(f"/submit-lead returned {response.status_code}: {response.get_data(as_text=True)}")
+        if sample_lag is not None and i % 100 == 0:
+            lags.append(sample_lag())
+    return latencies, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--leads', type=int, default=2000)
+    parser.add_argument('--backlog', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--interval', type=float, default=0.2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='katalystvc-replicator-')
+    os.chdir(workdir)
+    import app  # noqa: E402  (after chdir, so leads.db and the workbook land in workdir)
+    client = app.app.test_client()
+    report = {'leads': args.leads, 'backlog': args.backlog, 'batch_size': args.batch_size}
+
+    latencies, _ = submit(client, 0, args.leads)
+    report['submit_without_replicator'] = percentiles(latencies)
+
+    env = dict(os.environ, REPLICATOR_BATCH=str(args.batch_size))
+    replicator = subprocess.Popen([sys.executable, os.path.join(ROOT, 'lead_replicator.py'), 'run',
+                                   '--interval', str(args.interval)], cwd=workdir, env=env,
+                                  stdout=subprocess.DEVNULL)
+    try:
+        conn = db.connect(app.DATABASE)
+        latencies, lags = submit(client, args.leads, args.leads, lambda: lead_replicator.replication_lag(conn))
+        report['submit_with_replicator'] = percentiles(latencies)
+        report['lag_during_submits'] = {
+            'max_leads': max(lag['lag_leads'] for lag in lags),
+            'max_seconds': max(lag['lag_seconds'] for lag in lags)
+        }
+        start = time.perf_counter()
+        while lead_replicator.replication_lag(conn)['lag_leads']:
+            time.sleep(0.01)
+        report['catch_up_after_submits_s'] = round(time.perf_counter() - start, 3)
+    finally:
+        replicator.terminate()
+        replicator.wait()
+
+    store = lead_store.SQLiteStore(app.DATABASE)
+    records = [lead_store.lead_record(payload(i), '2025-06-01T12:00:00')
+               for i in range(2 * args.leads, 2 * args.leads + args.backlog)]
+    for offset in range(0, len(records), args.batch_size):
+        store.insert_many(records[offset:offset + args.batch_size])
+    replica = lead_replicator.Replicator(app.DATABASE, batch_size=args.batch_size)
+    start = time.perf_counter()
+    while replica.run_once() == args.batch_size:
+        pass
+    seconds = time.perf_counter() - start
+    report['backlog_catch_up'] = {'seconds': round(seconds, 2), 'leads_per_s': round(args.backlog / seconds)}
+    start = time.perf_counter()
+    replica.replica.journal.compact()
+    report['excel_compact_s'] = round(time.perf_counter() - start, 2)
+    report['replicated'] = lead_replicator.read_checkpoint()['replicated']
+    db.close(conn)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
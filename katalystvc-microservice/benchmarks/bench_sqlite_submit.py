@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+SQLite submit throughput: per-request connections vs the pooled db.py layer.
+Runs the /submit-lead insert path from several threads against a scratch
+database, once the way the services used to (connect, INSERT, commit, close
+with the default rollback journal) and once through db.get_connection()
+(per-thread connection, WAL, synchronous=NORMAL, cached INSERT).
+
+Usage: python benchmarks/bench_sqlite_submit.py [--submits 2000] [--threads 8]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+PAYLOAD = {
+    'firstName': 'Bench',
+    'lastName': 'Mark',
+    'email': 'bench@example.com',
+    'company': 'Example Health',
+    'role': 'CTO',
+    'phone': '555-0100',
+    'topic': 'infra',
+    'notes': 'Benchmark lead',
+    'consent': True,
+    'sourcePage': '/infra',
+    'utmSource': 'linkedin',
+    'utmMedium': 'cpc',
+    'utmCampaign': 'q1-infra',
+    'utmTerm': 'ai infrastructure',
+    'utmContent': 'ad-a'
+}
+
+
+def submit_per_request(database):
+    conn = sqlite3.connect(database, timeout=30)
+    conn.execute(db.INSERT_LEAD_SQL, db.lead_params(PAYLOAD, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def submit_pooled(database):
+    conn = db.get_connection(database)
+    db.insert_lead(conn.cursor(), PAYLOAD, datetime.now().isoformat())
+    conn.commit()
+
+
+def run(mode, submit, submits, threads):
+    database = os.path.join(tempfile.mkdtemp(prefix='katalystvc-bench-'), 'leads.db')
+    conn = sqlite3.connect(database)
+    migrations.migrate(conn)
+    conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(lambda _: submit(database), range(submits)))
+    elapsed = time.perf_counter() - start
+    db.close_all()
+    return {'mode': mode, 'submits': submits, 'threads': threads,
+            'seconds': round(elapsed, 3), 'submits_per_sec': round(submits / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submits', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    results = [
+        run('per_request_connection', submit_per_request, args.submits, args.threads),
+        run('pooled_wal', submit_pooled, args.submits, args.threads)
+    ]
+    results.append({'speedup': round(results[1]['submits_per_sec'] / results[0]['submits_per_sec'], 2)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
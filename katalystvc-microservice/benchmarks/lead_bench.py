@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Lead endpoint benchmark harness.
+Generates realistic lead payloads (all 16 form fields, UTM mixes keyed to the
+pages in data/kpis.csv) and drives each backend in-process at a configurable
+concurrency:
+
+    sqlite   app.py             POST /submit-lead
+    email    app_with_email.py  POST /submit-lead + GET /leads, against a stub SMTP server
+    excel    katalystvc-excel-api/app_secure.py  POST /submit-lead, against a stub SMTP server
+
+Each backend runs in its own process and scratch directory. The report is JSON
+(throughput, latency percentiles and per-stage timings, plus the git commit) so
+runs can be diffed across commits.
+
+Usage: python benchmarks/lead_bench.py [--backends sqlite,email,excel]
+           [--requests 1000] [--concurrency 16] [--seed 1] [--output results.json]
+"""
+
+import argparse
+import contextlib
+import csv
+import functools
+import io
+import json
+import multiprocessing
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+EXCEL_API_DIR = os.path.join(SERVICE_DIR, 'katalystvc-excel-api')
+KPIS_CSV = os.path.join(os.path.dirname(SERVICE_DIR), 'data', 'kpis.csv')
+
+FIRST_NAMES = ['Avery', 'Jordan', 'Priya', 'Mateo', 'Chen', 'Fatima', 'Liam', 'Sofia', 'Kwame', 'Elena']
+LAST_NAMES = ['Nguyen', 'Okafor', 'Schmidt', 'Patel', 'Garcia', 'Kim', 'Rossi', 'Haddad', 'Levine', 'Silva']
+COMPANIES = ['Northwind Health', 'Contoso Clinics', 'Fabrikam Labs', 'Tailspin Capital', 'Adatum Care', None]
+ROLES = ['CTO', 'CIO', 'VP Engineering', 'Head of Data', 'Founder', 'Director of IT', None]
+# (utm_source, utm_medium) pairs and their relative weights
+UTM_MIX = [
+    (('linkedin', 'cpc'), 35),
+    (('google', 'cpc'), 25),
+    (('newsletter', 'email'), 15),
+    (('partner', 'referral'), 10),
+    ((None, None), 15)  # direct traffic
+]
+
+
+def load_pages():
+    """Landing pages from data/kpis.csv (falls back to the two briefs)."""
+    try:
+        with open(KPIS_CSV, newline='') as f:
+            pages = sorted({row['page'] for row in csv.DictReader(f) if row.get('page')})
+    except OSError:
+        pages = []
+    return pages or ['/infra', '/fhir']
+
+
+def make_payload(rng, i, pages):
+    """One realistic /submit-lead payload with all 16 form fields."""
+    page = rng.choice(pages)
+    topic = page.strip('/').split('/')[0] or 'infra'
+    (source, medium), = rng.choices([pair for pair, _ in UTM_MIX], weights=[w for _, w in UTM_MIX])
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    month = rng.choice(['jan', 'feb', 'mar', 'apr'])
+    return {
+        'firstName': first,
+        'lastName': last,
+        'email': f"{first.lower()}.{last.lower()}.{i}@example.com",
+        'company': rng.choice(COMPANIES),
+        'role': rng.choice(ROLES),
+        'phone': f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+        'topic': topic,
+        'notes': rng.choice(['', 'Interested in a diagnostic session.', 'Please send pricing. ' * rng.randint(1, 20)]),
+        'consent': rng.random() < 0.97,
+        'sourcePage': page,
+        'utmSource': source,
+        'utmMedium': medium,
+        'utmCampaign': f"{topic}-{month}" if source else None,
+        'utmTerm': rng.choice(['ai infrastructure', 'fhir tefca', 'cloud audit', None]) if source else None,
+        'utmContent': rng.choice(['ad-a', 'ad-b', 'hero', None]) if source else None
+    }
+
+
+class _StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts and discards every message."""
+
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self._reply('220 stub ESMTP')
+        in_data = False
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if in_data:
+                if line == '.':
+                    in_data = False
+                    self.server.messages += 1
+                    self._reply('250 OK')
+                continue
+            verb = line[:4].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-stub\r\n250 8BITMIME\r\n')
+            elif verb == 'DATA':
+                in_data = True
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _StubSMTPHandler)
+        self.messages = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class StageTimer:
+    """Collects wall-clock durations of wrapped functions, per stage name."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.samples.setdefault(stage, []).append(elapsed)
+
+        setattr(owner, name, timed)
+
+    def report(self):
+        return {stage: summarize(values) for stage, values in sorted(self.samples.items())}
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p90_ms': round(percentile(values, 90) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3)
+    }
+
+
+def drive(app, method, paths_or_payloads, concurrency):
+    """Fire requests through Flask test clients from a thread pool."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(item):
+        nonlocal errors
+        client = app.test_client()
+        start = time.perf_counter()
+        if method == 'POST':
+            response = client.post('/submit-lead', json=item)
+        else:
+            response = client.get(item)
+            response.get_data()  # Drain streamed bodies
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, paths_or_payloads))
+    elapsed = time.perf_counter() - start
+
+    result = {'requests': len(latencies), 'errors': errors,
+              'throughput_per_sec': round(len(latencies) / elapsed, 1)}
+    result['latency'] = summarize(latencies)
+    return result
+
+
+def run_backend(backend, requests, concurrency, seed):
+    """Benchmark one backend; runs in a fresh process inside a scratch directory."""
+    os.chdir(tempfile.mkdtemp(prefix=f'katalystvc-bench-{backend}-'))
+    rng = random.Random(seed)
+    pages = load_pages()
+    payloads = [make_payload(rng, i, pages) for i in range(requests)]
+    timer = StageTimer()
+    smtp = None
+    # Every request comes from one address as fast as it can; measure the service, not the limiter
+    os.environ.update(RATE_LIMIT_PER_IP='0', RATE_LIMIT_GLOBAL='0', SMTP_RATE_LIMIT='0')
+    if backend in ('email', 'excel'):
+        smtp = StubSMTPServer()
+        os.environ.update(SMTP_SERVER='127.0.0.1', SMTP_PORT=str(smtp.server_address[1]),
+                          SMTP_USE_TLS='false', EMAIL_PASSWORD='bench')
+    else:
+        os.environ['EMAIL_PASSWORD'] = ''
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        sys.path.insert(0, SERVICE_DIR)
+        if backend == 'sqlite':
+            import app as service
+            timer.wrap(service.capture.sqlite, 'insert_row', 'db_insert')
+        elif backend == 'email':
+            import app_with_email as service
+            import notification_digest
+            timer.wrap(service.capture.sqlite, 'insert_row', 'db_insert')
+            timer.wrap(notification_digest, 'queue_lead_emails', 'render_and_enqueue_emails')
+            timer.wrap(service.smtp_pool, 'sendmail', 'smtp_send')
+        else:
+            sys.path.insert(0, EXCEL_API_DIR)
+            import app_secure as service
+            service.initialize_excel_file()
+            timer.wrap(service.store, 'insert', 'excel_append')
+            timer.wrap(service, 'render_confirmation', 'render_confirmation')
+            timer.wrap(service, 'get_internal_notification', 'render_internal')
+            timer.wrap(service, 'send_email', 'smtp_send')
+
+        results['submit_lead'] = drive(service.app, 'POST', payloads, concurrency)
+        if backend == 'email':
+            pages_to_read = ['/leads?limit=100', '/leads?limit=100&topic=infra', '/leads?format=ndjson&limit=1000']
+            results['get_leads'] = drive(service.app, 'GET', pages_to_read * max(1, requests // 30), concurrency)
+            # Let the outbox drain so smtp_send timings are complete
+            deadline = time.time() + 60
+            while smtp.messages < 2 * requests and time.time() < deadline:
+                time.sleep(0.1)
+
+    results['stages'] = timer.report()
+    if smtp is not None:
+        results['smtp_messages'] = smtp.messages
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVICE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backends', default='sqlite,email,excel')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'backends': {}
+    }
+    context = multiprocessing.get_context('spawn')
+    for backend in args.backends.split(','):
+        with context.Pool(1) as pool:
+            report['backends'][backend] = pool.apply(run_backend, (backend, args.requests, args.concurrency, args.seed))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Flask vs ASGI latency under concurrent load.
+Starts app_with_email.py (threaded Werkzeug server) and asgi_app.py (uvicorn)
+against separate scratch databases, fires --requests POST /submit-lead calls at
+each with --concurrency clients in flight, and prints throughput and p50/p99
+latency as JSON. Emails are disabled so only the request and storage path is
+measured. Each client is a bare keep-alive HTTP/1.1 connection on asyncio
+streams, so the load generator itself stays cheap next to the servers.
+
+Usage: python benchmarks/load_test_asgi.py [--concurrency 500] [--requests 5000]
+Requires: uvicorn
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'flask': [sys.executable, '-c',
+              'import sys, app_with_email as a; a.app.run(host="127.0.0.1", port=int(sys.argv[1]), threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1',
+             '--log-level', 'warning', '--port']
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def start_server(name, port):
+    workdir = tempfile.mkdtemp(prefix=f'katalystvc-load-{name}-')
+    env = dict(os.environ, EMAIL_PASSWORD='', PYTHONPATH=SERVICE_DIR, RATE_LIMIT_PER_IP='0', RATE_LIMIT_GLOBAL='0')
+    process = subprocess.Popen(SERVERS[name] + [str(port)], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{name} server did not start')
+
+
+async def post_json(reader, writer, port, path, payload):
+    """One POST on an open connection; returns (status, connection still usable)."""
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(
+        f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nContent-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n'.encode('ascii') + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {k.strip().lower(): v.strip() for k, v in (line.split(':', 1) for line in lines[1:] if ':' in line)}
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        # Chunked responses: read until the terminating zero-length chunk
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    return status, keep_alive
+
+
+async def drive(port, total, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def client_loop():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            for i in counter:
+                payload = {'firstName': 'Load', 'lastName': f'Test{i}', 'email': f'load{i}@example.com',
+                           'topic': 'infra', 'consent': True}
+                start = time.perf_counter()
+                try:
+                    status, keep_alive = await post_json(reader, writer, port, '/submit-lead', payload)
+                    if status != 200:
+                        errors += 1
+                    if not keep_alive:
+                        writer.close()
+                        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'requests_per_sec': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--servers', default='flask,asgi')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.servers.split(','):
+        port = free_port()
+        process = start_server(name, port)
+        try:
+            results[name] = asyncio.run(drive(port, args.requests, args.concurrency))
+        finally:
+            process.terminate()
+            process.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Lead ID concurrency stress test for the Excel API.
+Fires parallel /submit-lead requests from several worker processes (each with
+its own thread pool and its own copy of the Flask app) at one shared journal,
+then checks that the returned and stored lead IDs (the journal plus whatever
+the compactor has already rotated out of it into the workbook) are exactly
+1..N with no duplicates or gaps, and that compaction writes every lead to the
+workbook.
+
+Usage: python benchmarks/stress_lead_ids.py [--submits 1000] [--processes 4] [--threads 16]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+EXCEL_API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'katalystvc-excel-api')
+
+
+def _lead_payload(i):
+    return {
+        'firstName': 'Stress',
+        'lastName': f'Test{i}',
+        'email': f'stress{i}@example.com',
+        'topic': 'infra' if i % 2 else 'fhir',
+        'consent': True
+    }
+
+
+def _worker(workdir, indexes, threads):
+    os.chdir(workdir)
+    sys.path.insert(0, EXCEL_API_DIR)
+    os.environ['EMAIL_PASSWORD'] = ''
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as excel_app
+        client = excel_app.app.test_client
+
+        def submit(i):
+            response = client().post('/submit-lead', json=_lead_payload(i))
+            return response.status_code, response.get_json().get('lead_id')
+
+        with ThreadPoolExecutor(threads) as executor:
+            return list(executor.map(submit, indexes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--submits', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='katalystvc-stress-')
+    chunks = [list(range(p, args.submits, args.processes)) for p in range(args.processes)]
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        results = pool.starmap(_worker, [(workdir, chunk, args.threads) for chunk in chunks])
+
+    responses = [r for chunk in results for r in chunk]
+    failures = [r for r in responses if r[0] != 200]
+    returned_ids = sorted(lead_id for status, lead_id in responses if status == 200)
+
+    os.chdir(workdir)
+    sys.path.insert(0, EXCEL_API_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as excel_app
+        journal_ids = sorted(lead['lead_id'] for lead in excel_app.journal.iter_leads())
+        excel_app.journal.compact()
+        stats = excel_app.journal.stats()
+
+    expected = list(range(1, args.submits + 1))
+    report = {
+        'workdir': workdir,
+        'submits': args.submits,
+        'failures': len(failures),
+        'duplicate_ids': len(returned_ids) - len(set(returned_ids)),
+        'returned_ids_ok': returned_ids == expected,
+        'journal_ids_ok': journal_ids == expected,
+        'workbook_rows': stats['workbook_rows']
+    }
+    print(json.dumps(report, indent=2))
+
+    ok = (not failures and report['returned_ids_ok'] and report['journal_ids_ok']
+          and stats['workbook_rows'] == args.submits)
+    print('PASS' if ok else 'FAIL')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
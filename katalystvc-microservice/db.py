@@ -0,0 +1,136 @@
+"""
+KatalystVC SQLite Connection Layer
+Shared by app.py and app_with_email.py. Each thread keeps one open, tuned
+connection per database file instead of connecting for every request:
+WAL journaling (readers no longer block the writer), synchronous=NORMAL (no
+fsync per commit in WAL mode), a busy timeout instead of immediate "database is
+locked" errors, memory-mapped reads and a statement cache for the lead INSERT.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import weakref
+
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', '128'))
+
+# submission_time (ISO 8601) as Unix seconds; times without an offset are taken as UTC
+EPOCH_SQL = 'round((julianday({}) - 2440587.5) * 86400.0, 3)'
+
+# Kept as a single constant so sqlite3's statement cache compiles it once per connection.
+# submitted_at is derived from the submission_time parameter (?16) with EPOCH_SQL.
+INSERT_LEAD_SQL = """
+    INSERT INTO leads (
+        first_name, last_name, email, company, role, phone, topic, notes, consent,
+        source_page, utm_source, utm_medium, utm_campaign, utm_term, utm_content, submission_time,
+        submitted_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, round((julianday(?16) - 2440587.5) * 86400.0, 3))
+"""
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def connect(database, isolation_level=''):
+    """Open a new connection with the service pragmas applied."""
+    conn = sqlite3.connect(
+        database,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_CACHED_STATEMENTS,
+        isolation_level=isolation_level,
+        check_same_thread=False  # Still used by one thread at a time; lets teardown close it
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+
+class _ThreadConnections:
+    """Per-thread holder; its connections are closed when the thread exits."""
+
+    def __init__(self):
+        self.connections = {}
+        # At exit close_all() closes them instead, after hooks registered later (such as a
+        # FanoutStore's last copy) have run
+        weakref.finalize(self, _close_many, self.connections).atexit = False
+
+
+def _close_many(connections):
+    for conn in connections.values():
+        close(conn)
+
+
+def get_connection(database):
+    """This thread's long-lived connection to `database` (do not close it)."""
+    holder = getattr(_local, 'holder', None)
+    if holder is None:
+        holder = _local.holder = _ThreadConnections()
+    connections = holder.connections
+    conn = connections.get(database)
+    if conn is None:
+        conn = connections[database] = connect(database)
+    return conn
+
+
+def reset_connection(database):
+    """Roll back anything a failed request left open on this thread's connection."""
+    holder = getattr(_local, 'holder', None)
+    conn = holder.connections.get(database) if holder is not None else None
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def close(conn):
+    """Close a connection opened with connect() and forget it."""
+    with _connections_lock:
+        if conn in _connections:
+            _connections.remove(conn)
+    conn.close()
+
+
+def close_all():
+    """Close every connection opened through this module (app teardown)."""
+    with _connections_lock:
+        connections, _connections[:] = list(_connections), []
+    for conn in connections:
+        conn.close()
+
+
+atexit.register(close_all)
+
+
+def lead_params(data, submission_time):
+    """INSERT_LEAD_SQL parameters for a submitted form payload."""
+    return (
+        data['firstName'],
+        data['lastName'],
+        data['email'],
+        data.get('company'),
+        data.get('role'),
+        data.get('phone'),
+        data['topic'],
+        data.get('notes'),
+        1 if data['consent'] else 0,  # Convert boolean to integer
+        data.get('sourcePage'),
+        data.get('utmSource'),
+        data.get('utmMedium'),
+        data.get('utmCampaign'),
+        data.get('utmTerm'),
+        data.get('utmContent'),
+        submission_time
+    )
+
+
+def insert_lead(cursor, data, submission_time):
+    """Insert a submitted lead and return its row ID."""
+    cursor.execute(INSERT_LEAD_SQL, lead_params(data, submission_time))
+    return cursor.lastrowid
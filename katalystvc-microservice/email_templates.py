@@ -0,0 +1,308 @@
+"""
+KatalystVC Email Templates
+Confirmation and internal notification emails, shared by the Flask service
+(app_with_email.py), its asyncio variant (asgi_app.py) and the Excel API.
+
+The templates live in templates/ as <name>.txt (a "Subject:" line, a blank
+line, then the plain-text body) and <name>.html, with $name placeholders.
+Each file is compiled once into literal chunks and field slots; the
+confirmation email's per-topic parts (display name, brief link) are
+substituted once per topic and cached, so rendering a lead only fills in its
+own fields. Template files are re-read only when their mtime changes, checked
+at most every EMAIL_TEMPLATE_RELOAD_SECONDS (0 turns the check off).
+The email.mime package is imported by build_message() on first use, so
+services that only render templates don't load it at startup.
+"""
+
+import html
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+TEMPLATE_DIR = os.getenv('EMAIL_TEMPLATE_DIR',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+EMAIL_TEMPLATE_RELOAD_SECONDS = float(os.getenv('EMAIL_TEMPLATE_RELOAD_SECONDS', '2'))
+
+TOPIC_DISPLAY = {
+    'infra': 'AI-Ready Infrastructure Audit',
+    'fhir': 'FHIR/TEFCA 90-Day Sprint',
+    'both': 'AI-Ready Infrastructure Audit and FHIR/TEFCA 90-Day Sprint',
+    'consolidation-divestiture': 'Technology Consolidation & Divestiture Consulting'
+}
+DOWNLOAD_LINK = 'https://katalystvc.com/downloads/{topic}-brief.html'
+
+# Shown for optional fields the lead left out
+MISSING = 'N/A'
+
+# Topics are user input, so the per-topic cache is bounded
+TOPIC_CACHE_SIZE = 64
+
+RenderedEmail = namedtuple('RenderedEmail', 'subject text html')
+
+
+class Markup(str):
+    """Already-rendered HTML, substituted into .html templates without escaping."""
+
+_PLACEHOLDER = re.compile(r'\$(?:(\$)|\{(\w+)\}|(\w+))')
+
+
+def _text_value(value):
+    if value is None:
+        return MISSING
+    return value if type(value) is str else str(value)
+
+
+_HTML_SPECIAL = re.compile('[&<>"\']')
+
+
+def _html_value(value):
+    if type(value) is Markup:
+        return value
+    value = _text_value(value)
+    return html.escape(value, quote=True) if _HTML_SPECIAL.search(value) else value
+
+
+class CompiledTemplate:
+    """A $name template parsed once into literal chunks and field slots.
+
+    Rendering copies the chunk list, fills the slots and joins it, so the
+    template text is never re-scanned. HTML templates escape every value
+    except Markup; None values render as MISSING.
+    """
+
+    def __init__(self, parts, is_html=False):
+        self.parts = parts  # [(literal, field or None)]
+        self.is_html = is_html
+        self._value = _html_value if is_html else _text_value
+        chunks, slots = [], []
+        for literal, field in parts:
+            if literal:
+                chunks.append(literal)
+            if field:
+                slots.append((len(chunks), field))
+                chunks.append('')
+        self._chunks = chunks
+        self._slots = tuple(slots)
+        self.fields = tuple(dict.fromkeys(field for _, field in slots))
+
+    @classmethod
+    def parse(cls, source, is_html=False):
+        parts, position = [], 0
+        for match in _PLACEHOLDER.finditer(source):
+            literal = source[position:match.start()]
+            if match.group(1):
+                parts.append((literal + '$', None))
+            else:
+                parts.append((literal, match.group(2) or match.group(3)))
+            position = match.end()
+        parts.append((source[position:], None))
+        return cls(parts, is_html)
+
+    def partial(self, values):
+        """A new template with the fields present in `values` baked in."""
+        parts, pending = [], ''
+        for literal, field in self.parts:
+            if field in values:
+                pending += literal + self._value(values[field])
+            else:
+                parts.append((pending + literal, field))
+                pending = ''
+        parts.append((pending, None))
+        return CompiledTemplate(parts, self.is_html)
+
+    def render(self, values):
+        chunks = self._chunks.copy()
+        value_of, get = self._value, values.get
+        for index, field in self._slots:
+            chunks[index] = value_of(get(field))
+        return ''.join(chunks)
+
+
+class TemplateSet:
+    """Compiled subject/text/html templates from a directory, hot-reloaded on mtime change."""
+
+    def __init__(self, directory=TEMPLATE_DIR, reload_seconds=EMAIL_TEMPLATE_RELOAD_SECONDS):
+        self.directory = directory
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._compiled = {}
+        self._mtimes = {}
+        self._topic_cache = {}
+        self._next_check = 0.0
+        self.loads = 0
+        self._load()
+
+    def _paths(self):
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith(('.txt', '.html'))]
+
+    def _load(self):
+        compiled, mtimes = {}, {}
+        for path in self._paths():
+            name, extension = os.path.splitext(os.path.basename(path))
+            mtimes[path] = os.stat(path).st_mtime_ns
+            with open(path, encoding='utf-8') as f:
+                source = f.read().rstrip('\n')
+            subject, text, markup = compiled.get(name, (None, None, None))
+            if extension == '.html':
+                markup = CompiledTemplate.parse(source, is_html=True)
+            else:
+                if source.startswith('Subject:'):
+                    subject_line, _, source = source.partition('\n')
+                    subject = CompiledTemplate.parse(subject_line[len('Subject:'):].strip())
+                    source = source.lstrip('\n')
+                text = CompiledTemplate.parse(source)
+            compiled[name] = (subject, text, markup)
+        self._compiled, self._mtimes = compiled, mtimes
+        self._topic_cache = {}
+        self.loads += 1
+
+    def _changed(self):
+        try:
+            paths = self._paths()
+            if set(paths) != set(self._mtimes):
+                return True
+            return any(os.stat(path).st_mtime_ns != self._mtimes[path] for path in paths)
+        except OSError:
+            return False  # Mid-edit or missing; keep serving the last good set
+
+    def _check_reload(self):
+        if not self.reload_seconds:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.reload_seconds
+            if self._changed():
+                try:
+                    self._load()
+                    print(f"Reloaded email templates from {self.directory}")
+                except Exception as e:
+                    print(f"Email template reload failed, keeping the previous templates: {e}")
+
+    def get(self, name):
+        """(subject, text, html) CompiledTemplates; html is None if there's no .html file."""
+        self._check_reload()
+        return self._compiled[name]
+
+    def for_topic(self, name, topic):
+        """`name` with the topic's display name and brief link baked in (cached per topic)."""
+        self._check_reload()
+        cache = self._topic_cache
+        key = (name, topic)
+        templates = cache.get(key)
+        if templates is None:
+            values = {
+                'topic': topic,
+                'topic_display': TOPIC_DISPLAY.get(topic, topic),
+                'download_link': DOWNLOAD_LINK.format(topic=topic)
+            }
+            templates = tuple(None if template is None else template.partial(values)
+                              for template in self._compiled[name])
+            if len(cache) >= TOPIC_CACHE_SIZE:
+                cache.clear()
+            cache[key] = templates
+        return templates
+
+
+templates = TemplateSet()
+
+
+def _render(parts, values, with_html=True):
+    subject, text, markup = parts
+    return RenderedEmail(
+        subject.render(values) if subject else '',
+        text.render(values),
+        markup.render(values) if markup and with_html else None
+    )
+
+
+def lead_template_data(lead_id, data, submission_time):
+    """Map a submitted form payload onto the fields the templates use"""
+    return {
+        'id': lead_id,
+        'first_name': data['firstName'],
+        'last_name': data['lastName'],
+        'email': data['email'],
+        'company': data.get('company'),
+        'role': data.get('role'),
+        'phone': data.get('phone'),
+        'topic': data['topic'],
+        'notes': data.get('notes'),
+        'consent': data['consent'],
+        'source_page': data.get('sourcePage'),
+        'utm_source': data.get('utmSource'),
+        'utm_medium': data.get('utmMedium'),
+        'utm_campaign': data.get('utmCampaign'),
+        'utm_term': data.get('utmTerm'),
+        'utm_content': data.get('utmContent'),
+        'submission_time': submission_time
+    }
+
+
+def render_confirmation(first_name, topic, with_html=True):
+    """Confirmation email for the user as a RenderedEmail (plain text + HTML)"""
+    return _render(templates.for_topic('confirmation', topic), {'first_name': first_name}, with_html)
+
+
+def _consent_label(consent):
+    return consent if isinstance(consent, str) else ('Yes' if consent else 'No')
+
+
+def render_internal_notification(lead_data, record_note=None, with_html=True):
+    """Internal notification email for the team as a RenderedEmail (plain text + HTML)
+
+    `record_note` is the last action item; by default it points at the lead's
+    database ID.
+    """
+    values = dict(lead_data)
+    values['consent'] = _consent_label(lead_data['consent'])
+    values['record_note'] = record_note or f"Lead ID in database: {lead_data.get('id') or 'TBD'}"
+    return _render(templates.get('internal_notification'), values, with_html)
+
+
+def render_internal_digest(leads):
+    """One internal email summarizing several leads (dicts shaped like lead_template_data)"""
+    _, item_text, item_html = templates.get('internal_digest_item')
+    text_items, html_items, topics = [], [], {}
+    for lead_data in leads:
+        values = dict(lead_data)
+        values['consent'] = _consent_label(lead_data['consent'])
+        text_items.append(item_text.render(values))
+        if item_html is not None:
+            html_items.append(item_html.render(values))
+        topics[lead_data['topic']] = topics.get(lead_data['topic'], 0) + 1
+
+    times = sorted(str(lead_data['submission_time']) for lead_data in leads)
+    values = {
+        'new_leads': f"{len(leads)} new lead{'' if len(leads) == 1 else 's'}",
+        'topics': ', '.join(f"{count} {topic}" for topic, count in sorted(topics.items(), key=lambda item: -item[1])),
+        'first_time': times[0] if times else None,
+        'last_time': times[-1] if times else None
+    }
+    parts = templates.get('internal_digest')
+    return RenderedEmail(
+        parts[0].render(values),
+        parts[1].render(dict(values, leads='\n\n'.join(text_items))),
+        parts[2].render(dict(values, leads=Markup('\n'.join(html_items)))) if parts[2] else None
+    )
+
+
+def build_message(sender, to_email, subject, body, is_html=False, html_body=None):
+    """MIME message for one email: multipart/alternative with plain and HTML parts when both exist"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart('alternative')
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'html' if is_html else 'plain', 'utf-8'))
+    if html_body and not is_html:
+        msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+    return msg
@@ -0,0 +1,135 @@
+"""
+KatalystVC Group-Commit Lead Writer
+An optional single writer thread for lead inserts. Requests hand their INSERT
+parameters to a queue and wait on a future; the writer drains the queue every
+few milliseconds (or as soon as it has a full batch), inserts the whole batch
+with executemany in one transaction and resolves each future with its row ID.
+Under a burst this turns N commits (N fsyncs) into one. Batch sizes, queue
+waits and transaction times are exported on /metrics.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+import metrics
+
+GROUP_COMMIT_ENABLED = os.getenv('LEAD_GROUP_COMMIT', 'false').lower() == 'true'
+GROUP_COMMIT_WINDOW_MS = float(os.getenv('GROUP_COMMIT_WINDOW_MS', '5'))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', '100'))
+GROUP_COMMIT_TIMEOUT_SECONDS = float(os.getenv('GROUP_COMMIT_TIMEOUT_SECONDS', '30'))
+
+
+class GroupCommitWriter:
+    """Batches lead INSERTs from many request threads into shared transactions.
+
+    `after_insert(cursor, lead_ids, contexts)` runs inside each batch's
+    transaction (e.g. to queue outbox emails), with one context per lead as
+    passed to submit().
+    """
+
+    def __init__(self, database, window_ms=GROUP_COMMIT_WINDOW_MS,
+                 max_batch=GROUP_COMMIT_MAX_BATCH, after_insert=None):
+        self.database = database
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.after_insert = after_insert
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._max_seen = 0
+
+        # Opened before returning, so nothing the caller starts next (migration
+        # backfills) can change the schema while the connection is loading it
+        self._conn = db.connect(self.database, isolation_level=None)
+        self._thread = threading.Thread(target=self._run, name='lead-group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, params, context=None):
+        """Queue one lead's INSERT_LEAD_SQL parameters; returns a Future of its row ID."""
+        future = Future()
+        self._queue.put((params, context, future, time.monotonic()))
+        return future
+
+    def insert(self, params, context=None, timeout=GROUP_COMMIT_TIMEOUT_SECONDS):
+        """Queue a lead and block until its batch has committed."""
+        return self.submit(params, context).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = self._conn
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            for item in batch:
+                metrics.GROUP_COMMIT_WAIT_SECONDS.observe(started - item[3])
+            try:
+                self._write(conn, batch)
+            except Exception as e:
+                # Retry one by one so a single bad row can't fail its neighbours
+                print(f"Group commit of {len(batch)} leads failed, retrying individually: {e}")
+                for item in batch:
+                    try:
+                        self._write(conn, [item])
+                    except Exception as row_error:
+                        item[2].set_exception(row_error)
+
+    def _write(self, conn, batch):
+        cursor = conn.cursor()
+        with metrics.stage('group_commit_write'):
+            lead_ids = self._write_batch(cursor, batch)
+        self._record(len(batch))
+        for item, lead_id in zip(batch, lead_ids):
+            item[2].set_result(lead_id)
+
+    def _write_batch(self, cursor, batch):
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.executemany(db.INSERT_LEAD_SQL, [item[0] for item in batch])
+            # One writer, one transaction: the batch's row IDs are contiguous
+            last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+            lead_ids = list(range(last_id - len(batch) + 1, last_id + 1))
+            if self.after_insert is not None:
+                self.after_insert(cursor, lead_ids, [item[1] for item in batch])
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        return lead_ids
+
+    def _record(self, size):
+        metrics.GROUP_COMMIT_BATCH_SIZE.observe(size)
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += size
+            self._max_seen = max(self._max_seen, size)
+
+    def stats(self):
+        """Configuration and running totals for the /health endpoint (the distributions are on /metrics)."""
+        with self._stats_lock:
+            return {
+                'window_ms': self.window * 1000,
+                'max_batch': self.max_batch,
+                'queued': self._queue.qsize(),
+                'batches': self._batches,
+                'rows': self._rows,
+                'mean_batch_size': round(self._rows / self._batches, 2) if self._batches else 0,
+                'max_batch_size_seen': self._max_seen
+            }
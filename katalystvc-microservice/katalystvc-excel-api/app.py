@@ -6,19 +6,27 @@ A Flask-based API for capturing website form submissions and storing them in an
 
 import os
 import smtplib
+import sys
 from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 
+# The shared lead schema, capture path and stores live in the parent katalystvc-microservice directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lead_capture
+import lead_schema
+import lead_store
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 # Configuration
-EXCEL_FILE = 'katalystvc_leads.xlsx'
+LEAD_STORE = os.getenv('LEAD_STORE', 'excel')  # sqlite, excel, jsonl or fanout (see lead_store.py)
+EXCEL_FILE = lead_store.EXCEL_FILE
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
 EMAIL_USER = os.getenv('EMAIL_USER', 'support@katalystvc.com')
@@ -26,15 +34,17 @@ EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD', '')  # App password for Gmail
 INTERNAL_EMAIL = os.getenv('INTERNAL_EMAIL', 'support@katalystvc.com')
 
 # Excel column headers
-EXCEL_HEADERS = [
-    'Timestamp', 'Lead ID', 'First Name', 'Last Name', 'Email', 'Company', 
-    'Role', 'Phone', 'Topic', 'Notes', 'Consent', 'Source Page', 
-    'UTM Source', 'UTM Medium', 'UTM Campaign', 'UTM Term', 'UTM Content'
-]
+EXCEL_HEADERS = lead_store.EXCEL_HEADERS
+
+# With LEAD_STORE=excel (or fanout's replica), submissions land in the journal and the
+# compactor flushes them into EXCEL_FILE (or its monthly shards); other stores have no journal
+store = lead_store.open_store(LEAD_STORE)
+journal = lead_store.excel_journal(store)
+LEAD_LOCATION = EXCEL_FILE if journal is not None else f'the {store.name} lead store'
 
 def initialize_excel_file():
-    """Initialize the Excel file with headers if it doesn't exist."""
-    if not os.path.exists(EXCEL_FILE):
+    """Initialize the Excel file with headers if it doesn't exist (monthly shards are created by the compactor)."""
+    if journal is not None and not journal.sharded and not os.path.exists(EXCEL_FILE):
         workbook = Workbook()
         worksheet = workbook.active
         worksheet.title = "Leads"
@@ -51,67 +61,6 @@ def initialize_excel_file():
         workbook.save(EXCEL_FILE)
         print(f"Created new Excel file: {EXCEL_FILE}")
 
-def get_next_lead_id():
-    """Get the next available lead ID by checking the last row in the Excel file."""
-    try:
-        workbook = load_workbook(EXCEL_FILE)
-        worksheet = workbook.active
-        
-        # Find the last row with data
-        last_row = worksheet.max_row
-        if last_row <= 1:  # Only headers exist
-            return 1
-        
-        # Get the last lead ID and increment
-        last_lead_id = worksheet.cell(row=last_row, column=2).value  # Lead ID is in column 2
-        return (last_lead_id or 0) + 1
-    except Exception as e:
-        print(f"Error getting next lead ID: {e}")
-        return 1
-
-def append_to_excel(lead_data):
-    """Append lead data to the Excel file."""
-    try:
-        workbook = load_workbook(EXCEL_FILE)
-        worksheet = workbook.active
-        
-        # Find the next empty row
-        next_row = worksheet.max_row + 1
-        
-        # Prepare data row
-        data_row = [
-            lead_data.get('timestamp'),
-            lead_data.get('lead_id'),
-            lead_data.get('first_name'),
-            lead_data.get('last_name'),
-            lead_data.get('email'),
-            lead_data.get('company'),
-            lead_data.get('role'),
-            lead_data.get('phone'),
-            lead_data.get('topic'),
-            lead_data.get('notes'),
-            lead_data.get('consent'),
-            lead_data.get('source_page'),
-            lead_data.get('utm_source'),
-            lead_data.get('utm_medium'),
-            lead_data.get('utm_campaign'),
-            lead_data.get('utm_term'),
-            lead_data.get('utm_content')
-        ]
-        
-        # Write data to the worksheet
-        for col_num, value in enumerate(data_row, 1):
-            worksheet.cell(row=next_row, column=col_num, value=value)
-        
-        # Save the workbook
-        workbook.save(EXCEL_FILE)
-        print(f"Successfully added lead {lead_data.get('lead_id')} to Excel file")
-        return True
-        
-    except Exception as e:
-        print(f"Error writing to Excel file: {e}")
-        return False
-
 def send_email(to_email, subject, body, is_html=False):
     """Send an email using SMTP."""
     if not EMAIL_PASSWORD:
@@ -200,7 +149,7 @@ A new lead has been submitted via the KatalystVC website. Please find the detail
 
 **Action Required:**
 • Follow up with the lead within 24-48 business hours.
-• Lead data has been saved to {EXCEL_FILE}
+• Lead data has been saved to {LEAD_LOCATION}
 
 Best regards,
 
@@ -208,69 +157,33 @@ KatalystVC Automated System"""
     
     return subject, body
 
-@app.route('/submit-lead', methods=['POST'])
-def submit_lead():
-    """Handle lead submission from the website form."""
-    data = request.get_json()
-
-    # Validate required fields
-    required_fields = ['firstName', 'lastName', 'email', 'topic', 'consent']
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    try:
-        # Generate lead ID and timestamp
-        lead_id = get_next_lead_id()
-        timestamp = datetime.now().isoformat()
+def send_lead_emails(submission):
+    """Send a new lead's emails, if credentials are configured."""
+    data, lead_data = submission.data, submission.record
+    lead_id = lead_data['lead_id']
+    submission.body['timestamp'] = lead_data['timestamp']  # This API's response also carries the submission time
+    if EMAIL_PASSWORD:
+        # Send confirmation email to user
+        conf_subject, conf_body = get_confirmation_email_template(data['firstName'], data['topic'])
+        user_email_sent = send_email(data['email'], conf_subject, conf_body)
+        
+        # Send internal notification email
+        int_subject, int_body = get_internal_notification_template(lead_data)
+        internal_email_sent = send_email(INTERNAL_EMAIL, int_subject, int_body)
         
-        # Prepare lead data for Excel
-        lead_data = {
-            'timestamp': timestamp,
-            'lead_id': lead_id,
-            'first_name': data['firstName'],
-            'last_name': data['lastName'],
-            'email': data['email'],
-            'company': data.get('company'),
-            'role': data.get('role'),
-            'phone': data.get('phone'),
-            'topic': data['topic'],
-            'notes': data.get('notes'),
-            'consent': 'Yes' if data['consent'] else 'No',
-            'source_page': data.get('sourcePage'),
-            'utm_source': data.get('utmSource'),
-            'utm_medium': data.get('utmMedium'),
-            'utm_campaign': data.get('utmCampaign'),
-            'utm_term': data.get('utmTerm'),
-            'utm_content': data.get('utmContent')
-        }
+        print(f"Lead {lead_id} submitted. User email sent: {user_email_sent}, Internal email sent: {internal_email_sent}")
+    else:
+        print(f"Lead {lead_id} submitted. Email credentials not configured - emails not sent.")
 
-        # Write to Excel file
-        if not append_to_excel(lead_data):
-            return jsonify({'error': 'Failed to save lead data'}), 500
+# Validation, dedupe and the store write are shared with the other services (lead_capture.py)
+capture = lead_capture.LeadCapture(store, on_stored=send_lead_emails)
 
-        # Send emails if credentials are configured
-        if EMAIL_PASSWORD:
-            # Send confirmation email to user
-            conf_subject, conf_body = get_confirmation_email_template(data['firstName'], data['topic'])
-            user_email_sent = send_email(data['email'], conf_subject, conf_body)
-            
-            # Send internal notification email
-            int_subject, int_body = get_internal_notification_template(lead_data)
-            internal_email_sent = send_email(INTERNAL_EMAIL, int_subject, int_body)
-            
-            print(f"Lead {lead_id} submitted. User email sent: {user_email_sent}, Internal email sent: {internal_email_sent}")
-        else:
-            print(f"Lead {lead_id} submitted. Email credentials not configured - emails not sent.")
-
-        return jsonify({
-            'message': 'Lead submitted successfully',
-            'lead_id': lead_id,
-            'timestamp': timestamp
-        }), 200
-        
-    except Exception as e:
-        print(f"Error processing lead submission: {e}")
-        return jsonify({'error': str(e)}), 500
+@app.route('/submit-lead', methods=['POST'])
+def submit_lead():
+    """Handle lead submission from the website form."""
+    submission = capture.submit(request.remote_addr, request.headers,
+                                lambda: lead_schema.read_limited(request.stream, request.content_length))
+    return submission.body, submission.status, submission.headers
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -278,24 +191,23 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'excel_file_exists': os.path.exists(EXCEL_FILE)
+        'excel_file_exists': journal is not None and bool(journal.shard_files())
     }), 200
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Get basic statistics about the leads."""
     try:
-        if not os.path.exists(EXCEL_FILE):
-            return jsonify({'total_leads': 0, 'excel_file_exists': False}), 200
-        
-        workbook = load_workbook(EXCEL_FILE)
-        worksheet = workbook.active
-        total_leads = worksheet.max_row - 1  # Subtract header row
+        if journal is None:
+            return jsonify({'total_leads': store.count(), 'lead_store': store.name}), 200
+        stats = journal.stats()
         
         return jsonify({
-            'total_leads': max(0, total_leads),
-            'excel_file_exists': True,
-            'excel_file': EXCEL_FILE
+            'total_leads': stats['total_leads'],
+            'pending_compaction': stats['pending_rows'],
+            'excel_file_exists': os.path.exists(journal.current_file()),
+            'excel_file': journal.current_file(),
+            'shards': stats['shards']
         }), 200
         
     except Exception as e:
@@ -306,8 +218,10 @@ if __name__ == '__main__':
     print(f"Excel file: {EXCEL_FILE}")
     print(f"Email configured: {'Yes' if EMAIL_PASSWORD else 'No (set EMAIL_PASSWORD environment variable)'}")
     
-    # Initialize Excel file
+    # Initialize Excel file and replay the journal
     initialize_excel_file()
+    if journal is not None:
+        journal.open()
     
     # Start the Flask application
     app.run(debug=True, host='0.0.0.0', port=5000)
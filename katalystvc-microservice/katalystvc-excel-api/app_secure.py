@@ -1,46 +1,80 @@
 #!/usr/bin/env python3
 """
 KatalystVC Excel API Microservice (Secure Version)
-A Flask-based API for capturing website form submissions and storing them in an Excel file.
+A Flask-based API for capturing website form submissions and storing them in an Excel file
+(or in whichever lead store LEAD_STORE names; see lead_store.py).
 This version uses secure credential management with .env files.
+With FAST_START=true (serverless / autoscaled deployments) it never prompts for
+credentials, which then come from the environment or .env, and the workbook is
+set up on the first request instead of at startup.
 """
 
+import atexit
 import os
-import smtplib
+import sys
+import threading
 from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from openpyxl import Workbook, load_workbook
-from openpyxl.utils import get_column_letter
 from dotenv import load_dotenv
-import getpass
+
+# Shared helpers live in the parent katalystvc-microservice directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from smtp_pool import SMTPConnectionPool
+from lead_queries import QueryError
+from email_templates import build_message, render_confirmation, render_internal_notification
+import lead_capture
+import lead_schema
+import lead_store
+import metrics
+import notification_digest
+import rate_limit
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+metrics.instrument_flask(app)
 
 # Configuration - Load from .env file
-EXCEL_FILE = 'katalystvc_leads.xlsx'
+LEAD_STORE = os.getenv('LEAD_STORE', 'excel')  # sqlite, excel, jsonl or fanout (see lead_store.py)
+EXCEL_FILE = lead_store.EXCEL_FILE
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.office365.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
 EMAIL_USER = os.getenv('EMAIL_USER', 'support@katalystvc.com')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD', '')  # Will be loaded from .env file
 INTERNAL_EMAIL = os.getenv('INTERNAL_EMAIL', 'support@katalystvc.com')
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'  # Disable for a local test relay
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '4'))
+SMTP_RATE_LIMIT = os.getenv('SMTP_RATE_LIMIT', '30/minute')  # Outbound sends per process; 0 = unlimited
+FAST_START = os.getenv('FAST_START', 'false').lower() == 'true'  # No prompts; workbook set up on first request
+
+def create_smtp_pool():
+    """Build the shared SMTP session pool from the current configuration."""
+    return SMTPConnectionPool(SMTP_SERVER, SMTP_PORT, EMAIL_USER, EMAIL_PASSWORD,
+                              use_tls=SMTP_USE_TLS, max_size=SMTP_POOL_SIZE, send_rate=SMTP_RATE_LIMIT)
+
+# Authenticated SMTP sessions shared by every request thread
+smtp_pool = create_smtp_pool()
 
 # Excel column headers
-EXCEL_HEADERS = [
-    'Timestamp', 'Lead ID', 'First Name', 'Last Name', 'Email', 'Company', 
-    'Role', 'Phone', 'Topic', 'Notes', 'Consent', 'Source Page', 
-    'UTM Source', 'UTM Medium', 'UTM Campaign', 'UTM Term', 'UTM Content'
-]
+EXCEL_HEADERS = lead_store.EXCEL_HEADERS
+
+# With LEAD_STORE=excel (or fanout's replica), submissions land in the journal and the
+# compactor flushes them into EXCEL_FILE (or its monthly shards); other stores have no journal
+store = lead_store.open_store(LEAD_STORE)
+journal = lead_store.excel_journal(store)
+
+# Per-IP and global token buckets for /submit-lead (see rate_limit.py)
+limiter = rate_limit.SubmitRateLimiter()
 
 def initialize_excel_file():
-    """Initialize the Excel file with headers if it doesn't exist."""
-    if not os.path.exists(EXCEL_FILE):
+    """Initialize the Excel file with headers if it doesn't exist (monthly shards are created by the compactor)."""
+    if journal is not None and not journal.sharded and not os.path.exists(EXCEL_FILE):
+        from openpyxl import Workbook
+        from openpyxl.utils import get_column_letter
+
         workbook = Workbook()
         worksheet = workbook.active
         worksheet.title = "Leads"
@@ -57,168 +91,81 @@ def initialize_excel_file():
         workbook.save(EXCEL_FILE)
         print(f"Created new Excel file: {EXCEL_FILE}")
 
-def get_next_lead_id():
-    """Get the next available lead ID by checking the last row in the Excel file."""
-    try:
-        workbook = load_workbook(EXCEL_FILE)
-        worksheet = workbook.active
-        
-        # Find the last row with data
-        last_row = worksheet.max_row
-        if last_row <= 1:  # Only headers exist
-            return 1
-        
-        # Get the last lead ID and increment
-        last_lead_id = worksheet.cell(row=last_row, column=2).value  # Lead ID is in column 2
-        return (last_lead_id or 0) + 1
-    except Exception as e:
-        print(f"Error getting next lead ID: {e}")
-        return 1
-
-def append_to_excel(lead_data):
-    """Append lead data to the Excel file."""
-    try:
-        workbook = load_workbook(EXCEL_FILE)
-        worksheet = workbook.active
-        
-        # Find the next empty row
-        next_row = worksheet.max_row + 1
-        
-        # Prepare data row
-        data_row = [
-            lead_data.get('timestamp'),
-            lead_data.get('lead_id'),
-            lead_data.get('first_name'),
-            lead_data.get('last_name'),
-            lead_data.get('email'),
-            lead_data.get('company'),
-            lead_data.get('role'),
-            lead_data.get('phone'),
-            lead_data.get('topic'),
-            lead_data.get('notes'),
-            lead_data.get('consent'),
-            lead_data.get('source_page'),
-            lead_data.get('utm_source'),
-            lead_data.get('utm_medium'),
-            lead_data.get('utm_campaign'),
-            lead_data.get('utm_term'),
-            lead_data.get('utm_content')
-        ]
-        
-        # Write data to the worksheet
-        for col_num, value in enumerate(data_row, 1):
-            worksheet.cell(row=next_row, column=col_num, value=value)
-        
-        # Save the workbook
-        workbook.save(EXCEL_FILE)
-        print(f"Successfully added lead {lead_data.get('lead_id')} to Excel file")
-        return True
-        
-    except Exception as e:
-        print(f"Error writing to Excel file: {e}")
-        return False
-
-def send_email(to_email, subject, body, is_html=False):
-    """Send an email using SMTP."""
+storage_ready = False
+storage_lock = threading.Lock()
+
+def init_storage():
+    """Create the Excel file if needed and replay the journal, once per process."""
+    global storage_ready
+    if storage_ready:
+        return
+    with storage_lock:
+        if not storage_ready:
+            initialize_excel_file()
+            if journal is not None:
+                journal.open()
+            if isinstance(store, lead_store.FanoutStore):
+                store.start()
+            storage_ready = True
+
+def send_email(to_email, subject, body, is_html=False, html_body=None):
+    """Send an email using SMTP, with html_body as the HTML alternative to a plain body."""
     if not EMAIL_PASSWORD:
         print("Email credentials not configured. Skipping email send.")
         return False
     
     try:
-        msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        if is_html:
-            msg.attach(MIMEText(body, 'html'))
-        else:
-            msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_USER, to_email, text)
-        server.quit()
+        text = build_message(EMAIL_USER, to_email, subject, body, is_html, html_body).as_string()
+        with metrics.stage('smtp_send'):
+            smtp_pool.sendmail(EMAIL_USER, to_email, text)
+        metrics.EMAILS_SENT.inc()
         return True
     except Exception as e:
+        metrics.EMAIL_FAILURES.inc()
         print(f"Email sending failed: {e}")
         return False
 
-def get_confirmation_email_template(first_name, topic):
-    """Generate confirmation email for the user."""
-    topic_mapping = {
-        'infra': 'AI-Ready Infrastructure Audit',
-        'fhir': 'FHIR/TEFCA 90-Day Sprint'
-    }
-    
-    topic_display = topic_mapping.get(topic, topic)
-    download_link = f"https://katalystvc.com/downloads/{topic}-brief.html"
-    
-    subject = "Your KatalystVC Inquiry Has Been Received - What's Next?"
-    
-    body = f"""Dear {first_name},
-
-Thank you for reaching out to KatalystVC. We've successfully received your inquiry regarding {topic_display}.
-
-We appreciate your interest in our specialized technical consulting services. Our team is currently reviewing your submission and will get back to you within 24-48 business hours to schedule your 20-minute diagnostic session.
-
-In the meantime, you can access your requested marketing brief here:
-{download_link}
-
-We look forward to connecting with you and exploring how KatalystVC can help you achieve your technical objectives with tight, efficient, and smart solutions.
-
-Best regards,
-
-The KatalystVC Team
-support@katalystvc.com"""
-    
-    return subject, body
-
-def get_internal_notification_template(lead_data):
-    """Generate internal notification email for the team."""
-    subject = f"NEW KatalystVC Lead: {lead_data['first_name']} {lead_data['last_name']} - {lead_data['topic']}"
-    
-    body = f"""Hello Team,
-
-A new lead has been submitted via the KatalystVC website. Please find the details below:
-
-**Lead Information:**
-• Lead ID: {lead_data['lead_id']}
-• Name: {lead_data['first_name']} {lead_data['last_name']}
-• Email: {lead_data['email']}
-• Company: {lead_data.get('company', 'N/A')}
-• Role: {lead_data.get('role', 'N/A')}
-• Phone: {lead_data.get('phone', 'N/A')}
-• Topic of Interest: {lead_data['topic']}
-• Notes/Message: {lead_data.get('notes', 'N/A')}
-• Consent to Contact: {'Yes' if lead_data['consent'] else 'No'}
-
-**Tracking Information:**
-• Submission Date: {lead_data['timestamp']}
-• Source Page: {lead_data.get('source_page', 'N/A')}
-• UTM Source: {lead_data.get('utm_source', 'N/A')}
-• UTM Medium: {lead_data.get('utm_medium', 'N/A')}
-• UTM Campaign: {lead_data.get('utm_campaign', 'N/A')}
-• UTM Term: {lead_data.get('utm_term', 'N/A')}
-• UTM Content: {lead_data.get('utm_content', 'N/A')}
-
-**Action Required:**
-• Follow up with the lead within 24-48 business hours.
-• Lead data has been saved to {EXCEL_FILE}
-
-Best regards,
-
-KatalystVC Automated System"""
-    
-    return subject, body
+def internal_template_data(lead_data):
+    """Journaled lead data keyed the way the shared email templates expect."""
+    return dict(lead_data, id=lead_data['lead_id'], submission_time=lead_data['timestamp'])
+
+def get_internal_notification(lead_data):
+    """Render the internal notification for a stored lead (see email_templates)."""
+    if journal is not None:
+        location = journal.shard_file(journal.shard_key(lead_data['timestamp']))
+    else:
+        location = f"the {store.name} lead store"
+    return render_internal_notification(
+        internal_template_data(lead_data),
+        record_note=f"Lead {lead_data['lead_id']} has been saved to {location}"
+    )
+
+def send_internal_digest(email):
+    """Send one digest of buffered internal notifications, raising if it wasn't sent so it is retried."""
+    if not send_email(INTERNAL_EMAIL, email.subject, email.text, html_body=email.html):
+        raise RuntimeError(f"Internal digest not sent to {INTERNAL_EMAIL}")
+
+# Optional digest mode: internal notifications are buffered and sent as one summary
+internal_digest = None
+if notification_digest.DIGEST_ENABLED and EMAIL_PASSWORD:
+    internal_digest = notification_digest.LeadDigestBuffer(send_internal_digest)
+    atexit.register(internal_digest.flush)
 
 def setup_credentials():
-    """Setup credentials securely if .env file doesn't exist."""
+    """Setup credentials securely if .env file doesn't exist.
+
+    Only prompts when run from a terminal without FAST_START; otherwise the
+    credentials are whatever the environment provides.
+    """
     env_file = '.env'
     
+    if not os.path.exists(env_file) and (FAST_START or not sys.stdin.isatty()):
+        print("No .env file and not running interactively - using credentials from the environment.")
+        return False
+
     if not os.path.exists(env_file):
+        import getpass
+
         print("Setting up secure credentials for the first time...")
         print("This information will be stored in a .env file and should be kept secure.")
         print()
@@ -255,121 +202,130 @@ def setup_credentials():
     
     return False
 
+if FAST_START:
+    app.before_request(init_storage)
+
+def send_lead_emails(submission):
+    """After each new lead: send its emails inline, if credentials are configured."""
+    data, lead_data = submission.data, submission.record
+    lead_id = lead_data['lead_id']
+    submission.body['timestamp'] = lead_data['timestamp']  # This API's response also carries the submission time
+    if not EMAIL_PASSWORD:
+        print(f"Lead {lead_id} submitted. Email credentials not configured - emails not sent.")
+        return
+
+    digest = internal_digest is not None and notification_digest.should_digest(lead_data['topic'])
+    with metrics.stage('render_templates'):
+        confirmation = render_confirmation(data['firstName'], data['topic'])
+        if not digest:
+            notification = get_internal_notification(lead_data)
+
+    # Send confirmation email to user
+    user_email_sent = send_email(data['email'], confirmation.subject, confirmation.text,
+                                 html_body=confirmation.html)
+
+    # Send internal notification email, or leave it for the next digest
+    if digest:
+        internal_digest.add(internal_template_data(lead_data))
+        internal_email_sent = 'queued for digest'
+    else:
+        internal_email_sent = send_email(INTERNAL_EMAIL, notification.subject, notification.text,
+                                         html_body=notification.html)
+
+    print(f"Lead {lead_id} submitted. User email sent: {user_email_sent}, Internal email sent: {internal_email_sent}")
+
+# Rate limit, validation, dedupe and the store write are shared with the other services (lead_capture.py)
+capture = lead_capture.LeadCapture(store, limiter, on_stored=send_lead_emails)
+
 @app.route('/submit-lead', methods=['POST'])
 def submit_lead():
     """Handle lead submission from the website form."""
-    data = request.get_json()
-
-    # Validate required fields
-    required_fields = ['firstName', 'lastName', 'email', 'topic', 'consent']
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    try:
-        # Generate lead ID and timestamp
-        lead_id = get_next_lead_id()
-        timestamp = datetime.now().isoformat()
-        
-        # Prepare lead data for Excel
-        lead_data = {
-            'timestamp': timestamp,
-            'lead_id': lead_id,
-            'first_name': data['firstName'],
-            'last_name': data['lastName'],
-            'email': data['email'],
-            'company': data.get('company'),
-            'role': data.get('role'),
-            'phone': data.get('phone'),
-            'topic': data.get('topic'),
-            'notes': data.get('notes'),
-            'consent': 'Yes' if data['consent'] else 'No',
-            'source_page': data.get('sourcePage'),
-            'utm_source': data.get('utmSource'),
-            'utm_medium': data.get('utmMedium'),
-            'utm_campaign': data.get('utmCampaign'),
-            'utm_term': data.get('utmTerm'),
-            'utm_content': data.get('utmContent')
-        }
-
-        # Write to Excel file
-        if not append_to_excel(lead_data):
-            return jsonify({'error': 'Failed to save lead data'}), 500
-
-        # Send emails if credentials are configured
-        if EMAIL_PASSWORD:
-            # Send confirmation email to user
-            conf_subject, conf_body = get_confirmation_email_template(data['firstName'], data['topic'])
-            user_email_sent = send_email(data['email'], conf_subject, conf_body)
-            
-            # Send internal notification email
-            int_subject, int_body = get_internal_notification_template(lead_data)
-            internal_email_sent = send_email(INTERNAL_EMAIL, int_subject, int_body)
-            
-            print(f"Lead {lead_id} submitted. User email sent: {user_email_sent}, Internal email sent: {internal_email_sent}")
-        else:
-            print(f"Lead {lead_id} submitted. Email credentials not configured - emails not sent.")
-
-        return jsonify({
-            'message': 'Lead submitted successfully',
-            'lead_id': lead_id,
-            'timestamp': timestamp
-        }), 200
-        
-    except Exception as e:
-        print(f"Error processing lead submission: {e}")
-        return jsonify({'error': str(e)}), 500
+    submission = capture.submit(request.remote_addr, request.headers,
+                                lambda: lead_schema.read_limited(request.stream, request.content_length))
+    return submission.body, submission.status, submission.headers
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({
+    health = {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'excel_file_exists': os.path.exists(EXCEL_FILE),
-        'email_configured': bool(EMAIL_PASSWORD)
-    }), 200
+        'excel_file_exists': journal is not None and bool(journal.shard_files()),
+        'email_configured': bool(EMAIL_PASSWORD),
+        'smtp_pool': smtp_pool.stats(),
+        'rate_limit': limiter.stats(),
+        'lead_store': store.stats()
+    }
+    if internal_digest is not None:
+        health['internal_digest'] = {'pending_leads': internal_digest.pending()}
+    return jsonify(health), 200
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
-    """Get basic statistics about the leads."""
+    """Get statistics about the leads: totals plus counts by topic, UTM, source page and day or week.
+
+    Query parameters: since, until (inclusive YYYY-MM-DD) and bucket (day or week).
+    """
     try:
-        if not os.path.exists(EXCEL_FILE):
-            return jsonify({'total_leads': 0, 'excel_file_exists': False}), 200
-        
-        workbook = load_workbook(EXCEL_FILE)
-        worksheet = workbook.active
-        total_leads = worksheet.max_row - 1  # Subtract header row
+        analytics = store.analytics(request.args)
         
-        return jsonify({
-            'total_leads': max(0, total_leads),
-            'excel_file_exists': True,
-            'excel_file': EXCEL_FILE
-        }), 200
+        if journal is not None:
+            stats = journal.stats()
+            analytics.update({
+                'pending_compaction': stats['pending_rows'],
+                'excel_file_exists': os.path.exists(journal.current_file()),
+                'excel_file': journal.current_file(),
+                'shard_by': stats['shard_by'],
+                'shards': stats['shards']
+            })
+        return jsonify(analytics), 200
         
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/leads/<int:lead_id>', methods=['GET'])
+def get_lead(lead_id):
+    """Look up one lead by ID; in the journal, the manifest says which monthly shard to open."""
+    try:
+        lead = store.get(lead_id)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    if lead is None:
+        return jsonify({'error': f'Lead {lead_id} not found'}), 404
+    return jsonify(lead), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus-style request, stage, lead and email counters for this process."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     print("KatalystVC Excel API Microservice (Secure Version) starting...")
-    print(f"Excel file: {EXCEL_FILE}")
+    if journal is not None:
+        print(f"Excel file: {EXCEL_FILE}" + (" (sharded by month)" if journal.sharded else ""))
+    else:
+        print(f"Lead store: {LEAD_STORE}")
     
     # Setup credentials if needed
     setup_credentials()
     
     # Reload environment variables after potential setup
-    global EMAIL_PASSWORD, EMAIL_USER, SMTP_SERVER, SMTP_PORT, INTERNAL_EMAIL
     EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD', '')
     EMAIL_USER = os.getenv('EMAIL_USER', 'support@katalystvc.com')
     SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.office365.com')
     SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
     INTERNAL_EMAIL = os.getenv('INTERNAL_EMAIL', 'support@katalystvc.com')
+    smtp_pool = create_smtp_pool()
     
     print(f"Email configured: {'Yes' if EMAIL_PASSWORD else 'No'}")
     print(f"Email user: {EMAIL_USER}")
     print(f"SMTP server: {SMTP_SERVER}:{SMTP_PORT}")
     
-    # Initialize Excel file
-    initialize_excel_file()
+    # Initialize Excel file and replay the journal (fast start leaves it to the first request)
+    if not FAST_START:
+        init_storage()
     
     # Start the Flask application
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,679 @@
+"""
+KatalystVC Lead Journal
+An append-only JSONL journal in front of the Excel workbook. Submissions are
+appended and fsynced to the journal on the request path; a background compactor
+batch-flushes new journal rows into the workbook using openpyxl write-only mode.
+Lead counts and IDs are served from the journal, not from the workbook.
+
+Lead IDs are allocated and appended under an fcntl lock on a sidecar lock file,
+so any number of threads and worker processes can share one journal. Only one
+process at a time compacts, which makes the compactor the single writer of the
+workbook. openpyxl is imported by the compactor and workbook lookups when they
+first run, so appending (the request path) never loads it.
+
+With EXCEL_SHARD_BY=month (the default) the workbook is split into one file
+per submission month, katalystvc_leads-2025-01.xlsx and so on, and a compaction
+rebuilds only the shards its new rows belong to (normally just the current
+month), so its cost no longer grows with history. A small JSON manifest next to
+the workbook lists each shard's file, row count and lead ID range; /stats and
+ID lookups read the manifest instead of opening workbooks. Closed months are
+never rewritten, so they can be moved elsewhere (see archive_shards) without
+losing their counts. A workbook from before sharding is kept as-is as the
+"workbook" shard. EXCEL_SHARD_BY=none keeps the single ever-growing workbook.
+
+Once a compaction's checkpoint is written, the journal is rotated down to the
+rows appended while it ran, so the journal holds only uncompacted leads and
+its size doesn't grow with history. Each rotation bumps the checkpoint's
+generation; readers that tail the journal (the /stats rollup) keep a
+(generation, offset) position and use read_since(), which catches them up
+from the workbook when a rotation has moved rows they hadn't read yet.
+
+Only appends (and open()) start the compactor thread; lookups, stats and the
+maintenance commands below read the files without it:
+
+    python lead_journal.py manifest
+    python lead_journal.py archive --before 2025-01 --to archive/
+"""
+
+import argparse
+import fcntl
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+COMPACT_INTERVAL_SECONDS = float(os.getenv('JOURNAL_COMPACT_INTERVAL_SECONDS', '60'))
+COMPACT_MAX_ROWS = int(os.getenv('JOURNAL_COMPACT_MAX_ROWS', '500'))
+EXCEL_SHARD_BY = os.getenv('EXCEL_SHARD_BY', 'month')  # month or none
+
+SHARD_MODES = ('month', 'none')
+# Manifest key of excel_file itself: the whole workbook with sharding off, and
+# the pre-sharding workbook (kept as-is) with it on
+MAIN_SHARD = 'workbook'
+
+# lead_data keys in workbook column order (matches EXCEL_HEADERS in the apps)
+LEAD_FIELDS = [
+    'timestamp', 'lead_id', 'first_name', 'last_name', 'email', 'company',
+    'role', 'phone', 'topic', 'notes', 'consent', 'source_page',
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content'
+]
+
+TAIL_CHUNK_BYTES = 8192
+
+
+def _write_json_atomic(path, data):
+    # A temp file of its own, so writers in other processes never share (or remove) it
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_last_line(fd, size):
+    """Return (last complete line, offset just past it) by reading backwards."""
+    end = size
+    buffer = b''
+    position = size
+    while position > 0:
+        step = min(TAIL_CHUNK_BYTES, position)
+        position -= step
+        buffer = os.pread(fd, step, position) + buffer
+        if end == size:
+            # Ignore a torn, newline-less tail left by a crashed writer
+            cut = buffer.rfind(b'\n')
+            if cut == -1:
+                continue
+            end = position + cut + 1
+            buffer = buffer[:cut + 1]
+        start = buffer.rfind(b'\n', 0, len(buffer) - 1)
+        if start != -1 or position == 0:
+            return buffer[start + 1:], end
+    return None, 0
+
+
+class LeadJournal:
+    """Append-only lead journal with periodic compaction into an xlsx workbook."""
+
+    def __init__(self, journal_file, excel_file, headers, sheet_title='Leads', shard_by=EXCEL_SHARD_BY):
+        if shard_by not in SHARD_MODES:
+            raise ValueError(f"shard_by must be one of: {', '.join(SHARD_MODES)}")
+        self.journal_file = journal_file
+        self.excel_file = excel_file
+        self.shard_by = shard_by
+        self.manifest_file = f"{os.path.splitext(excel_file)[0]}.manifest.json"
+        self.checkpoint_file = f"{journal_file}.checkpoint"
+        self.lock_file = f"{journal_file}.lock"
+        self.compact_lock_file = f"{journal_file}.compact.lock"
+        self.headers = headers
+        self.sheet_title = sheet_title
+
+        self._open_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._prepared = False
+        self._opened = False
+        self._appended = 0  # Appends by this process since its last compaction
+
+    @contextmanager
+    def _locked(self, path, mode):
+        # flock is held per open file description, so this excludes other
+        # threads of this process as well as other processes
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, mode)
+            yield
+        finally:
+            os.close(fd)
+
+    def open(self):
+        """Write the initial checkpoint if needed and start the compactor."""
+        self._prepare()
+        with self._open_lock:
+            if self._opened:
+                return
+            self._opened = True
+
+        thread = threading.Thread(target=self._compactor_loop, name='journal-compactor', daemon=True)
+        thread.start()
+
+    def _prepare(self):
+        """Write the initial checkpoint and manifest if needed, without starting the compactor."""
+        with self._open_lock:
+            if self._prepared:
+                return
+            with self._locked(self.lock_file, fcntl.LOCK_EX):
+                if not os.path.exists(self.checkpoint_file):
+                    _write_json_atomic(self.checkpoint_file, self._bootstrap_checkpoint())
+                if not os.path.exists(self.manifest_file):
+                    _write_json_atomic(self.manifest_file, self._bootstrap_manifest(self._read_checkpoint()))
+            self._prepared = True
+
+    def _bootstrap_checkpoint(self):
+        # First run against an existing workbook: take its rows as already compacted
+        workbook_rows = 0
+        last_lead_id = 0
+        if os.path.exists(self.excel_file):
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(self.excel_file, read_only=True)
+            for row in workbook.active.iter_rows(min_row=2, values_only=True):
+                if not any(value is not None for value in row):
+                    continue
+                workbook_rows += 1
+                if len(row) > 1 and isinstance(row[1], int):
+                    last_lead_id = max(last_lead_id, row[1])
+            workbook.close()
+        return {'offset': 0, 'generation': 0, 'workbook_rows': workbook_rows, 'last_lead_id': last_lead_id}
+
+    def _bootstrap_manifest(self, checkpoint):
+        # Whatever the checkpoint says is compacted lives in the existing workbook (if any)
+        shards = {}
+        if os.path.exists(self.excel_file):
+            shards[MAIN_SHARD] = {'file': self.excel_file, 'rows': checkpoint['workbook_rows'],
+                           'first_lead_id': None, 'last_lead_id': checkpoint['last_lead_id'] or None}
+        return {'shard_by': self.shard_by, 'shards': shards}
+
+    @property
+    def sharded(self):
+        return self.shard_by != 'none'
+
+    def shard_key(self, timestamp=None):
+        """Manifest key of the shard a lead submitted at `timestamp` (ISO 8601) belongs to."""
+        if not self.sharded:
+            return MAIN_SHARD
+        month = str(timestamp or '')[:7]
+        if len(month) != 7 or month[4] != '-' or not (month[:4] + month[5:]).isdigit():
+            month = datetime.now().strftime('%Y-%m')
+        return month
+
+    def shard_file(self, key):
+        """Workbook path for a shard key (where compaction writes it)."""
+        if key == MAIN_SHARD:
+            return self.excel_file
+        base, extension = os.path.splitext(self.excel_file)
+        return f"{base}-{key}{extension}"
+
+    def current_file(self):
+        """The workbook new submissions are compacted into."""
+        return self.shard_file(self.shard_key(datetime.now().isoformat()))
+
+    def read_manifest(self):
+        """{'shard_by', 'shards': {key: {file, rows, first_lead_id, last_lead_id}}}"""
+        self._prepare()
+        with open(self.manifest_file) as f:
+            return json.load(f)
+
+    def shard_files(self):
+        """Existing shard workbooks, oldest first (the pre-sharding workbook first)."""
+        shards = self.read_manifest()['shards']
+        keys = sorted(shards, key=lambda key: (key != MAIN_SHARD, key))
+        return [shards[key]['file'] for key in keys if os.path.exists(shards[key]['file'])]
+
+    def _read_checkpoint(self):
+        with open(self.checkpoint_file) as f:
+            return json.load(f)
+
+    def _journal_tail(self, fd, checkpoint):
+        """Last lead ID in the journal and the offset of its clean end."""
+        size = os.fstat(fd).st_size
+        line, end = _read_last_line(fd, size)
+        if line is None:
+            return checkpoint['last_lead_id'], end
+        return max(json.loads(line)['lead_id'], checkpoint['last_lead_id']), end
+
+    def append(self, lead_data):
+        """Allocate the next lead ID and durably append the lead (write + fsync).
+
+        ID allocation and the append happen under one exclusive lock, so two
+        submits can never receive the same ID. Sets and returns lead_data['lead_id'].
+        """
+        self.append_many([lead_data])
+        return lead_data['lead_id']
+
+    def _pending_ids(self, fd, offset, end):
+        """Lead IDs of the complete journal rows between offset and end (not yet compacted)."""
+        if end <= offset:
+            return []
+        return [json.loads(line)['lead_id'] for line in os.pread(fd, end - offset, offset).splitlines()]
+
+    def _compacted_ids(self, lead_ids):
+        """Those of lead_ids that are in the workbook (opening only the shards whose ID range covers one)."""
+        found = set()
+        if not lead_ids:
+            return found
+        for entry in self.read_manifest()['shards'].values():
+            first, last = entry['first_lead_id'], entry['last_lead_id']
+            wanted = {lead_id for lead_id in lead_ids
+                      if last is not None and lead_id <= last and (first is None or lead_id >= first)}
+            if not wanted or not os.path.exists(entry['file']):
+                continue
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(entry['file'], read_only=True)
+            try:
+                for row in workbook.active.iter_rows(min_row=2, values_only=True):
+                    if len(row) > 1 and row[1] in wanted:
+                        found.add(row[1])
+            finally:
+                workbook.close()
+        return found
+
+    def append_many(self, leads, keep_ids=False):
+        """Append several leads with one write and one fsync; returns the appended IDs.
+
+        Leads get consecutive new IDs, unless keep_ids is set (copying leads
+        whose IDs were allocated elsewhere, such as leads.db): then each keeps
+        its lead_id, leads are appended in ID order, and a lead whose ID is
+        already in the journal or the workbook is skipped, whatever order the
+        copies arrive in. A journal either allocates IDs or keeps them, never both.
+        """
+        self.open()
+        appended = []
+        compacted = set()
+        if keep_ids:
+            leads = sorted(leads, key=lambda lead_data: lead_data['lead_id'])
+            # Workbook lookups happen outside the lock, so they never hold up appends.
+            # A lead compacted in between is appended again and dropped by the compactor.
+            compacted_up_to = self._read_checkpoint()['last_lead_id']
+            compacted = self._compacted_ids([lead_data['lead_id'] for lead_data in leads
+                                             if lead_data['lead_id'] <= compacted_up_to])
+        with self._locked(self.lock_file, fcntl.LOCK_EX):
+            checkpoint = self._read_checkpoint()
+            fd = os.open(self.journal_file, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                last_lead_id, end = self._journal_tail(fd, checkpoint)
+                if end != os.fstat(fd).st_size:
+                    os.ftruncate(fd, end)
+                known = compacted | set(self._pending_ids(fd, checkpoint['offset'], end)) if keep_ids else ()
+                lines = []
+                for lead_data in leads:
+                    if keep_ids:
+                        if lead_data['lead_id'] in known:
+                            continue
+                        known.add(lead_data['lead_id'])
+                    else:
+                        lead_data['lead_id'] = last_lead_id + 1
+                        last_lead_id = lead_data['lead_id']
+                    appended.append(lead_data['lead_id'])
+                    lines.append(json.dumps(lead_data, default=str) + '\n')
+                if lines:
+                    os.write(fd, ''.join(lines).encode('utf-8'))
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self._appended += len(appended)
+        if self._appended >= COMPACT_MAX_ROWS:
+            self._wakeup.set()
+        return appended
+
+    def stats(self):
+        """Journal counters for /stats and /health."""
+        self._prepare()
+        with self._locked(self.lock_file, fcntl.LOCK_SH):
+            checkpoint = self._read_checkpoint()
+            fd = os.open(self.journal_file, os.O_RDONLY | os.O_CREAT, 0o600)
+            try:
+                _, end = self._journal_tail(fd, checkpoint)
+                pending_ids = self._pending_ids(fd, checkpoint['offset'], end)
+            finally:
+                os.close(fd)
+
+        shards = self.read_manifest()['shards']
+        return {
+            'total_leads': checkpoint['workbook_rows'] + len(pending_ids),
+            'workbook_rows': checkpoint['workbook_rows'],
+            'pending_rows': len(pending_ids),
+            'last_lead_id': max(pending_ids + [checkpoint['last_lead_id']]),
+            'shard_by': self.shard_by,
+            'shards': {key: shards[key]['rows'] for key in sorted(shards)}
+        }
+
+    def next_lead_id(self):
+        """The ID the next appended lead will receive (informational only)."""
+        return self.stats()['last_lead_id'] + 1
+
+    def total_leads(self):
+        """Leads in the workbook plus those still waiting in the journal."""
+        return self.stats()['total_leads']
+
+    def _read_pending(self):
+        """(checkpoint, complete journal rows past it, offset just past the last one).
+
+        The checkpoint is read and the journal opened under the shared lock, so
+        a rotation that lands while the rows are read can't move them.
+        """
+        checkpoint, f = self._snapshot()
+        records, end = self._read_rows(f, checkpoint['offset'])
+        return checkpoint, records, end
+
+    def _snapshot(self):
+        """The checkpoint and the journal it refers to (an open file, or None if there is none yet)."""
+        with self._locked(self.lock_file, fcntl.LOCK_SH):
+            checkpoint = self._read_checkpoint()
+            try:
+                return checkpoint, open(self.journal_file, 'rb')
+            except FileNotFoundError:
+                return checkpoint, None
+
+    @staticmethod
+    def _read_rows(f, offset):
+        """Complete rows of an open journal from offset on, and the offset just past them; closes f."""
+        records = []
+        end = offset
+        if f is None:
+            return records, end
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Torn tail of an in-progress append
+                end += len(line)
+                records.append(json.loads(line))
+        return records, end
+
+    def start_position(self):
+        """read_since() position of the start of the journal as it is now."""
+        self._prepare()
+        return self._read_checkpoint().get('generation', 0), 0
+
+    def read_since(self, position, after_id=0):
+        """Leads journaled since `position`, and the position to pass next time.
+
+        A position is (generation, offset). If the journal has been rotated
+        since it was taken, the rows rotated out are read back from the shards
+        (those with an ID above after_id) ahead of the current journal's rows.
+        """
+        self._prepare()
+        generation, offset = position
+        checkpoint, f = self._snapshot()
+        current = checkpoint.get('generation', 0)
+        if generation == current:
+            records, end = self._read_rows(f, offset)
+            return records, (current, end)
+        records, end = self._read_rows(f, 0)
+        return list(heapq.merge(self._iter_compacted(after_id), records,
+                                key=lambda record: record['lead_id'])), (current, end)
+
+    def _rotate(self, compacted_end):
+        """Replace the journal with its rows past compacted_end (call with the append lock held).
+
+        The rows are copied to a new file that is swapped in, so a reader that
+        opened the old journal keeps reading it. Rows cut from a crashed
+        rotation are still in the workbook; rows left in one are skipped by
+        the next compaction.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.journal_file)),
+                                        prefix=f"{os.path.basename(self.journal_file)}.", suffix='.tmp')
+        try:
+            with open(self.journal_file, 'rb') as source, os.fdopen(fd, 'wb') as target:
+                source.seek(compacted_end)
+                shutil.copyfileobj(source, target)
+                target.flush()
+                os.fsync(target.fileno())
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.journal_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _new_worksheet(self, workbook):
+        from openpyxl.utils import get_column_letter
+
+        worksheet = workbook.create_sheet(self.sheet_title)
+        for col_num, header in enumerate(self.headers, 1):
+            column_letter = get_column_letter(col_num)
+            worksheet.column_dimensions[column_letter].width = max(len(header) + 2, 15)
+        worksheet.append(self.headers)
+        return worksheet
+
+    def compact(self):
+        """Flush all complete journal rows past the checkpoint into the workbook.
+
+        The workbook is rebuilt in write-only mode (streaming the existing rows
+        through a read-only reader) and swapped in atomically, then the
+        checkpoint is advanced. Rows whose lead ID is already in the workbook
+        are skipped, so a crash between the swap and the checkpoint is safe.
+        The journal is then rotated down to the rows appended meanwhile.
+        Returns the number of rows flushed, or 0 if another process holds the
+        compaction lock.
+        """
+        self._prepare()
+        fd = os.open(self.compact_lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            return self._compact_locked()
+        finally:
+            os.close(fd)
+
+    def _rebuild_shard(self, path, records):
+        """Rewrite one shard with `records` merged in; returns its manifest entry.
+
+        Existing rows are streamed through a read-only reader into a write-only
+        workbook that is swapped in atomically, with the new records merged in
+        by lead ID, so a shard stays in ID order however the journal rows were
+        ordered. Records whose lead ID is already in it (a crash after the
+        swap, or a copy appended twice) are skipped.
+        """
+        from openpyxl import Workbook, load_workbook
+
+        def existing_rows():
+            if not os.path.exists(path):
+                return
+            existing = load_workbook(path, read_only=True)
+            try:
+                for row in existing.active.iter_rows(min_row=2, values_only=True):
+                    if any(value is not None for value in row):
+                        yield row, False
+            finally:
+                existing.close()
+
+        def row_lead_id(row):
+            return row[1] if len(row) > 1 and isinstance(row[1], int) else 0
+
+        output = Workbook(write_only=True)
+        worksheet = self._new_worksheet(output)
+        new_rows = sorted((([record.get(field) for field in LEAD_FIELDS], True) for record in records),
+                          key=lambda item: row_lead_id(item[0]))
+
+        rows = 0
+        flushed = 0
+        lead_ids = set()
+        # On equal IDs heapq.merge yields the existing row first, so its copy is the one skipped
+        for row, new in heapq.merge(existing_rows(), new_rows, key=lambda item: row_lead_id(item[0])):
+            lead_id = row_lead_id(row)
+            if new:
+                if lead_id in lead_ids:
+                    continue
+                flushed += 1
+            worksheet.append(row)
+            rows += 1
+            if lead_id:
+                lead_ids.add(lead_id)
+
+        tmp_path = f"{path}.tmp.xlsx"
+        output.save(tmp_path)
+        os.replace(tmp_path, path)
+        entry = {'file': path, 'rows': rows, 'first_lead_id': min(lead_ids, default=None),
+                 'last_lead_id': max(lead_ids, default=None)}
+        return entry, flushed
+
+    def _compact_locked(self):
+        checkpoint, records, end = self._read_pending()
+        self._appended = 0
+        if not records:
+            return 0
+
+        by_shard = {}
+        for record in records:
+            by_shard.setdefault(self.shard_key(record.get('timestamp')), []).append(record)
+
+        manifest = self.read_manifest()
+        shards = manifest['shards']
+        flushed = 0
+        for key, shard_records in sorted(by_shard.items()):
+            path = shards[key]['file'] if key in shards else self.shard_file(key)
+            shards[key], count = self._rebuild_shard(path, shard_records)
+            flushed += count
+        _write_json_atomic(self.manifest_file, manifest)
+
+        last_lead_id = max([checkpoint['last_lead_id']] + [entry['last_lead_id'] or 0 for entry in shards.values()])
+        with self._locked(self.lock_file, fcntl.LOCK_EX):
+            # Checkpoint first: a crash before the rotation only re-reads rows
+            # the shards already hold, which the next compaction skips
+            _write_json_atomic(self.checkpoint_file, {
+                'offset': 0,
+                'generation': checkpoint.get('generation', 0) + 1,
+                'workbook_rows': sum(entry['rows'] for entry in shards.values()),
+                'last_lead_id': last_lead_id
+            })
+            self._rotate(end)
+
+        print(f"Compacted {flushed} journal rows into {', '.join(shards[key]['file'] for key in sorted(by_shard))}")
+        return flushed
+
+    def find_lead(self, lead_id):
+        """A lead's row as a {field: value} dict, or None.
+
+        The uncompacted end of the journal is searched first; compacted leads
+        are looked up in the manifest, so only the shard(s) whose ID range
+        covers lead_id are opened.
+        """
+        self._prepare()
+        checkpoint, records, _ = self._read_pending()
+        lead = next((record for record in records if record['lead_id'] == lead_id), None)
+        if lead is not None or lead_id > checkpoint['last_lead_id']:
+            return lead
+
+        for entry in self.read_manifest()['shards'].values():
+            first, last = entry['first_lead_id'], entry['last_lead_id']
+            if last is None or lead_id > last or (first is not None and lead_id < first):
+                continue
+            if not os.path.exists(entry['file']):
+                continue  # Archived
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(entry['file'], read_only=True)
+            try:
+                for row in workbook.active.iter_rows(min_row=2, values_only=True):
+                    if len(row) > 1 and row[1] == lead_id:
+                        lead = dict.fromkeys(LEAD_FIELDS)  # Trailing empty cells aren't in the row
+                        lead.update(zip(LEAD_FIELDS, row))
+                        return lead
+            finally:
+                workbook.close()
+        return None
+
+    def iter_leads(self, after_id=0):
+        """Every lead with an ID above after_id as a {field: value} dict, in ID order.
+
+        Compacted leads are read from the shards (skipping those the manifest
+        shows end at or below after_id, and archived ones) and merged with the
+        uncompacted end of the journal, which wins for a lead that is in both.
+        """
+        self._prepare()
+        _, records, _ = self._read_pending()
+        pending = sorted((record for record in records if record['lead_id'] > after_id),
+                         key=lambda record: record['lead_id'])
+        pending_ids = {record['lead_id'] for record in pending}
+
+        yield from heapq.merge(self._iter_compacted(after_id, pending_ids), pending,
+                               key=lambda record: record['lead_id'])
+
+    def _iter_compacted(self, after_id, skip_ids=()):
+        """Leads in the shards with an ID above after_id (less skip_ids), in ID order."""
+        shards = self.read_manifest()['shards']
+        for key in sorted(shards, key=lambda key: (key != MAIN_SHARD, key)):
+            entry = shards[key]
+            if (entry['last_lead_id'] is None or entry['last_lead_id'] <= after_id
+                    or not os.path.exists(entry['file'])):
+                continue
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(entry['file'], read_only=True)
+            try:
+                for row in workbook.active.iter_rows(min_row=2, values_only=True):
+                    if (len(row) > 1 and isinstance(row[1], int) and row[1] > after_id
+                            and row[1] not in skip_ids):
+                        lead = dict.fromkeys(LEAD_FIELDS)
+                        lead.update(zip(LEAD_FIELDS, row))
+                        yield lead
+            finally:
+                workbook.close()
+
+    def archive_shards(self, before, directory):
+        """Move closed monthly shards older than `before` (YYYY-MM) into `directory`.
+
+        Their manifest entries (and so /stats counts) stay; only the file path
+        changes. The current month is never moved. Returns the moved keys.
+        """
+        os.makedirs(directory, exist_ok=True)
+        current = self.shard_key(datetime.now().isoformat())
+        fd = os.open(self.compact_lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)  # No compaction may rebuild a shard while it moves
+            manifest = self.read_manifest()
+            moved = []
+            for key, entry in sorted(manifest['shards'].items()):
+                if key == MAIN_SHARD or key >= before or key >= current:
+                    continue
+                target = os.path.join(directory, os.path.basename(entry['file']))
+                if os.path.abspath(target) == os.path.abspath(entry['file']) or not os.path.exists(entry['file']):
+                    continue
+                shutil.move(entry['file'], target)
+                entry['file'] = target
+                moved.append(key)
+            if moved:
+                _write_json_atomic(self.manifest_file, manifest)
+            return moved
+        finally:
+            os.close(fd)
+
+    def _compactor_loop(self):
+        while True:
+            self._wakeup.wait(COMPACT_INTERVAL_SECONDS)
+            self._wakeup.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting lead journal: {e}")
+                time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KatalystVC lead journal maintenance')
+    parser.add_argument('command', choices=['archive', 'manifest'])
+    parser.add_argument('--journal', default=os.getenv('LEAD_JOURNAL_FILE', 'katalystvc_leads.journal.jsonl'))
+    parser.add_argument('--excel', default='katalystvc_leads.xlsx')
+    parser.add_argument('--before', help='archive: move monthly shards older than this month (YYYY-MM)')
+    parser.add_argument('--to', default='archive', help='archive: destination directory')
+    args = parser.parse_args()
+
+    journal = LeadJournal(args.journal, args.excel, LEAD_FIELDS)
+    if args.command == 'manifest':
+        print(json.dumps(journal.read_manifest(), indent=2))
+        return
+    if not args.before:
+        parser.error('archive needs --before YYYY-MM')
+    moved = journal.archive_shards(args.before, args.to)
+    print(f"Archived {len(moved)} shard(s) to {args.to}: {', '.join(moved) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
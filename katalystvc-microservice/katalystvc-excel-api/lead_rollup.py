@@ -0,0 +1,124 @@
+"""
+KatalystVC Lead Rollup (Excel API)
+Per-day lead counts by topic, UTM and source page for /stats, maintained from
+the append-only lead journal by lead-ID high-water mark. The workbook (every
+shard listed in the manifest) is read once, the first time a process builds its rollup; after that each refresh only
+reads journal rows appended since the last one (LeadJournal.read_since, which
+also returns rows a compaction rotated out of the journal in between). The
+rollup is saved next to the journal so restarts don't reread the workbook
+either. Each worker process keeps its own rollup; saves take an fcntl lock on
+a sidecar file and never replace a saved rollup that has read further into
+the journal.
+"""
+
+import fcntl
+import json
+import os
+import threading
+
+from lead_journal import LEAD_FIELDS, _write_json_atomic
+from lead_stats import DIMENSIONS, build_stats, parse_stats_args, week_start
+
+_DAY_INDEX = LEAD_FIELDS.index('timestamp')
+_DIMENSION_INDEXES = {dimension: LEAD_FIELDS.index(dimension) for dimension in DIMENSIONS}
+
+
+class LeadRollup:
+    """In-memory {(dimension, value, day): count} over every journaled lead."""
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.rollup_file = f"{journal.journal_file}.rollup.json"
+        self.lock_file = f"{self.rollup_file}.lock"
+        self.counts = {}
+        self.position = (0, 0)  # Journal (generation, offset) already folded in
+        self.last_lead_id = 0  # High-water mark; rows at or below it are skipped
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _add(self, lead_id, day, values):
+        if lead_id is None or lead_id <= self.last_lead_id:
+            return
+        day = str(day or '')[:10]
+        for dimension, value in values.items():
+            key = (dimension, value or '', day)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.last_lead_id = lead_id
+
+    def _load(self):
+        if os.path.exists(self.rollup_file):
+            with open(self.rollup_file) as f:
+                saved = json.load(f)
+            self.counts = {(dimension, value, day): count for dimension, value, day, count in saved['counts']}
+            self.position = (saved.get('generation', 0), saved['offset'])
+            self.last_lead_id = saved['last_lead_id']
+        else:
+            # Leads that predate the journal only exist in the workbook (or its shards).
+            # Taken first, so rows a rotation moves meanwhile are read back by refresh()
+            self.position = self.journal.start_position()
+            from openpyxl import load_workbook
+
+            rows = []
+            for path in self.journal.shard_files():
+                workbook = load_workbook(path, read_only=True)
+                # Read-only rows stop at the last non-empty cell, so pad them out
+                rows.extend(row + (None,) * (len(LEAD_FIELDS) - len(row))
+                            for row in workbook.active.iter_rows(min_row=2, values_only=True)
+                            if len(row) > 1 and isinstance(row[1], int))
+                workbook.close()
+            rows.sort(key=lambda row: row[1])
+            for row in rows:
+                self._add(row[1], row[_DAY_INDEX],
+                          {dimension: row[index] for dimension, index in _DIMENSION_INDEXES.items()})
+            # Those rows are also in the journal if they were compacted from it;
+            # the high-water mark skips them when the journal is read
+        self._loaded = True
+
+    def _save(self):
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.path.exists(self.rollup_file):
+                with open(self.rollup_file) as f:
+                    saved = json.load(f)
+                if (saved.get('generation', 0), saved['offset']) >= self.position:
+                    return  # Another worker saved a rollup at least as far along
+            _write_json_atomic(self.rollup_file, {
+                'generation': self.position[0],
+                'offset': self.position[1],
+                'last_lead_id': self.last_lead_id,
+                'counts': [[*key, count] for key, count in self.counts.items()]
+            })
+        finally:
+            os.close(fd)
+
+    def refresh(self):
+        """Fold complete journal lines appended since the last refresh."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            records, position = self.journal.read_since(self.position, self.last_lead_id)
+            for record in records:
+                self._add(record['lead_id'], record.get('timestamp'),
+                          {dimension: record.get(dimension) for dimension in DIMENSIONS})
+            if position != self.position:
+                self.position = position
+                self._save()
+
+    def stats(self, args):
+        """The /stats analytics for the given query args. Raises QueryError on bad args."""
+        since, until, bucket = parse_stats_args(args)
+        self.refresh()
+        by_dimension = {}
+        by_period = {}
+        with self._lock:
+            for (dimension, value, day), count in self.counts.items():
+                if (since and day < since) or (until and day > until):
+                    continue
+                key = (dimension, value)
+                by_dimension[key] = by_dimension.get(key, 0) + count
+                if dimension == 'topic':
+                    period = day if bucket == 'day' or not day else week_start(day)
+                    by_period[period] = by_period.get(period, 0) + count
+        return build_stats([(dimension, value, count) for (dimension, value), count in by_dimension.items()],
+                           sorted(by_period.items()), since, until, bucket)
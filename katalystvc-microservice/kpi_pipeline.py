@@ -0,0 +1,213 @@
+"""
+KatalystVC KPI Pipeline
+Turns data/kpis.csv (one row per date and landing page, with ctr, cvr,
+win_rate, cpl and cac stored as display strings like "8.0%" and "$125") into
+typed columns, joins the leads actually captured per source page and day from
+leads.db, and recomputes the funnel rates, CPL and CAC as whole-column NumPy
+operations. Results are written as Parquet or CSV and can be queried over any
+date range, with rates recomputed from the summed counts rather than averaged.
+
+Metric definitions (matching the hand-computed sheet):
+    ctr       = bookings / visits
+    cvr       = wins / bookings
+    win_rate  = wins / bookings
+    spend     = reported cpl * bookings   (the sheet has no spend column)
+    cpl       = spend / bookings
+    cac       = spend / wins
+    lead_rate = leads / visits            (leads from leads.db)
+    cost_per_captured_lead = spend / leads
+
+    python kpi_pipeline.py build --kpis ../data/kpis.csv --db leads.db --out kpis.parquet
+    python kpi_pipeline.py query --data kpis.parquet --since 2025-01-01 --until 2025-03-31 --freq W
+
+Requires: pandas, numpy (pyarrow for Parquet)
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+KPIS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'kpis.csv')
+DATABASE = 'leads.db'
+
+COUNT_COLUMNS = ['visits', 'bookings', 'wins', 'leads']
+PERCENT_COLUMNS = ['ctr', 'cvr', 'win_rate']
+MONEY_COLUMNS = ['cpl', 'cac']
+
+# Column -> (numerator, denominator), recomputed after every aggregation
+RATIOS = {
+    'ctr': ('bookings', 'visits'),
+    'cvr': ('wins', 'bookings'),
+    'win_rate': ('wins', 'bookings'),
+    'cpl': ('spend', 'bookings'),
+    'cac': ('spend', 'wins'),
+    'lead_rate': ('leads', 'visits'),
+    'cost_per_captured_lead': ('spend', 'leads')
+}
+
+OUTPUT_COLUMNS = ['date', 'page', 'visits', 'bookings', 'wins', 'leads', 'spend'] + list(RATIOS)
+
+# Per-page, per-day lead counts: the /stats rollups when present (O(groups)),
+# otherwise one grouped scan of the leads table
+ROLLUP_LEADS_SQL = """
+    SELECT value AS page, day, count AS leads FROM lead_rollups
+    WHERE dimension = 'source_page' AND value != ''
+"""
+SCAN_LEADS_SQL = """
+    SELECT source_page AS page, substr(submission_time, 1, 10) AS day, COUNT(*) AS leads
+    FROM leads WHERE source_page IS NOT NULL GROUP BY 1, 2
+"""
+
+
+def _parse_number(column, strip):
+    cleaned = column.astype('string').str.strip()
+    for token in strip:
+        cleaned = cleaned.str.replace(token, '', regex=False)
+    return pd.to_numeric(cleaned, errors='coerce').astype('float64')
+
+
+def load_kpis(path=KPIS_CSV):
+    """Read the KPI sheet into typed columns (percentages as fractions, money as floats)."""
+    raw = pd.read_csv(path, dtype={'page': 'string'}, keep_default_na=False, na_values=[''])
+    frame = pd.DataFrame({
+        'date': pd.to_datetime(raw['date'], format='%Y-%m-%d'),
+        'page': raw['page'].astype('category')
+    })
+    for column in ['visits', 'bookings', 'wins']:
+        frame[column] = pd.to_numeric(raw[column], errors='coerce').fillna(0).astype('int64')
+    for column in PERCENT_COLUMNS:
+        frame[f'reported_{column}'] = _parse_number(raw[column], ['%']) / 100
+    for column in MONEY_COLUMNS:
+        frame[f'reported_{column}'] = _parse_number(raw[column], ['$', ','])
+    return frame
+
+
+def load_lead_counts(database=DATABASE):
+    """Leads captured per (page, date) from leads.db; empty if there is no database."""
+    if not os.path.exists(database):
+        return pd.DataFrame({'page': pd.Series(dtype='string'), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'leads': pd.Series(dtype='int64')})
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    try:
+        has_rollups = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lead_rollups'").fetchone()
+        counts = pd.read_sql_query(ROLLUP_LEADS_SQL if has_rollups else SCAN_LEADS_SQL, conn)
+    finally:
+        conn.close()
+    counts['date'] = pd.to_datetime(counts.pop('day'), format='%Y-%m-%d', errors='coerce')
+    counts['page'] = counts['page'].astype('string')
+    return counts.dropna(subset=['date']).groupby(['page', 'date'], as_index=False, observed=True)['leads'].sum()
+
+
+def compute_ratios(frame):
+    """(Re)compute every RATIOS column in place; a zero denominator gives NaN."""
+    for column, (numerator, denominator) in RATIOS.items():
+        top = frame[numerator].to_numpy(dtype='float64')
+        bottom = frame[denominator].to_numpy(dtype='float64')
+        out = np.full(len(frame), np.nan)
+        np.divide(top, bottom, out=out, where=bottom != 0)
+        frame[column] = out
+    return frame
+
+
+def build(kpis_path=KPIS_CSV, database=DATABASE):
+    """KPI sheet + captured leads -> typed per-day, per-page KPI frame sorted by date."""
+    frame = load_kpis(kpis_path)
+    counts = load_lead_counts(database)
+
+    frame['page'] = frame['page'].astype('string')
+    frame = frame.merge(counts, on=['page', 'date'], how='left')
+    frame['leads'] = frame['leads'].fillna(0).astype('int64')
+    frame['spend'] = frame['reported_cpl'].fillna(0).to_numpy() * frame['bookings'].to_numpy()
+    compute_ratios(frame)
+
+    frame['page'] = frame['page'].astype('category')
+    frame = frame.sort_values(['date', 'page'], kind='stable').reset_index(drop=True)
+    return frame[OUTPUT_COLUMNS + [f'reported_{column}' for column in PERCENT_COLUMNS + MONEY_COLUMNS]]
+
+
+def save(frame, path):
+    """Write .parquet (typed, via pyarrow) or anything else as CSV."""
+    if path.endswith('.parquet'):
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False, date_format='%Y-%m-%d', float_format='%.6g')
+
+
+def load(path):
+    """Read a frame written by save() back with its types."""
+    if path.endswith('.parquet'):
+        frame = pd.read_parquet(path)
+    else:
+        frame = pd.read_csv(path, parse_dates=['date'], dtype={'page': 'category'})
+    return frame.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def query(frame, since=None, until=None, pages=None, freq=None, by_page=True):
+    """KPIs for an inclusive date range, optionally per page and per period.
+
+    frame must be sorted by date (as build() and load() return it); the range
+    is cut with a binary search. freq is a pandas period alias ('D', 'W', 'M',
+    'Q', 'Y') or None for a single total. Counts and spend are summed and the
+    rates recomputed from the sums.
+    """
+    dates = frame['date'].to_numpy()
+    start = 0 if since is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(since)), side='left')
+    stop = len(frame) if until is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(until)), side='right')
+    window = frame.iloc[start:stop]
+    if pages:
+        window = window[window['page'].isin(pages)]
+
+    keys = []
+    if freq:
+        keys.append(window['date'].dt.to_period(freq).dt.start_time.rename('period'))
+    if by_page:
+        keys.append(window['page'].astype('string'))
+    sums = ['visits', 'bookings', 'wins', 'leads', 'spend']
+    if keys:
+        result = window.groupby(keys, observed=True, sort=True)[sums].sum().reset_index()
+    else:
+        result = window[sums].sum().to_frame().T.astype({column: 'int64' for column in COUNT_COLUMNS})
+    return compute_ratios(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='Parse the KPI sheet, join leads and write the typed output')
+    build_parser.add_argument('--kpis', default=KPIS_CSV)
+    build_parser.add_argument('--db', default=DATABASE)
+    build_parser.add_argument('--out', default='kpis.parquet', help='.parquet or .csv')
+
+    query_parser = commands.add_parser('query', help='Aggregate a built file over a date range')
+    query_parser.add_argument('--data', default='kpis.parquet')
+    query_parser.add_argument('--since')
+    query_parser.add_argument('--until')
+    query_parser.add_argument('--page', action='append', help='Repeat to select several pages')
+    query_parser.add_argument('--freq', help="Period per row: D, W, M, Q or Y (default: one total)")
+    query_parser.add_argument('--all-pages', action='store_true', help='Combine pages instead of one row each')
+    query_parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        frame = build(args.kpis, args.db)
+        save(frame, args.out)
+        print(f"Wrote {len(frame)} KPI rows to {args.out}")
+        return
+
+    result = query(load(args.data), args.since, args.until, args.page, args.freq, by_page=not args.all_pages)
+    if args.format == 'csv':
+        result.to_csv(sys.stdout, index=False)
+    elif args.format == 'json':
+        print(result.to_json(orient='records', date_format='iso'))
+    else:
+        print(result.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+KatalystVC Lead Capture
+The /submit-lead path shared by every service (app.py, app_with_email.py,
+asgi_app.py and both Excel APIs): rate limiting, parsing and validating the
+body against lead_schema, answering repeat submissions with the lead they
+repeat, storing the lead in the LEAD_STORE backend (lead_store.open_store),
+queueing its emails and counting it. The services only adapt their framework:
+they pass in the client address, headers and a body reader and answer with
+the Submission they get back.
+
+Where the store keeps its leads in SQLite (sqlite, or fanout's primary), a
+lead, its dedupe keys and its queued emails commit in one transaction,
+optionally batched by a group_commit writer, and repeats are found in
+lead_dedupe_keys. The other stores (excel, jsonl) have no key table: repeats
+are caught by lead_dedupe's in-process LRU, checked and stored under one lock
+per process, and queued emails commit to the outbox database just after the
+lead is stored (internal notifications are never digested, since the digest
+reads leads back from the leads table).
+"""
+
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime
+
+import db
+import lead_dedupe
+import lead_schema
+import lead_store
+import metrics
+import notification_digest
+import rate_limit
+
+
+class Submission:
+    """The answer to one POST /submit-lead: HTTP status, JSON body and extra headers.
+
+    For a newly stored lead, `data` is the validated payload and `record` the
+    stored lead record (with its lead_id).
+    """
+
+    __slots__ = ('status', 'body', 'headers', 'data', 'record')
+
+    def __init__(self, status, body, headers=None, data=None, record=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.data = data
+        self.record = record
+
+
+class _Rejected(Exception):
+    def __init__(self, submission):
+        super().__init__(submission.body)
+        self.submission = submission
+
+
+class LeadCapture:
+    """Takes /submit-lead requests into a lead store.
+
+    `limiter` is a rate_limit.SubmitRateLimiter (None = unlimited). With
+    `internal_email` set, each lead's confirmation and internal notification
+    are queued in the email outbox of `database` (the store's own database
+    for SQLite stores). `on_stored(submission)` runs after each new lead is
+    stored, e.g. to wake the outbox workers or send emails inline.
+    """
+
+    def __init__(self, store, limiter=None, database=None, internal_email=None, on_stored=None):
+        self.store = store
+        self.limiter = limiter
+        self.sqlite = lead_store.sqlite_store(store)
+        self.database = self.sqlite.database if self.sqlite is not None else database
+        self.internal_email = internal_email if self.database else None
+        self.on_stored = on_stored
+        self.writer = None
+        self.in_flight = 0  # submit_async() calls waiting on the store
+        self._lock = threading.Lock()
+
+    def start_group_commit(self):
+        """Batch concurrent inserts through a group_commit writer; returns it (None if the store isn't SQLite)."""
+        if self.sqlite is None:
+            print(f"Group commit needs a SQLite lead store; LEAD_STORE={self.store.name} stores leads one by one")
+            return None
+        import group_commit
+        self.writer = group_commit.GroupCommitWriter(self.sqlite.database, after_insert=self._record_batch)
+        return self.writer
+
+    def submit(self, remote_addr, headers, read_body):
+        """The whole /submit-lead path for a threaded service; read_body() returns the raw body."""
+        try:
+            self._check_rate(remote_addr, headers)
+            with metrics.stage('parse'):
+                data = self._parse(read_body)
+            data, keys = self._validate(data, headers)
+            submission = self._store(data, keys)
+        except _Rejected as e:
+            return e.submission
+        except Exception as e:
+            return self._failed(e)
+        return self._after_store(submission)
+
+    async def submit_async(self, remote_addr, headers, read_body, find_duplicate=None):
+        """submit() for the event loop: read_body and find_duplicate(keys) are coroutine functions.
+
+        With a group commit writer, the insert is awaited on its future, so
+        the only thread hop is the writer's; other stores run in a worker thread.
+        """
+        try:
+            self._check_rate(remote_addr, headers)
+            with metrics.stage('parse'):
+                try:
+                    data = lead_schema.parse_body(await read_body())
+                except lead_schema.LeadValidationError as e:
+                    raise _Rejected(self._invalid(e))
+            data, keys = self._validate(data, headers)
+            self.in_flight += 1
+            try:
+                if self.writer is not None:
+                    submission = await self._store_group_commit(data, keys, find_duplicate)
+                else:
+                    submission = await asyncio.to_thread(self._store, data, keys)
+            finally:
+                self.in_flight -= 1
+        except _Rejected as e:
+            return e.submission
+        except Exception as e:
+            return self._failed(e)
+        return self._after_store(submission)
+
+    def _check_rate(self, remote_addr, headers):
+        if self.limiter is None:
+            return
+        with metrics.stage('rate_limit'):
+            limited = self.limiter.check(rate_limit.client_ip(remote_addr, headers.get('X-Forwarded-For')))
+        if limited is not None:
+            scope, retry_after = limited
+            metrics.RATE_LIMITED.inc(limit=scope)
+            raise _Rejected(Submission(429, rate_limit.rejection_body(scope),
+                                       {'Retry-After': rate_limit.retry_after_header(retry_after)}))
+
+    def _parse(self, read_body):
+        try:
+            return lead_schema.parse_body(read_body())
+        except lead_schema.LeadValidationError as e:
+            raise _Rejected(self._invalid(e))
+
+    def _validate(self, data, headers):
+        try:
+            with metrics.stage('validate'):
+                lead_schema.validate(data)
+        except lead_schema.LeadValidationError as e:
+            raise _Rejected(self._invalid(e))
+        try:
+            return data, lead_dedupe.dedupe_keys(data, headers.get('Idempotency-Key'))
+        except lead_dedupe.DedupeKeyError as e:
+            raise _Rejected(Submission(400, {'error': str(e)}))
+
+    @staticmethod
+    def _invalid(error):
+        """400 (or 413) for a body that isn't a valid lead."""
+        metrics.INVALID_SUBMISSIONS.inc(status=str(error.status))
+        return Submission(error.status, lead_schema.error_body(error))
+
+    @staticmethod
+    def _replay(lead_id):
+        """Answer a repeat submission with the lead it repeats."""
+        metrics.DUPLICATES.inc()
+        print(f"Duplicate submission of lead {lead_id} - not stored again.")
+        return Submission(200, lead_dedupe.replay_body(lead_id), {lead_dedupe.REPLAYED_HEADER: 'true'})
+
+    @staticmethod
+    def _failed(error):
+        metrics.DB_ERRORS.inc()
+        print(f"Database error: {error}")
+        return Submission(500, {'error': str(error)})
+
+    def _store(self, data, keys):
+        """Store a validated lead unless it repeats one; returns its Submission."""
+        if self.sqlite is None:
+            return self._store_unindexed(data, keys)
+
+        # Double-clicks and client retries get the original lead back: no new row, no new emails
+        with metrics.stage('dedupe'):
+            duplicate_id = lead_dedupe.find_duplicate(self.sqlite.connection(), keys)
+        if duplicate_id is not None:
+            return self._replay(duplicate_id)
+
+        record = lead_store.lead_record(data, datetime.now().isoformat())
+        try:
+            if self.writer is not None:
+                with metrics.stage('group_commit'):
+                    record['lead_id'] = self.writer.insert(self.sqlite.params(record), context=(data, record, keys))
+            else:
+                self._insert(data, record, keys)
+        except sqlite3.IntegrityError:
+            # Normally a concurrent identical submission that claimed the dedupe key first
+            db.reset_connection(self.sqlite.database)
+            duplicate_id = lead_dedupe.find_duplicate(self.sqlite.connection(), keys)
+            if duplicate_id is not None:
+                return self._replay(duplicate_id)
+            raise
+        return self._stored(data, record, keys)
+
+    async def _store_group_commit(self, data, keys, find_duplicate):
+        find_duplicate = find_duplicate or (lambda keys: asyncio.to_thread(self._find_duplicate, keys))
+        with metrics.stage('dedupe'):
+            duplicate_id = await find_duplicate(keys)
+        if duplicate_id is not None:
+            return self._replay(duplicate_id)
+
+        record = lead_store.lead_record(data, datetime.now().isoformat())
+        try:
+            with metrics.stage('group_commit'):
+                future = self.writer.submit(self.sqlite.params(record), context=(data, record, keys))
+                record['lead_id'] = await asyncio.wrap_future(future)
+        except sqlite3.IntegrityError:
+            duplicate_id = await find_duplicate(keys)
+            if duplicate_id is not None:
+                return self._replay(duplicate_id)
+            raise
+        return self._stored(data, record, keys)
+
+    def _find_duplicate(self, keys):
+        return lead_dedupe.find_duplicate(self.sqlite.connection(), keys)
+
+    def _insert(self, data, record, keys):
+        """Insert a lead, its dedupe keys and its emails in one transaction."""
+        conn = self.sqlite.connection()
+        cursor = conn.cursor()
+        try:
+            with metrics.stage('db_insert'):
+                lead_id = self.sqlite.insert_row(cursor, record)
+                lead_dedupe.record_keys(cursor, keys, lead_id)
+            # Queue emails in the same transaction as the lead; the outbox workers send them
+            self._queue_emails(cursor, data, record)
+            with metrics.stage('db_commit'):
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _record_batch(self, cursor, lead_ids, contexts):
+        """Group-commit hook: claim each lead's dedupe keys and queue its emails in the batch transaction."""
+        for lead_id, (data, record, keys) in zip(lead_ids, contexts):
+            record['lead_id'] = lead_id
+            lead_dedupe.record_keys(cursor, keys, lead_id)
+            self._queue_emails(cursor, data, record)
+
+    def _store_unindexed(self, data, keys):
+        # No key table to claim in the store's own write, so the check and the insert are one step per process
+        with self._lock:
+            duplicate_id = lead_dedupe.recent.get(keys.lookup)
+            if duplicate_id is None:
+                record = lead_store.lead_record(data, datetime.now().isoformat())
+                with metrics.stage('store_insert'):
+                    self.store.insert(record)
+                lead_dedupe.remember(keys, record['lead_id'])
+        if duplicate_id is not None:
+            return self._replay(duplicate_id)
+
+        if self.internal_email is not None:
+            conn = db.get_connection(self.database)
+            try:
+                self._queue_emails(conn.cursor(), data, record)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Lead {record['lead_id']} stored, but its emails could not be queued: {e}")
+        return self._stored(data, record, keys)
+
+    def _digests(self, data):
+        return self.sqlite is not None and notification_digest.should_digest(data['topic'])
+
+    def _queue_emails(self, cursor, data, record):
+        if self.internal_email is not None:
+            notification_digest.queue_lead_emails(cursor, record['lead_id'], data, record['timestamp'],
+                                                  self.internal_email, digest=self._digests(data))
+
+    def _stored(self, data, record, keys):
+        lead_dedupe.remember(keys, record['lead_id'])
+        if isinstance(self.store, lead_store.FanoutStore):
+            self.store.notify()
+        metrics.LEADS_SUBMITTED.inc(topic=metrics.topic_label(data['topic']))
+        if self.internal_email is not None and self._digests(data):
+            notification_digest.lead_queued()
+        return Submission(200, {'message': 'Lead submitted successfully', 'lead_id': record['lead_id']},
+                          data=data, record=record)
+
+    def _after_store(self, submission):
+        if submission.record is not None and self.on_stored is not None:
+            self.on_stored(submission)
+        return submission
@@ -0,0 +1,190 @@
+"""
+KatalystVC Lead Deduplication
+Makes /submit-lead idempotent, so double-clicks and client retries don't store
+the same lead twice or send its emails twice. A submission is a repeat when
+either
+
+    its Idempotency-Key header was already used (within IDEMPOTENCY_TTL_SECONDS), or
+    the same normalized email asked about the same topic within DEDUPE_WINDOW_SECONDS
+
+and is answered with the original lead_id instead of a new row. Keys live in
+lead_dedupe_keys, whose primary key is the dedupe key: the key rows are written
+in the lead's own transaction, so two racing submissions can't both commit and
+the loser gets sqlite3.IntegrityError (callers then return the winner's ID).
+Recently seen keys are also kept in a per-process LRU, so most repeats are
+answered without touching the database.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEDUPE_WINDOW_SECONDS = int(os.getenv('DEDUPE_WINDOW_SECONDS', '600'))  # 0 disables email+topic dedupe
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+DEDUPE_LRU_SIZE = int(os.getenv('DEDUPE_LRU_SIZE', '4096'))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# Set on responses that replay an earlier submission
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Expired keys are swept once every this many recorded leads
+PRUNE_EVERY = 500
+
+INSERT_KEY_SQL = 'INSERT INTO lead_dedupe_keys (dedupe_key, lead_id, expires_at) VALUES (?, ?, ?)'
+# Frees an expired key for reuse so the INSERT only conflicts with a live one
+DELETE_EXPIRED_KEY_SQL = 'DELETE FROM lead_dedupe_keys WHERE dedupe_key = ? AND expires_at <= ?'
+PRUNE_SQL = 'DELETE FROM lead_dedupe_keys WHERE expires_at <= ?'
+
+
+class DedupeKeyError(ValueError):
+    """The Idempotency-Key header is unusable (empty or too long)."""
+
+
+class DedupeKeys:
+    """The keys one submission is checked against and recorded under.
+
+    `lookup` also covers the previous email+topic window, so a repeat that
+    straddles a window boundary is still caught; `record` holds
+    (key, expires_at) pairs for the current window only.
+    """
+
+    __slots__ = ('lookup', 'record')
+
+    def __init__(self, lookup, record):
+        self.lookup = lookup
+        self.record = record
+
+    def __bool__(self):
+        return bool(self.lookup)
+
+
+def normalize_email(email):
+    """Case- and whitespace-insensitive form of an address."""
+    return str(email).strip().lower()
+
+
+def dedupe_keys(data, idempotency_key=None, now=None):
+    """Build the DedupeKeys for a validated /submit-lead payload."""
+    now = time.time() if now is None else now
+    lookup, record = [], []
+
+    if idempotency_key is not None:
+        idempotency_key = idempotency_key.strip()
+        if not idempotency_key or len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise DedupeKeyError(f'Idempotency-Key must be 1-{MAX_IDEMPOTENCY_KEY_LENGTH} characters')
+        key = f'idem:{idempotency_key}'
+        lookup.append(key)
+        record.append((key, now + IDEMPOTENCY_TTL_SECONDS))
+
+    if DEDUPE_WINDOW_SECONDS > 0:
+        window = int(now // DEDUPE_WINDOW_SECONDS)
+        prefix = f"auto:{normalize_email(data['email'])}\x1f{str(data['topic']).strip().lower()}\x1f"
+        current = f'{prefix}{window}'
+        lookup.extend([current, f'{prefix}{window - 1}'])
+        record.append((current, (window + 2) * DEDUPE_WINDOW_SECONDS))
+
+    return DedupeKeys(lookup, record)
+
+
+class RecentKeys:
+    """Thread-safe LRU of dedupe key -> (lead_id, expires_at)."""
+
+    def __init__(self, max_size=DEDUPE_LRU_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, keys, now=None):
+        """The lead ID stored under any live key in `keys`, or None."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                return entry[0]
+        return None
+
+    def put(self, record, lead_id):
+        """Remember (key, expires_at) pairs as belonging to lead_id."""
+        with self._lock:
+            for key, expires_at in record:
+                self._entries[key] = (lead_id, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+recent = RecentKeys()
+
+_recorded = 0
+_recorded_lock = threading.Lock()
+
+
+def lookup_query(keys, now=None):
+    """(sql, params) finding the lead ID behind any live key in `keys`."""
+    now = time.time() if now is None else now
+    placeholders = ', '.join('?' * len(keys.lookup))
+    sql = (f'SELECT lead_id FROM lead_dedupe_keys WHERE dedupe_key IN ({placeholders}) '
+           f'AND expires_at > ? ORDER BY lead_id LIMIT 1')
+    return sql, list(keys.lookup) + [now]
+
+
+def find_duplicate(conn, keys):
+    """The original lead ID if this submission is a repeat, else None.
+
+    Checks the in-process LRU first and falls back to lead_dedupe_keys (a
+    primary-key probe per key); database hits are cached for next time.
+    """
+    if not keys:
+        return None
+    lead_id = recent.get(keys.lookup)
+    if lead_id is not None:
+        return lead_id
+    sql, params = lookup_query(keys)
+    row = conn.execute(sql, params).fetchone()
+    if row is None:
+        return None
+    recent.put(keys.record, row[0])
+    return row[0]
+
+
+def record_keys(cursor, keys, lead_id, now=None):
+    """Claim the keys for lead_id inside the lead's transaction.
+
+    Raises sqlite3.IntegrityError if another lead already holds a live key, so
+    the caller can roll back and return that lead instead.
+    """
+    global _recorded
+    if not keys:
+        return
+    now = time.time() if now is None else now
+    for key, expires_at in keys.record:
+        cursor.execute(DELETE_EXPIRED_KEY_SQL, (key, now))
+        cursor.execute(INSERT_KEY_SQL, (key, lead_id, expires_at))
+
+    with _recorded_lock:
+        _recorded += 1
+        prune = _recorded % PRUNE_EVERY == 0
+    if prune:
+        cursor.execute(PRUNE_SQL, (now,))
+
+
+def replay_body(lead_id):
+    """/submit-lead response body for a repeat of lead_id."""
+    return {'message': 'Lead submitted successfully', 'lead_id': lead_id, 'duplicate': True}
+
+
+def remember(keys, lead_id):
+    """Cache a committed lead's keys so repeats skip the database."""
+    if keys:
+        recent.put(keys.record, lead_id)
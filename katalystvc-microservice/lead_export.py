@@ -0,0 +1,204 @@
+"""
+KatalystVC Lead Export
+Streams leads out of leads.db as CSV, XLSX or Parquet without holding the
+result set in memory. The filters (/leads' topic, utm_source, utm_campaign and
+since/until) are pushed down into the SQL query, and rows are read from the
+cursor EXPORT_CHUNK_ROWS at a time:
+
+    csv      written incrementally, chunk by chunk
+    xlsx     openpyxl write-only mode (rows are spooled to disk, not kept in a tree)
+    parquet  one row group per chunk through pyarrow's ParquetWriter (optional)
+
+Memory use therefore stays flat whether the export holds 1k or 5M leads.
+Services whose LEAD_STORE has no leads table export the store's matching
+records instead (iter_record_chunks).
+
+    python lead_export.py --format xlsx --out leads.xlsx [--topic infra] [--since 2025-01-01]
+
+Requires: openpyxl (xlsx), pyarrow (parquet)
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+
+import db
+import lead_queries
+import lead_store
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '5000'))
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Parquet column types; everything else is a string
+INTEGER_COLUMNS = {'id'}
+BOOLEAN_COLUMNS = {'consent'}
+TIMESTAMP_COLUMNS = {'submission_time'}
+
+
+class ExportError(ValueError):
+    """The export can't be produced (e.g. a missing optional dependency)."""
+
+
+def build_export_query(args, fields):
+    """SQL for every matching lead, oldest first, with the filters pushed down."""
+    clauses, params = lead_queries.build_where(args)
+    sql = f"SELECT {', '.join(fields)} FROM leads"
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY submission_time, id'
+    return sql, params
+
+
+def iter_chunks(conn, sql, params, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield lists of plain row tuples straight off one cursor."""
+    cursor = conn.cursor()
+    cursor.row_factory = None  # Tuples; skip building sqlite3.Row objects
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def iter_record_chunks(records, fields, chunk_rows=EXPORT_CHUNK_ROWS):
+    """iter_chunks() for lead_store records, for stores without the leads table."""
+    chunk = []
+    for record in records:
+        row = lead_store.lead_row(record)
+        chunk.append(tuple(row[field] for field in fields))
+        if len(chunk) == chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def csv_stream(chunks, fields):
+    """Yield CSV text one chunk at a time (header first)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_csv(chunks, fields, out):
+    """Write CSV to a text file object."""
+    for text in csv_stream(chunks, fields):
+        out.write(text)
+
+
+def write_xlsx(chunks, fields, out):
+    """Write a workbook to a path or binary file object in write-only mode."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Leads')
+    worksheet.append(fields)
+    for rows in chunks:
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(out)
+
+
+def _parquet_schema(pa, fields):
+    types = []
+    for field in fields:
+        if field in INTEGER_COLUMNS:
+            types.append(pa.field(field, pa.int64()))
+        elif field in BOOLEAN_COLUMNS:
+            types.append(pa.field(field, pa.bool_()))
+        elif field in TIMESTAMP_COLUMNS:
+            types.append(pa.field(field, pa.timestamp('us')))
+        else:
+            types.append(pa.field(field, pa.string()))
+    return pa.schema(types)
+
+
+def write_parquet(chunks, fields, out):
+    """Write a Parquet file to a path or binary file object, one row group per chunk."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError('Parquet export requires pyarrow')
+
+    schema = _parquet_schema(pa, fields)
+    with pq.ParquetWriter(out, schema, compression='zstd') as writer:
+        for rows in chunks:
+            columns = []
+            for index, field in enumerate(schema):
+                values = [row[index] for row in rows]
+                if pa.types.is_timestamp(field.type):
+                    columns.append(pc.cast(pa.array(values, pa.string()), field.type))
+                elif pa.types.is_boolean(field.type):
+                    columns.append(pa.array([None if value is None else bool(value) for value in values],
+                                            field.type))
+                else:
+                    columns.append(pa.array(values, field.type))
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'parquet': write_parquet}
+
+
+def export(conn, args, fmt, out, fields=None):
+    """Export the leads matching `args` (the /leads filters) to `out`."""
+    if fmt not in FORMATS:
+        raise lead_queries.QueryError(f"format must be one of: {', '.join(FORMATS)}")
+    fields = fields or list(lead_queries.LEAD_COLUMNS)
+    sql, params = build_export_query(args, fields)
+    WRITERS[fmt](iter_chunks(conn, sql, params), fields, out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default='leads.db')
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--out', help='Output file (default: stdout for csv)')
+    parser.add_argument('--fields', help='Comma-separated columns (default: all)')
+    for arg in list(lead_queries.FILTER_COLUMNS) + ['since', 'until']:
+        parser.add_argument(f'--{arg}')
+    args = parser.parse_args()
+
+    if args.out is None and args.format != 'csv':
+        parser.error(f'--out is required for {args.format}')
+    filters = {name: getattr(args, name) for name in list(lead_queries.FILTER_COLUMNS) + ['since', 'until']}
+
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} does not exist')
+    conn = db.connect(args.db)
+    try:
+        fields = lead_queries.parse_fields(args.fields)
+        if args.out is None:
+            export(conn, filters, args.format, sys.stdout, fields)
+        elif args.format == 'csv':
+            with open(args.out, 'w', newline='') as out:
+                export(conn, filters, args.format, out, fields)
+        else:
+            export(conn, filters, args.format, args.out, fields)
+    except (lead_queries.QueryError, ExportError) as e:
+        parser.error(str(e))
+    finally:
+        db.close(conn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+KatalystVC Bulk Lead Import
+Loads event and partner lead lists (NDJSON, CSV or XLSX) into leads.db. Input
+is parsed row by row as it streams in, each row is checked against the same
+schema as /submit-lead (lead_schema.py), and valid rows are inserted with executemany
+in transactions of IMPORT_BATCH_SIZE rows. Invalid rows are reported with
+their row number and skipped; they never fail the rest of the batch.
+
+Confirmation emails are not sent inline: they go into the email outbox with
+staggered send times (IMPORT_EMAILS_PER_MINUTE), and the team gets one summary
+email per import instead of a notification per lead.
+
+With a lead_store store for leads kept outside leads.db (LEAD_STORE=excel or
+jsonl), each batch goes to the store in one insert_many and only the emails
+are queued in leads.db.
+
+Column names are matched loosely, so the form keys (firstName), the database
+columns (first_name) and the Excel headers (First Name) all work.
+
+    python lead_import.py partners.csv [--db leads.db] [--emails]
+"""
+
+import argparse
+import csv
+import functools
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import db
+import lead_schema
+import lead_store
+import metrics
+import migrations
+import outbox
+from email_templates import render_confirmation
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '5000'))
+IMPORT_EMAILS_PER_MINUTE = float(os.getenv('IMPORT_EMAILS_PER_MINUTE', '30'))
+IMPORT_MAX_ERRORS_REPORTED = int(os.getenv('IMPORT_MAX_ERRORS_REPORTED', '1000'))
+
+FORMATS = ('ndjson', 'csv', 'xlsx')
+
+FORM_FIELDS = [field.name for field in lead_schema.LEAD_FIELDS]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+
+def _header_key(name):
+    return ''.join(ch for ch in str(name).lower() if ch.isalnum())
+
+
+# Normalized column name -> form key ('submissionTime' keeps an original timestamp)
+COLUMN_ALIASES = {_header_key(field): field for field in FORM_FIELDS}
+COLUMN_ALIASES.update({'timestamp': 'submissionTime', 'submissiontime': 'submissionTime'})
+
+
+@functools.lru_cache(maxsize=256)
+def _field_for(name):
+    return COLUMN_ALIASES.get(_header_key(name))
+
+
+class ImportFormatError(ValueError):
+    """The upload as a whole can't be read (reported as HTTP 400)."""
+
+
+def detect_format(filename=None, content_type=None):
+    """Pick a format from a file extension or Content-Type, or None."""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json'):
+        return 'ndjson'
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    extension = os.path.splitext(filename or '')[1].lower()
+    return {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv', '.xlsx': 'xlsx'}.get(extension)
+
+
+def iter_ndjson(lines):
+    """Yield (row number, raw dict or error string) per non-blank line."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f'Invalid JSON: {e}'
+            continue
+        yield number, record if isinstance(record, dict) else 'Expected a JSON object'
+
+
+def iter_csv(lines):
+    """Yield (row number, raw dict) per CSV data row; row 1 is the header."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        raise ImportFormatError('CSV input has no header row')
+    for number, values in enumerate(reader, 2):
+        if any(value.strip() for value in values):
+            yield number, dict(zip(header, values))
+
+
+def iter_xlsx(path):
+    """Yield (row number, raw dict) per worksheet row, streaming in read-only mode."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            raise ImportFormatError('Worksheet has no header row')
+        for number, values in enumerate(rows, 2):
+            if any(value not in (None, '') for value in values):
+                yield number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def iter_rows(stream, fmt):
+    """Rows from a binary stream (NDJSON/CSV) or an .xlsx path."""
+    if fmt == 'xlsx':
+        return iter_xlsx(stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'ndjson':
+        return iter_ndjson(text)
+    if fmt == 'csv':
+        return iter_csv(text)
+    raise ImportFormatError(f"Unsupported format; use one of: {', '.join(FORMATS)}")
+
+
+def _parse_consent(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    return None
+
+
+def normalize_row(raw):
+    """Map loosely named columns onto form keys; blank cells become None."""
+    data = {}
+    for name, value in raw.items():
+        field = _field_for(name) if name is not None else None
+        if field is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip() or None
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and field != 'consent':
+            value = str(value)  # Spreadsheet cells hold phone numbers and the like as numbers
+        data[field] = value
+    if 'consent' in data:
+        data['consent'] = _parse_consent(data['consent'])
+    return data
+
+
+def validate_row(data):
+    """Return an error message, or None if the row can be imported."""
+    return lead_schema.validation_error(data)
+
+
+def _submission_time(data, default):
+    value = data.get('submissionTime')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value:
+        try:
+            return datetime.fromisoformat(str(value)).isoformat()
+        except ValueError:
+            pass
+    return default
+
+
+class LeadImporter:
+    """Validates and inserts one import's rows in large transactions."""
+
+    def __init__(self, conn, send_emails=False, internal_email=None, batch_size=IMPORT_BATCH_SIZE,
+                 emails_per_minute=IMPORT_EMAILS_PER_MINUTE, source='import', store=None):
+        self.conn = conn
+        self.store = store
+        self.send_emails = send_emails
+        self.internal_email = internal_email
+        self.batch_size = batch_size
+        self.email_interval = 60.0 / emails_per_minute if emails_per_minute > 0 else 0.0
+        self.source = source
+
+        self.started = time.time()
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self.emails_queued = 0
+        self.first_lead_id = None
+        self.last_lead_id = None
+        self._batch = []
+
+    def _reject(self, number, message):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS_REPORTED:
+            self.errors.append({'row': number, 'error': message})
+
+    def add(self, number, raw):
+        if not isinstance(raw, dict):
+            self._reject(number, raw)
+            return
+        data = normalize_row(raw)
+        error = validate_row(data)
+        if error:
+            self._reject(number, error)
+            return
+        self._batch.append(data)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the pending rows (and queue their emails) in one transaction."""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        now = datetime.now().isoformat()
+        if self.store is not None:
+            first_id, last_id = self._store_batch(batch, now)
+        else:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.executemany(db.INSERT_LEAD_SQL, [db.lead_params(data, _submission_time(data, now))
+                                                        for data in batch])
+                # The write lock is held for the whole batch, so its row IDs are contiguous
+                last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+                first_id = last_id - len(batch) + 1
+                if self.send_emails:
+                    self._queue_confirmations(cursor, first_id, batch)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                metrics.DB_ERRORS.inc()
+                raise
+
+        self.imported += len(batch)
+        if self.first_lead_id is None:
+            self.first_lead_id = first_id
+        self.last_lead_id = last_id
+        topics = {}
+        for data in batch:
+            topic = metrics.topic_label(data['topic'])
+            topics[topic] = topics.get(topic, 0) + 1
+        for topic, count in topics.items():
+            metrics.LEADS_SUBMITTED.inc(count, topic=topic)
+
+    def _store_batch(self, batch, now):
+        """Insert a batch into self.store, then queue its emails in leads.db; returns (first, last) lead ID."""
+        records = [lead_store.lead_record(data, _submission_time(data, now)) for data in batch]
+        try:
+            self.store.insert_many(records)
+        except Exception:
+            metrics.DB_ERRORS.inc()
+            raise
+        # One insert_many allocates consecutive IDs
+        first_id, last_id = records[0]['lead_id'], records[-1]['lead_id']
+        if self.send_emails:
+            try:
+                self._queue_confirmations(self.conn.cursor(), first_id, batch)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return first_id, last_id
+
+    def _queue_confirmations(self, cursor, first_id, batch):
+        for offset, data in enumerate(batch):
+            if not data['consent']:
+                continue  # Imported lists aren't form submissions; only email leads who opted in
+            email = render_confirmation(data['firstName'], data['topic'])
+            not_before = self.started + self.emails_queued * self.email_interval
+            outbox.enqueue_email(cursor, data['email'], email.subject, email.text, lead_id=first_id + offset,
+                                 not_before=not_before, html_body=email.html)
+            self.emails_queued += 1
+
+    def finish(self):
+        """Flush the last batch, queue the summary email and return the report."""
+        self.flush()
+        report = self.report()
+        if self.send_emails and self.internal_email and self.imported:
+            cursor = self.conn.cursor()
+            outbox.enqueue_email(cursor, self.internal_email, *self._summary_email(report))
+            self.conn.commit()
+        if self.send_emails:
+            outbox.notify()
+        return report
+
+    def _summary_email(self, report):
+        subject = f"KatalystVC bulk import: {report['imported']} leads from {self.source}"
+        rate = f"{60 / self.email_interval:g}" if self.email_interval else 'unlimited'
+        body = f"""Hello Team,
+
+A bulk lead import has finished.
+
+• Source: {self.source}
+• Leads imported: {report['imported']} (IDs {report['first_lead_id']}-{report['last_lead_id']})
+• Rows rejected: {report['rejected']}
+• Confirmation emails queued: {report['emails_queued']}, sent at up to {rate} per minute
+
+KatalystVC Automated System"""
+        return subject, body
+
+    def report(self):
+        return {
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'first_lead_id': self.first_lead_id,
+            'last_lead_id': self.last_lead_id,
+            'emails_queued': self.emails_queued,
+            'seconds': round(time.time() - self.started, 3),
+            'errors': self.errors,
+            'errors_truncated': self.rejected > len(self.errors)
+        }
+
+
+def import_leads(conn, rows, max_rows=None, **options):
+    """Import (row number, raw row) pairs; returns the report dict.
+
+    With max_rows, the import stops after that many rows and the report's
+    'aborted' says where; the rows before it stay imported.
+    """
+    importer = LeadImporter(conn, **options)
+    try:
+        for count, (number, raw) in enumerate(rows, 1):
+            if max_rows is not None and count > max_rows:
+                report = importer.finish()
+                report['aborted'] = f'Stopped at row {number}: an import may have at most {max_rows} rows'
+                return report
+            importer.add(number, raw)
+    except ImportFormatError:
+        raise
+    except (ValueError, csv.Error) as e:
+        # A malformed file part-way through: keep what was imported, report where it stopped
+        report = importer.finish()
+        report['aborted'] = str(e)
+        return report
+    return importer.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='NDJSON, CSV or XLSX file ("-" reads stdin; needs --format)')
+    parser.add_argument('--db', default='leads.db')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--emails', action='store_true',
+                        help='Queue confirmation emails and an internal summary in the outbox')
+    parser.add_argument('--internal-email', default=os.getenv('INTERNAL_EMAIL', 'support@katalystvc.com'))
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error('Cannot tell the format from the file name; pass --format')
+
+    conn = db.connect(args.db)
+    migrations.migrate(conn)
+
+    if fmt == 'xlsx':
+        rows = iter_rows(args.path, fmt)
+        report = import_leads(conn, rows, send_emails=args.emails, internal_email=args.internal_email,
+                              batch_size=args.batch_size, source=os.path.basename(args.path))
+    else:
+        stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+        with stream:
+            report = import_leads(conn, iter_rows(stream, fmt), send_emails=args.emails,
+                                  internal_email=args.internal_email, batch_size=args.batch_size,
+                                  source=os.path.basename(args.path))
+    db.close(conn)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
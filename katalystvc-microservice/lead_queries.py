@@ -0,0 +1,121 @@
+"""
+KatalystVC Lead Queries
+Filtered, keyset-paginated reads over the leads table. Pages are ordered by
+(submission_time, id) descending and resume from an opaque cursor, so each page
+is an index range scan no matter how deep into the table it is.
+"""
+
+import base64
+import json
+
+from lead_dedupe import normalize_email
+
+LEAD_COLUMNS = [
+    'id', 'first_name', 'last_name', 'email', 'company', 'role', 'phone', 'topic',
+    'notes', 'consent', 'source_page', 'utm_source', 'utm_medium', 'utm_campaign',
+    'utm_term', 'utm_content', 'submission_time'
+]
+
+# Query-string parameter -> column for equality filters
+FILTER_COLUMNS = {
+    'topic': 'topic',
+    'utm_source': 'utm_source',
+    'utm_campaign': 'utm_campaign'
+}
+
+# ?email= matches case- and whitespace-insensitively, using the
+# idx_leads_email_time expression index (see migrations.py)
+EMAIL_FILTER_SQL = 'lower(trim({table}email)) = ?'
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+class QueryError(ValueError):
+    """Raised for malformed query parameters (reported as HTTP 400)."""
+
+
+def encode_cursor(submission_time, lead_id):
+    """Opaque cursor pointing just past the given row."""
+    raw = json.dumps([submission_time, lead_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        submission_time, lead_id = json.loads(raw)
+        return str(submission_time), int(lead_id)
+    except Exception:
+        raise QueryError('Invalid cursor')
+
+
+def parse_fields(value):
+    """Validate a comma-separated ?fields= projection."""
+    if not value:
+        return list(LEAD_COLUMNS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in LEAD_COLUMNS]
+    if unknown:
+        raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE):
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise QueryError('limit must be an integer')
+    if limit < 1:
+        raise QueryError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def build_where(args, table=''):
+    """WHERE clauses and parameters for the filters in a request's query args.
+
+    Supports the FILTER_COLUMNS equality filters, ?email= and a `since`/`until`
+    submission_time range (ISO 8601, since inclusive, until exclusive).
+    `table` qualifies the column names (e.g. 'leads.') for joins.
+    """
+    clauses = []
+    params = []
+    for arg, column in FILTER_COLUMNS.items():
+        value = args.get(arg)
+        if value:
+            clauses.append(f"{table}{column} = ?")
+            params.append(value)
+    if args.get('email'):
+        clauses.append(EMAIL_FILTER_SQL.format(table=table))
+        params.append(normalize_email(args['email']))
+    if args.get('since'):
+        clauses.append(f'{table}submission_time >= ?')
+        params.append(args['since'])
+    if args.get('until'):
+        clauses.append(f'{table}submission_time < ?')
+        params.append(args['until'])
+    return clauses, params
+
+
+def build_page_query(args, fields, limit, lookahead=True):
+    """SQL for one page of leads, newest first, starting after ?after=<cursor>.
+
+    With lookahead, fetches limit + 1 rows so the caller can tell whether
+    another page exists. A limit of None returns every matching row.
+    """
+    clauses, params = build_where(args)
+    if args.get('after'):
+        submission_time, lead_id = decode_cursor(args['after'])
+        clauses.append('(submission_time, id) < (?, ?)')
+        params.extend([submission_time, lead_id])
+
+    columns = list(dict.fromkeys(fields + ['submission_time', 'id']))
+    sql = f"SELECT {', '.join(columns)} FROM leads"
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY submission_time DESC, id DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit + 1 if lookahead else limit)
+    return sql, params
@@ -0,0 +1,166 @@
+"""
+KatalystVC Lead Replicator
+Copies leads from leads.db into the Excel workbook for spreadsheet users, as
+a process of its own, so /submit-lead only ever pays for the SQLite insert.
+It tails the leads table by ID high-water mark: each pass reads up to
+REPLICATOR_BATCH leads above the checkpoint in one short read (WAL readers
+never block the services' writes), appends them to the Excel lead journal
+with one fsync, and then advances the checkpoint. The copy itself is
+lead_store.copy_batch, the same step LEAD_STORE=fanout runs in-process. The
+journal's compactor flushes the leads into the (monthly) workbooks in
+batches, as in the Excel API.
+
+The checkpoint (REPLICATOR_CHECKPOINT, a small JSON file) is written after
+the leads are in the journal, and the journal skips IDs it already has, so
+a crash between the two only means the next pass copies nothing new. With no
+checkpoint yet the replicator starts after the journal's last lead ID.
+
+    python lead_replicator.py run      [--db leads.db] [--batch-size 500] [--interval 2]
+    python lead_replicator.py once     [--db leads.db]
+    python lead_replicator.py status   [--db leads.db]
+
+Set LEAD_REPLICATOR=true for the SQLite services where the replicator runs:
+they then report its lag on /metrics (lead_replication_lag_leads and
+lead_replication_lag_seconds, the age of the oldest lead not yet copied) and
+/health. The lag comes from leads.db and the checkpoint, not from the
+replicator, so it keeps growing if the replicator stops.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import db
+import lead_store
+import metrics
+
+REPLICATOR_ENABLED = os.getenv('LEAD_REPLICATOR', 'false').lower() == 'true'
+REPLICATOR_CHECKPOINT = os.getenv('REPLICATOR_CHECKPOINT', 'katalystvc_leads.replicator.json')
+REPLICATOR_BATCH = int(os.getenv('REPLICATOR_BATCH', '500'))
+REPLICATOR_INTERVAL_SECONDS = float(os.getenv('REPLICATOR_INTERVAL_SECONDS', '2'))
+
+
+def read_checkpoint(path=REPLICATOR_CHECKPOINT):
+    """{'last_lead_id', 'replicated', 'updated_at'}, or None before the first pass."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def replication_lag(conn, checkpoint_file=REPLICATOR_CHECKPOINT):
+    """How far the workbook is behind leads.db: leads not yet copied and the oldest one's age."""
+    checkpoint = read_checkpoint(checkpoint_file) or {'last_lead_id': 0, 'updated_at': None}
+    after_id = checkpoint['last_lead_id']
+    lag_leads = conn.execute('SELECT COUNT(*) FROM leads WHERE id > ?', (after_id,)).fetchone()[0]
+    lag_seconds = 0.0
+    if lag_leads:
+        oldest = conn.execute('SELECT submission_time FROM leads WHERE id > ? ORDER BY id LIMIT 1',
+                              (after_id,)).fetchone()[0]
+        try:
+            lag_seconds = max((datetime.now() - datetime.fromisoformat(oldest)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return {'lag_leads': lag_leads, 'lag_seconds': round(lag_seconds, 3),
+            'last_lead_id': after_id, 'checkpoint_updated_at': checkpoint['updated_at']}
+
+
+def register_metrics(database, checkpoint_file=REPLICATOR_CHECKPOINT):
+    """Report the replication lag on this service's /metrics, read when scraped."""
+    def collect(key):
+        try:
+            return replication_lag(db.get_connection(database), checkpoint_file)[key]
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return None
+
+    metrics.REGISTRY.gauge('lead_replication_lag_leads', 'Leads in leads.db not yet copied to the Excel workbook.',
+                           lambda: collect('lag_leads'))
+    metrics.REGISTRY.gauge('lead_replication_lag_seconds',
+                           'Age in seconds of the oldest lead not yet copied to the Excel workbook (0 when caught up).',
+                           lambda: collect('lag_seconds'))
+
+
+class Replicator:
+    """Copies leads above the checkpoint from a SQLite store to a replica store in batches."""
+
+    def __init__(self, database=lead_store.LEAD_DATABASE, replica=None, checkpoint_file=REPLICATOR_CHECKPOINT,
+                 batch_size=REPLICATOR_BATCH):
+        self.source = lead_store.SQLiteStore(database)
+        self.replica = replica if replica is not None else lead_store.ExcelStore()
+        self.checkpoint_file = checkpoint_file
+        self.batch_size = batch_size
+
+    def checkpoint(self):
+        checkpoint = read_checkpoint(self.checkpoint_file)
+        if checkpoint is None:
+            # First run: whatever the replica already holds (e.g. from fanout) isn't copied again
+            checkpoint = {'last_lead_id': self.replica.next_id() - 1, 'replicated': 0, 'updated_at': None}
+        return checkpoint
+
+    def run_once(self):
+        """Copy the next batch; returns the number of leads read from leads.db."""
+        checkpoint = self.checkpoint()
+        read, copied, last_id = lead_store.copy_batch(self.source, self.replica, checkpoint['last_lead_id'],
+                                                      self.batch_size)
+        if read or checkpoint['updated_at'] is None:
+            # Also saves the first run's starting point, which is what the services' lag reads
+            write_checkpoint(self.checkpoint_file, {
+                'last_lead_id': last_id,
+                'replicated': checkpoint['replicated'] + len(copied),
+                'updated_at': datetime.now().isoformat()
+            })
+        return read
+
+    def run(self, interval=REPLICATOR_INTERVAL_SECONDS):
+        """Replicate until interrupted, polling every `interval` seconds once caught up."""
+        print(f"Replicating {self.source.database} to the {self.replica.name} store from lead "
+              f"{self.checkpoint()['last_lead_id'] + 1}")
+        while True:
+            try:
+                start = time.perf_counter()
+                count = self.run_once()
+                if count:
+                    print(f"Replicated {count} leads in {time.perf_counter() - start:.3f}s")
+                if count < self.batch_size:
+                    time.sleep(interval)
+            except Exception as e:
+                print(f"Replication failed, will retry: {e}")
+                time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('run', 'once', 'status'))
+    parser.add_argument('--db', default=lead_store.LEAD_DATABASE)
+    parser.add_argument('--batch-size', type=int, default=REPLICATOR_BATCH)
+    parser.add_argument('--interval', type=float, default=REPLICATOR_INTERVAL_SECONDS)
+    args = parser.parse_args()
+
+    replicator = Replicator(args.db, batch_size=args.batch_size)
+    if args.command == 'run':
+        replicator.run(args.interval)
+    elif args.command == 'once':
+        while replicator.run_once() == args.batch_size:
+            pass
+        replicator.replica.journal.compact()
+    conn = db.connect(args.db)
+    print(json.dumps(replication_lag(conn, replicator.checkpoint_file), indent=2))
+    db.close(conn)
+
+
+if __name__ == '__main__':
+    main()
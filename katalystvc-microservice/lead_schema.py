@@ -0,0 +1,209 @@
+"""
+KatalystVC Lead Schema
+The /submit-lead payload, declared once and shared by the Flask services, the
+asyncio service, the Excel API and bulk import. The declaration is compiled
+at import into one checker per field (type, length, email format, allowed
+topics), so validating a request is a single pass over LEAD_FIELDS with no
+per-request setup.
+
+Bodies are capped at LEAD_MAX_BODY_BYTES and decoded straight from the raw
+bytes, with orjson when it is installed (no intermediate str copy) and the
+standard json module otherwise. Anything that fails is rejected before the
+database or workbook is touched:
+
+    data = lead_schema.parse_body(raw_bytes)   # LeadValidationError (400/413)
+    lead_schema.validate(data)                 # LeadValidationError (400)
+
+Keys outside the schema (the site also sends utm_source, submittedAt, ...) are
+ignored, not rejected. Optional fields may be null or "".
+"""
+
+import json
+import os
+import re
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard decoder is used instead
+    orjson = None
+
+LEAD_MAX_BODY_BYTES = int(os.getenv('LEAD_MAX_BODY_BYTES', '16384'))
+DEFAULT_LEAD_TOPICS = 'infra,fhir,both,consolidation-divestiture'
+# Comma-separated; "*" accepts any topic
+LEAD_TOPICS = os.getenv('LEAD_TOPICS', DEFAULT_LEAD_TOPICS)
+
+MAX_EMAIL_LENGTH = 254
+
+# Deliberately loose (RFC 5322 is not worth it here): one @, no whitespace, a dot in the domain
+EMAIL_PATTERN = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s.]+')
+
+# name, type, required, max length (strings)
+Field = namedtuple('Field', 'name kind required max_length')
+
+LEAD_FIELDS = (
+    Field('firstName', str, True, 100),
+    Field('lastName', str, True, 100),
+    Field('email', str, True, MAX_EMAIL_LENGTH),
+    Field('company', str, False, 200),
+    Field('role', str, False, 100),
+    Field('phone', str, False, 40),
+    Field('topic', str, True, 64),
+    Field('notes', str, False, 5000),
+    Field('consent', bool, True, None),
+    Field('sourcePage', str, False, 500),
+    Field('utmSource', str, False, 200),
+    Field('utmMedium', str, False, 200),
+    Field('utmCampaign', str, False, 200),
+    Field('utmTerm', str, False, 200),
+    Field('utmContent', str, False, 200),
+)
+
+REQUIRED_FIELDS = [field.name for field in LEAD_FIELDS if field.required]
+
+
+class LeadValidationError(ValueError):
+    """The request can't be accepted; `fields` maps field names to what is wrong."""
+
+    status = 400
+
+    def __init__(self, message, fields=None):
+        super().__init__(message)
+        self.message = message
+        self.fields = fields or {}
+
+
+class PayloadTooLarge(LeadValidationError):
+    """The body is over LEAD_MAX_BODY_BYTES."""
+
+    status = 413
+
+
+def allowed_topics(value=LEAD_TOPICS):
+    """The set of accepted topics, or None if any topic is allowed."""
+    topics = frozenset(topic.strip() for topic in value.split(',') if topic.strip())
+    return None if not topics or '*' in topics else topics
+
+
+def _compile_field(field, topics):
+    """A function returning an error message for a present, non-null value, or None."""
+    if field.kind is bool:
+        def check(value):
+            return None if value is True or value is False else 'must be true or false'
+        return check
+
+    max_length = field.max_length
+    too_long = f'must be at most {max_length} characters'
+    required = field.required
+    if field.name == 'email':
+        match = EMAIL_PATTERN.fullmatch
+
+        def check(value):
+            if type(value) is not str:
+                return 'must be a string'
+            if len(value) > max_length:
+                return too_long
+            return None if match(value) else 'must be a valid email address'
+    elif field.name == 'topic' and topics is not None:
+        choices = f"must be one of: {', '.join(sorted(topics))}"
+
+        def check(value):
+            if type(value) is not str:
+                return 'must be a string'
+            return None if value in topics else choices
+    else:
+        def check(value):
+            if type(value) is not str:
+                return 'must be a string'
+            if len(value) > max_length:
+                return too_long
+            return 'must not be blank' if required and value.isspace() else None
+    return check
+
+
+def compile_schema(fields=LEAD_FIELDS, topics=LEAD_TOPICS):
+    """(name, required, check) per field; built once at import for the module-level validate."""
+    accepted = allowed_topics(topics)
+    return tuple((field.name, field.required, _compile_field(field, accepted)) for field in fields)
+
+
+_compiled = compile_schema()
+
+
+def validate(data, compiled=None):
+    """Check a decoded payload against the schema; raises LeadValidationError.
+
+    The payload isn't copied or modified. Required strings must not be blank.
+    """
+    if type(data) is not dict:
+        raise LeadValidationError('Request body must be a JSON object')
+    get = data.get
+    missing = None
+    errors = None
+    for name, required, check in compiled or _compiled:
+        value = get(name)
+        if value is None or value == '':
+            if required:
+                missing = missing or []
+                missing.append(name)
+            continue
+        error = check(value)
+        if error is not None:
+            errors = errors or {}
+            errors[name] = error
+    if missing:
+        fields = dict.fromkeys(missing, 'is required')
+        if errors:
+            fields.update(errors)
+        raise LeadValidationError('Missing required fields', fields)
+    if errors:
+        raise LeadValidationError('Invalid lead data', errors)
+    return data
+
+
+def validation_error(data, compiled=None):
+    """validate() as a message string ("field: problem; ..."), or None if the payload is valid."""
+    try:
+        validate(data, compiled)
+    except LeadValidationError as e:
+        if not e.fields:
+            return e.message
+        return f"{e.message}: " + '; '.join(f'{name} {problem}' for name, problem in e.fields.items())
+    return None
+
+
+def _loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def parse_body(body, max_bytes=LEAD_MAX_BODY_BYTES):
+    """Decode a request body (bytes) into a payload dict; raises LeadValidationError."""
+    if len(body) > max_bytes:
+        raise PayloadTooLarge(f'Request body must be at most {max_bytes} bytes')
+    try:
+        data = _loads(body)
+    except ValueError:  # orjson.JSONDecodeError and UnicodeDecodeError are ValueErrors too
+        raise LeadValidationError('Request body must be valid JSON')
+    if type(data) is not dict:
+        raise LeadValidationError('Request body must be a JSON object')
+    return data
+
+
+def read_limited(stream, content_length=None, max_bytes=LEAD_MAX_BODY_BYTES):
+    """Read a WSGI input stream, refusing anything over max_bytes before or while reading."""
+    if content_length is not None and content_length > max_bytes:
+        raise PayloadTooLarge(f'Request body must be at most {max_bytes} bytes')
+    body = stream.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        raise PayloadTooLarge(f'Request body must be at most {max_bytes} bytes')
+    return body
+
+
+def error_body(error):
+    """JSON response body for a LeadValidationError."""
+    body = {'error': error.message}
+    if error.fields:
+        body['fields'] = error.fields
+    return body
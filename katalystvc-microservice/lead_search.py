@@ -0,0 +1,244 @@
+"""
+KatalystVC Lead Search
+Full-text search over the notes, company and role of every lead, backed by an
+FTS5 index (leads_fts) that mirrors those columns of the leads table. Triggers
+keep it in sync as leads are inserted, updated and deleted, so /leads/search
+is an index lookup ranked by BM25 rather than a scan of the table.
+
+The query language is deliberately small: words must all match (any of the
+three columns), "quoted phrases" match in order, and a trailing * makes a
+word a prefix (acme* matches Acme and Acmecorp). Each hit carries a snippet
+of the best-matching column with the matched words in SNIPPET_OPEN/CLOSE.
+Ranking considers the newest SEARCH_RANK_CANDIDATES matches, which keeps a
+search for a common word in milliseconds however large the table grows.
+
+Creating the index on an existing leads.db only indexes new leads; the rows
+already there are indexed by a one-time, resumable backfill that commits in
+batches so the services keep writing meanwhile. Migration 4 (migrations.py)
+runs it in the background when a service starts; it can also be run by hand:
+
+    python lead_search.py backfill [--db leads.db] [--batch-size 5000]
+    python lead_search.py status
+
+Until it finishes, searches only see the leads indexed so far.
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+import db
+from lead_queries import QueryError, build_where, parse_fields, parse_limit
+
+SEARCH_COLUMNS = ('notes', 'company', 'role')
+
+SNIPPET_OPEN = '['
+SNIPPET_CLOSE = ']'
+SNIPPET_ELLIPSIS = '...'
+SNIPPET_TOKENS = 12
+
+# BM25 has to score every match before it can sort, which for a word in most
+# leads means most of the table. Ranking is limited to the newest this-many
+# matches (that pass the request's filters) so a search costs the same at a
+# million leads as at ten thousand; 0 ranks every match.
+SEARCH_RANK_CANDIDATES = int(os.getenv('SEARCH_RANK_CANDIDATES', '5000'))
+
+MAX_QUERY_TERMS = 16
+MIN_PREFIX_LENGTH = 2  # Shorter prefixes expand to most of the vocabulary
+# Pages past the ranked candidates would always be empty
+MAX_OFFSET = min(10000, SEARCH_RANK_CANDIDATES - 1) if SEARCH_RANK_CANDIDATES else 10000
+
+BACKFILL_BATCH_SIZE = 5000
+
+_COLUMNS = ', '.join(SEARCH_COLUMNS)
+
+BACKFILL_SQL = f'''
+    INSERT INTO leads_fts (rowid, {_COLUMNS})
+    SELECT id, {_COLUMNS} FROM leads WHERE id > ? AND id <= ? ORDER BY id
+'''
+
+
+STATUS_SQL = 'SELECT backfilled_through, pending_through FROM lead_search_state'
+
+
+def status_from_row(row):
+    """backfill_status() for a STATUS_SQL row (for the asyncio service's own connection)."""
+    if row is None:
+        return None
+    return {'backfilled_through': row[0], 'pending_through': row[1], 'complete': row[0] >= row[1]}
+
+
+def backfill_status(conn):
+    """How far the one-time backfill has got: {'backfilled_through', 'pending_through', 'complete'}."""
+    return status_from_row(conn.execute(STATUS_SQL).fetchone())
+
+
+def index_through(conn, through_id):
+    """Index the leads that predate the index up to through_id, in the caller's transaction.
+
+    Starts from the backfill's high-water mark, so leads already indexed are
+    skipped, and moves it up. Returns the number of leads indexed.
+    """
+    done, pending = conn.execute(STATUS_SQL).fetchone()
+    through = min(through_id, pending)
+    if through <= done:
+        return 0
+    indexed = conn.execute(BACKFILL_SQL, (done, through)).rowcount
+    conn.execute('UPDATE lead_search_state SET backfilled_through = ?', (through,))
+    return indexed
+
+
+def backfill(conn, batch_size=BACKFILL_BATCH_SIZE, progress=None):
+    """Index the leads that predate the index, batch_size IDs per transaction.
+
+    Safe to interrupt and rerun: each batch commits together with the new
+    high-water mark. Returns the number of leads indexed.
+    """
+    indexed = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done, pending = conn.execute(STATUS_SQL).fetchone()
+            if done >= pending:
+                conn.commit()
+                return indexed
+            through = min(done + batch_size, pending)
+            indexed += index_through(conn, through)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if progress is not None:
+            progress(through, pending)
+
+
+def optimize(conn):
+    """Merge the index's b-tree segments (worth running after a large backfill)."""
+    conn.execute("INSERT INTO leads_fts (leads_fts) VALUES ('optimize')")
+    conn.commit()
+
+
+_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+_WORD = re.compile(r'\w+')
+
+
+def parse_search(value):
+    """Turn a user's ?q= into an FTS5 MATCH expression, or raise QueryError.
+
+    Only words, "phrases" and trailing-* prefixes are recognised; everything
+    else (FTS5 operators, column filters, punctuation) is treated as text, so
+    no input can produce an FTS5 syntax error.
+    """
+    terms = []
+    for match in _TOKEN.finditer(value or ''):
+        phrase, word = match.groups()
+        if phrase is not None:
+            words = _WORD.findall(phrase)
+            if words:
+                terms.append('"' + ' '.join(words) + '"')
+            continue
+        prefix = word.endswith('*')
+        words = _WORD.findall(word)
+        if not words:
+            continue
+        if prefix and len(words[-1]) < MIN_PREFIX_LENGTH:
+            raise QueryError(f'Prefix searches need at least {MIN_PREFIX_LENGTH} characters: {word}')
+        # acme-corp* is the phrase "acme corp" with corp as a prefix
+        terms.append('"' + ' '.join(words) + '"' + ('*' if prefix else ''))
+    if not terms:
+        raise QueryError('q must contain at least one word')
+    if len(terms) > MAX_QUERY_TERMS:
+        raise QueryError(f'q can have at most {MAX_QUERY_TERMS} terms')
+    return ' '.join(terms)
+
+
+def parse_offset(value):
+    if value is None or value == '':
+        return 0
+    try:
+        offset = int(value)
+    except ValueError:
+        raise QueryError('offset must be an integer')
+    if offset < 0 or offset > MAX_OFFSET:
+        raise QueryError(f'offset must be between 0 and {MAX_OFFSET}')
+    return offset
+
+
+def build_search_query(args, fields, limit, offset=0, candidates=SEARCH_RANK_CANDIDATES):
+    """SQL for one page of search hits, best first, with `snippet` and `score` columns.
+
+    The /leads equality and since/until filters apply together with the
+    match, and only the newest `candidates` leads that pass both are ranked
+    (see SEARCH_RANK_CANDIDATES). Lower scores are better (FTS5's BM25 is
+    negated).
+    """
+    expression = parse_search(args.get('q'))
+    clauses, filter_params = build_where(args, table='leads.')
+    filters = ''.join(f' AND {clause}' for clause in clauses)
+    columns = ', '.join(f'leads.{field}' for field in fields)
+    # CROSS JOIN keeps leads_fts as the outer loop so its rank order is used
+    sql = (f"SELECT {columns}, "
+           f"snippet(leads_fts, -1, ?, ?, ?, {SNIPPET_TOKENS}) AS snippet, "
+           f"leads_fts.rank AS score "
+           f"FROM leads_fts CROSS JOIN leads ON leads.id = leads_fts.rowid "
+           f"WHERE leads_fts MATCH ?")
+    params = [SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_ELLIPSIS, expression]
+    if candidates:
+        # Matches walk the index in rowid order cheaply; the candidate window starts at
+        # the Nth newest that passes the filters, so filtering never empties the window
+        sql += (' AND leads_fts.rowid >= COALESCE((SELECT leads_fts.rowid FROM leads_fts '
+                'CROSS JOIN leads ON leads.id = leads_fts.rowid WHERE leads_fts MATCH ?'
+                f'{filters} ORDER BY leads_fts.rowid DESC LIMIT 1 OFFSET ?), 0)')
+        params += [expression] + filter_params + [candidates - 1]
+    sql += filters
+    params += filter_params
+    sql += ' ORDER BY leads_fts.rank LIMIT ? OFFSET ?'
+    params.extend([limit, offset])
+    return sql, params
+
+
+def parse_search_args(args):
+    """(sql, params, fields) for a /leads/search request; raises QueryError."""
+    fields = parse_fields(args.get('fields'))
+    limit = parse_limit(args.get('limit'))
+    sql, params = build_search_query(args, fields, limit, parse_offset(args.get('offset')))
+    return sql, params, fields
+
+
+def hit(row, fields):
+    """One search result: the projected lead plus its snippet and score."""
+    result = {field: row[field] for field in fields}
+    result['snippet'] = row['snippet']
+    result['score'] = round(-row['score'], 6)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('backfill', 'status'))
+    parser.add_argument('--db', default='leads.db')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    import migrations  # Imports this module
+
+    conn = db.connect(args.db)
+    migrations.migrate(conn)
+
+    if args.command == 'backfill':
+        start = time.perf_counter()
+        indexed = backfill(conn, args.batch_size,
+                           progress=lambda through, pending: print(f"Indexed leads up to {through} of {pending}"))
+        if indexed:
+            optimize(conn)
+        print(json.dumps({'indexed': indexed, 'seconds': round(time.perf_counter() - start, 2),
+                          **backfill_status(conn)}, indent=2))
+    else:
+        print(json.dumps(backfill_status(conn), indent=2))
+    db.close(conn)
+
+
+if __name__ == '__main__':
+    main()
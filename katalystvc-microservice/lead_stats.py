@@ -0,0 +1,122 @@
+"""
+KatalystVC Lead Analytics
+Per-day lead counts by topic, UTM source/medium/campaign and source page, kept
+in a small rollup table that triggers on the leads table update as each lead is
+inserted (and deleted). /stats reads the rollups instead of the leads, so a response costs
+O(groups x days in range) no matter how many leads there are.
+
+The same response is built for the Excel API from its journal (see
+katalystvc-excel-api/lead_rollup.py) via build_stats(), and by records_stats()
+for lead stores with neither (LEAD_STORE=jsonl).
+"""
+
+from datetime import date, timedelta
+
+from lead_queries import QueryError
+
+# Dimension name -> leads column
+DIMENSIONS = {
+    'topic': 'topic',
+    'utm_source': 'utm_source',
+    'utm_medium': 'utm_medium',
+    'utm_campaign': 'utm_campaign',
+    'source_page': 'source_page'
+}
+
+BUCKETS = ('day', 'week')
+
+# Label for leads with no value for a dimension (e.g. direct traffic has no utm_source)
+NONE_LABEL = '(none)'
+
+WEEK_SQL = "date(day, 'weekday 0', '-6 days')"  # Monday of the day's week
+
+
+def parse_stats_args(args):
+    """Validate since/until (YYYY-MM-DD, inclusive) and bucket=day|week."""
+    bounds = []
+    for name in ('since', 'until'):
+        value = args.get(name)
+        if value:
+            try:
+                value = date.fromisoformat(value[:10]).isoformat()
+            except ValueError:
+                raise QueryError(f'Invalid {name} date: {value}')
+        bounds.append(value or None)
+    bucket = args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        raise QueryError(f"bucket must be one of: {', '.join(BUCKETS)}")
+    return bounds[0], bounds[1], bucket
+
+
+def build_stats_queries(since, until, bucket):
+    """(sql, params) for the per-dimension counts, the per-period series and the all-time total."""
+    day_filter, params = '', []
+    if since:
+        day_filter += ' AND day >= ?'
+        params.append(since)
+    if until:
+        day_filter += ' AND day <= ?'
+        params.append(until)
+    period = 'day' if bucket == 'day' else WEEK_SQL
+    return [
+        (f'SELECT dimension, value, SUM(count) FROM lead_rollups WHERE 1 = 1{day_filter} '
+         f'GROUP BY dimension, value', params),
+        # Every lead has exactly one topic row, so the topic rollups double as the totals
+        (f"SELECT {period} AS period, SUM(count) FROM lead_rollups WHERE dimension = 'topic'{day_filter} "
+         f'GROUP BY period ORDER BY period', params),
+        ("SELECT COALESCE(SUM(count), 0) FROM lead_rollups WHERE dimension = 'topic'", [])
+    ]
+
+
+def query_stats(conn, args):
+    """The /stats response for the SQLite services. Raises QueryError on bad args."""
+    since, until, bucket = parse_stats_args(args)
+    by_dimension, by_period, total = [
+        [tuple(row) for row in conn.execute(sql, params)]
+        for sql, params in build_stats_queries(since, until, bucket)
+    ]
+    stats = build_stats(by_dimension, by_period, since, until, bucket)
+    stats['total_leads'] = total[0][0]
+    return stats
+
+
+def records_stats(records, args):
+    """The /stats response counted from lead_store records in one pass. Raises QueryError on bad args."""
+    since, until, bucket = parse_stats_args(args)
+    by_dimension, by_period, total = {}, {}, 0
+    for record in records:
+        total += 1
+        day = str(record.get('timestamp') or '')[:10]
+        if (since and day < since) or (until and day > until):
+            continue
+        for dimension, column in DIMENSIONS.items():
+            key = (dimension, record.get(column) or '')
+            by_dimension[key] = by_dimension.get(key, 0) + 1
+        period = day if bucket == 'day' or not day else week_start(day)
+        by_period[period] = by_period.get(period, 0) + 1
+    stats = build_stats([(dimension, value, count) for (dimension, value), count in by_dimension.items()],
+                        sorted(by_period.items()), since, until, bucket)
+    stats['total_leads'] = total
+    return stats
+
+
+def week_start(day):
+    """Monday of the ISO week containing the YYYY-MM-DD day."""
+    value = date.fromisoformat(day)
+    return (value - timedelta(days=value.weekday())).isoformat()
+
+
+def build_stats(by_dimension, by_period, since, until, bucket):
+    """Shape (dimension, value, count) and (period, count) rows into the /stats response."""
+    stats = {'since': since, 'until': until, 'bucket': bucket}
+    for dimension in DIMENSIONS:
+        stats[f'by_{dimension}'] = {}
+    for dimension, value, count in by_dimension:
+        if count:
+            stats[f'by_{dimension}'][value or NONE_LABEL] = count
+    for dimension in DIMENSIONS:
+        counts = stats[f'by_{dimension}']
+        stats[f'by_{dimension}'] = dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+    stats[f'by_{bucket}'] = [{'period': period, 'count': count} for period, count in by_period if count]
+    stats['leads_in_range'] = sum(stats['by_topic'].values())
+    return stats
@@ -0,0 +1,578 @@
+"""
+KatalystVC Lead Storage Backends
+One interface over the places a submitted lead can be kept, so the capture
+code (validation, dedupe, emails) doesn't depend on which one a service
+uses. A store holds lead records, dicts keyed by LEAD_FIELDS in workbook
+column order, and provides:
+
+    insert(record)                    store one lead; sets and returns record['lead_id']
+    insert_many(records, keep_ids)    store a batch in one transaction / fsync
+    next_id()                         the ID the next insert will get
+    count()                           leads stored
+    iterate(after_id=0)               every lead above after_id, in ID order
+    get(lead_id)                      one lead, or None
+    query(args, limit)                lead_queries-style filters, newest first
+    analytics(args)                   the /stats response (lead_stats.py)
+
+LEAD_STORE picks the backend for open_store():
+
+    sqlite   leads.db through db.py (the SQLite services' database)
+    excel    the Excel API's lead journal and workbook (katalystvc-excel-api/lead_journal.py)
+    jsonl    a plain append-only JSONL file, fsynced per batch
+    fanout   sqlite as the primary; a background thread copies new leads from
+             it to the excel store in ID order, so the workbook never slows a submit
+
+With keep_ids, insert_many keeps each record's lead_id instead of allocating
+one, and skips records the store already has; that is how a replica receives
+leads whose IDs the primary allocated. The JSONL store only compares against
+its last ID, so copies into it must arrive in ID order (as fanout's do). Don't
+point the Excel API at the same journal and workbook as a fanout replica: both
+would allocate IDs in them.
+"""
+
+import abc
+import atexit
+import fcntl
+import heapq
+import importlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+import db
+import lead_queries
+import lead_stats
+import migrations
+from lead_dedupe import normalize_email
+
+LEAD_STORE = os.getenv('LEAD_STORE', 'sqlite')  # sqlite, excel, jsonl or fanout
+LEAD_DATABASE = os.getenv('LEAD_DATABASE', 'leads.db')
+EXCEL_FILE = os.getenv('LEAD_EXCEL_FILE', 'katalystvc_leads.xlsx')
+JOURNAL_FILE = os.getenv('LEAD_JOURNAL_FILE', 'katalystvc_leads.journal.jsonl')
+JSONL_FILE = os.getenv('LEAD_JSONL_FILE', 'leads.jsonl')
+FANOUT_BATCH = int(os.getenv('FANOUT_BATCH', '200'))
+# Also picks up leads committed by other worker processes, which don't wake this one
+FANOUT_POLL_SECONDS = float(os.getenv('FANOUT_POLL_SECONDS', '2'))
+FANOUT_RETRY_SECONDS = float(os.getenv('FANOUT_RETRY_SECONDS', '5'))
+FANOUT_FLUSH_SECONDS = float(os.getenv('FANOUT_FLUSH_SECONDS', '10'))  # How long exit waits for the replica
+
+STORE_KINDS = ('sqlite', 'excel', 'jsonl', 'fanout')
+
+# Lead record keys, in workbook column order (the same as lead_journal.LEAD_FIELDS)
+LEAD_FIELDS = [
+    'timestamp', 'lead_id', 'first_name', 'last_name', 'email', 'company',
+    'role', 'phone', 'topic', 'notes', 'consent', 'source_page',
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content'
+]
+EXCEL_HEADERS = [
+    'Timestamp', 'Lead ID', 'First Name', 'Last Name', 'Email', 'Company',
+    'Role', 'Phone', 'Topic', 'Notes', 'Consent', 'Source Page',
+    'UTM Source', 'UTM Medium', 'UTM Campaign', 'UTM Term', 'UTM Content'
+]
+
+# leads table columns in LEAD_FIELDS order (two fields are stored under another name)
+_FIELD_COLUMNS = {'timestamp': 'submission_time', 'lead_id': 'id'}
+_COLUMNS = [_FIELD_COLUMNS.get(field, field) for field in LEAD_FIELDS]
+
+# For copies: the lead keeps the primary's ID, and one that is already here is skipped
+INSERT_LEAD_WITH_ID_SQL = f"""
+    INSERT OR IGNORE INTO leads (
+        id, first_name, last_name, email, company, role, phone, topic, notes, consent,
+        source_page, utm_source, utm_medium, utm_campaign, utm_term, utm_content, submission_time,
+        submitted_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {db.EPOCH_SQL.format('?17')})
+"""
+
+ITERATE_BATCH = 1000
+
+# lead_journal.py and lead_rollup.py live with the Excel API
+EXCEL_API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'katalystvc-excel-api')
+
+
+def _excel_api(module):
+    if EXCEL_API_DIR not in sys.path:
+        sys.path.append(EXCEL_API_DIR)
+    return importlib.import_module(module)
+
+
+def lead_record(data, timestamp, lead_id=None):
+    """The lead record for a validated /submit-lead payload."""
+    return {
+        'timestamp': timestamp,
+        'lead_id': lead_id,
+        'first_name': data['firstName'],
+        'last_name': data['lastName'],
+        'email': data['email'],
+        'company': data.get('company'),
+        'role': data.get('role'),
+        'phone': data.get('phone'),
+        'topic': data.get('topic'),
+        'notes': data.get('notes'),
+        'consent': 'Yes' if data['consent'] else 'No',
+        'source_page': data.get('sourcePage'),
+        'utm_source': data.get('utmSource'),
+        'utm_medium': data.get('utmMedium'),
+        'utm_campaign': data.get('utmCampaign'),
+        'utm_term': data.get('utmTerm'),
+        'utm_content': data.get('utmContent')
+    }
+
+
+def lead_row(record):
+    """A lead record keyed by leads table column, as /leads returns rows."""
+    row = {_FIELD_COLUMNS.get(field, field): value for field, value in record.items()}
+    row['consent'] = 1 if record.get('consent') == 'Yes' else 0
+    return row
+
+
+def _matches(record, args, after):
+    for arg in lead_queries.FILTER_COLUMNS:
+        if args.get(arg) and record.get(arg) != args[arg]:
+            return False
+    if args.get('email') and normalize_email(record.get('email') or '') != normalize_email(args['email']):
+        return False
+    timestamp = str(record.get('timestamp') or '')
+    if args.get('since') and timestamp < args['since']:
+        return False
+    if args.get('until') and timestamp >= args['until']:
+        return False
+    return after is None or (timestamp, record['lead_id']) < after
+
+
+def _page_order(record):
+    return str(record.get('timestamp') or ''), record['lead_id']
+
+
+class LeadStore(abc.ABC):
+    """Base class for the lead storage backends (see the module docstring)."""
+
+    name = None
+
+    def insert(self, record):
+        """Store one lead; sets and returns record['lead_id']."""
+        self.insert_many([record])
+        return record['lead_id']
+
+    @abc.abstractmethod
+    def insert_many(self, records, keep_ids=False):
+        """Store a batch of leads; returns the IDs stored."""
+
+    @abc.abstractmethod
+    def next_id(self):
+        """The ID the next insert will get (informational; inserts allocate their own)."""
+
+    @abc.abstractmethod
+    def count(self):
+        """Number of leads stored."""
+
+    @abc.abstractmethod
+    def iterate(self, after_id=0):
+        """Every lead with an ID above after_id, in ID order."""
+
+    def get(self, lead_id):
+        """The lead with this ID, or None."""
+        record = next(iter(self.iterate(lead_id - 1)), None)
+        return record if record is not None and record['lead_id'] == lead_id else None
+
+    def query(self, args, limit=lead_queries.DEFAULT_PAGE_SIZE):
+        """Leads matching lead_queries-style filters (topic, utm_source, utm_campaign,
+        email, since, until, after), newest first; a limit of None returns them all.
+
+        This version scans iterate(); stores with indexes override it.
+        """
+        after = lead_queries.decode_cursor(args['after']) if args.get('after') else None
+        matching = (record for record in self.iterate() if _matches(record, args, after))
+        if limit is None:
+            return sorted(matching, key=_page_order, reverse=True)
+        return heapq.nlargest(limit, matching, key=_page_order)
+
+    def analytics(self, args):
+        """The /stats response for these leads. Raises QueryError on bad args.
+
+        This version counts a full iterate(); stores that keep rollups override it.
+        """
+        return lead_stats.records_stats(self.iterate(), args)
+
+    def stats(self):
+        """Counters for /health."""
+        return {'store': self.name}
+
+
+class SQLiteStore(LeadStore):
+    """Leads in the leads table of a SQLite database, migrated on first use."""
+
+    name = 'sqlite'
+
+    def __init__(self, database=LEAD_DATABASE):
+        self.database = database
+
+    def connection(self):
+        """This thread's pooled connection to the database (see db.py), migrated first."""
+        migrations.ensure_migrated(self.database)
+        return db.get_connection(self.database)
+
+    @staticmethod
+    def params(record):
+        """INSERT_LEAD_SQL parameters for a lead record."""
+        return (
+            record['first_name'], record['last_name'], record['email'], record.get('company'),
+            record.get('role'), record.get('phone'), record.get('topic'), record.get('notes'),
+            1 if record.get('consent') == 'Yes' else 0, record.get('source_page'), record.get('utm_source'),
+            record.get('utm_medium'), record.get('utm_campaign'), record.get('utm_term'),
+            record.get('utm_content'), record['timestamp']
+        )
+
+    @staticmethod
+    def record(row):
+        """A lead record for a row of _COLUMNS."""
+        record = dict(zip(LEAD_FIELDS, row))
+        record['consent'] = 'Yes' if record['consent'] else 'No'
+        return record
+
+    def insert_row(self, cursor, record):
+        """Insert a lead in the caller's transaction; sets and returns record['lead_id']."""
+        cursor.execute(db.INSERT_LEAD_SQL, self.params(record))
+        record['lead_id'] = cursor.lastrowid
+        return record['lead_id']
+
+    def insert_many(self, records, keep_ids=False):
+        conn = self.connection()
+        cursor = conn.cursor()
+        stored = []
+        try:
+            for record in records:
+                if keep_ids:
+                    cursor.execute(INSERT_LEAD_WITH_ID_SQL, (record['lead_id'],) + self.params(record))
+                    if cursor.rowcount:
+                        stored.append(record['lead_id'])
+                else:
+                    stored.append(self.insert_row(cursor, record))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return stored
+
+    def next_id(self):
+        row = self.connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'leads'").fetchone()
+        return (row[0] if row else 0) + 1
+
+    def count(self):
+        return self.connection().execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+
+    def iterate(self, after_id=0):
+        conn = self.connection()
+        while True:
+            rows = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM leads WHERE id > ? ORDER BY id LIMIT ?",
+                                (after_id, ITERATE_BATCH)).fetchall()
+            for row in rows:
+                yield self.record(row)
+            if len(rows) < ITERATE_BATCH:
+                return
+            after_id = rows[-1]['id']
+
+    def query(self, args, limit=lead_queries.DEFAULT_PAGE_SIZE):
+        sql, params = lead_queries.build_page_query(args, _COLUMNS, limit, lookahead=False)
+        return [self.record(row) for row in self.connection().execute(sql, params)]
+
+    def analytics(self, args):
+        return lead_stats.query_stats(self.connection(), args)
+
+
+class ExcelStore(LeadStore):
+    """Leads in the Excel API's append-only journal, compacted into the (monthly) workbooks."""
+
+    name = 'excel'
+
+    def __init__(self, journal=None):
+        if journal is None:
+            journal = _excel_api('lead_journal').LeadJournal(JOURNAL_FILE, EXCEL_FILE, EXCEL_HEADERS)
+        self.journal = journal
+        self._rollup = None
+        self._rollup_lock = threading.Lock()
+
+    def insert_many(self, records, keep_ids=False):
+        return self.journal.append_many(records, keep_ids)
+
+    def next_id(self):
+        return self.journal.next_lead_id()
+
+    def count(self):
+        return self.journal.total_leads()
+
+    def iterate(self, after_id=0):
+        return self.journal.iter_leads(after_id)
+
+    def get(self, lead_id):
+        return self.journal.find_lead(lead_id)
+
+    def analytics(self, args):
+        # lead_rollup keeps per-day counts and only reads what the journal gained since
+        with self._rollup_lock:
+            if self._rollup is None:
+                self._rollup = _excel_api('lead_rollup').LeadRollup(self.journal)
+        stats = self._rollup.stats(args)
+        stats['total_leads'] = self.journal.total_leads()
+        return stats
+
+    def stats(self):
+        stats = self.journal.stats()
+        return {'store': self.name, 'total_leads': stats['total_leads'], 'pending_compaction': stats['pending_rows']}
+
+
+class JSONLStore(LeadStore):
+    """Leads as lines of an append-only JSONL file; IDs are allocated under an flock on it."""
+
+    name = 'jsonl'
+
+    def __init__(self, path=JSONL_FILE):
+        self.path = path
+
+    def _open(self):
+        return os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+
+    @staticmethod
+    def _tail(fd):
+        """(last lead ID, offset of the file's clean end), ignoring a torn last line."""
+        line, end = _excel_api('lead_journal')._read_last_line(fd, os.fstat(fd).st_size)
+        return (json.loads(line)['lead_id'] if line else 0), end
+
+    def insert_many(self, records, keep_ids=False):
+        stored = []
+        fd = self._open()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            last_id, end = self._tail(fd)
+            if end != os.fstat(fd).st_size:
+                os.ftruncate(fd, end)
+            if keep_ids:
+                records = sorted(records, key=lambda record: record['lead_id'])
+            lines = []
+            for record in records:
+                if keep_ids:
+                    if record['lead_id'] <= last_id:
+                        continue
+                else:
+                    record['lead_id'] = last_id + 1
+                last_id = record['lead_id']
+                stored.append(last_id)
+                lines.append(json.dumps(record, default=str) + '\n')
+            if lines:
+                os.write(fd, ''.join(lines).encode('utf-8'))
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        return stored
+
+    def next_id(self):
+        fd = self._open()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            return self._tail(fd)[0] + 1
+        finally:
+            os.close(fd)
+
+    def count(self):
+        if not os.path.exists(self.path):
+            return 0
+        count = 0
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                count += chunk.count(b'\n')
+        return count
+
+    def iterate(self, after_id=0):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return  # Torn by a crashed writer; the next insert truncates it
+                record = json.loads(line)
+                if record['lead_id'] > after_id:
+                    yield record
+
+
+def copy_batch(source, replica, after_id, batch_size):
+    """Copy up to batch_size leads above after_id from source to replica, in ID order.
+
+    The tailing step shared by FanoutStore and lead_replicator.py. The replica
+    keeps the source's IDs and skips leads it already has, so a batch copied
+    twice (after a crash, or by another process) is harmless. Returns (leads
+    read from the source, IDs the replica stored, the new high-water mark).
+    """
+    batch = list(itertools.islice(source.iterate(after_id), batch_size))
+    if not batch:
+        return 0, [], after_id
+    stored = replica.insert_many(batch, keep_ids=True)
+    return len(batch), stored, batch[-1]['lead_id']
+
+
+class FanoutStore(LeadStore):
+    """Writes to a fast primary, copied to a replica in batches by a background thread.
+
+    The thread tails the primary by lead ID with copy_batch(), as
+    lead_replicator.py does: it reads the leads above the newest one the
+    replica has, in ID order, and inserts them with keep_ids. There is no
+    queue of copies, so nothing is lost when the process dies, copies never
+    arrive out of ID order, and several worker processes tailing the same
+    primary skip what another one already copied. An insert only wakes the
+    thread; a slow or failing replica never fails or delays it, and a failed
+    batch is retried every FANOUT_RETRY_SECONDS. Reads are served by the
+    primary. At exit the thread gets FANOUT_FLUSH_SECONDS to catch up and is
+    then stopped, before db closes its connections.
+    """
+
+    name = 'fanout'
+
+    def __init__(self, primary, replica, batch_size=FANOUT_BATCH):
+        self.primary = primary
+        self.replica = replica
+        self.batch_size = batch_size
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._wakeups = 0  # notify() calls, so the thread knows to look again
+        self._pass = 0  # Copying passes started
+        self._caught_up = 0  # The last pass that found nothing more to copy
+        self._stopped = False
+        self.replicated = 0
+        self.failures = 0
+        self.last_replicated_id = None
+
+    def insert_many(self, records, keep_ids=False):
+        stored = self.primary.insert_many(records, keep_ids)
+        self.notify()
+        return stored
+
+    def start(self):
+        """Start the copying thread (once); also done by the first notify()."""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._replicate_loop, name=f'{self.replica.name}-replica',
+                                                daemon=True)
+                self._thread.start()
+                atexit.register(self.stop, FANOUT_FLUSH_SECONDS)
+
+    def notify(self):
+        """Tell the copying thread the primary has new leads (for callers that wrote to it themselves)."""
+        self.start()
+        with self._cond:
+            self._wakeups += 1
+            self._cond.notify_all()
+
+    def _copy_batch(self):
+        """Copy the next batch above the replica's newest lead; returns the number read from the primary."""
+        if self.last_replicated_id is None:
+            self.last_replicated_id = self.replica.next_id() - 1
+        read, stored, last_id = copy_batch(self.primary, self.replica, self.last_replicated_id, self.batch_size)
+        if read:
+            with self._cond:
+                self.replicated += len(stored)
+                self.last_replicated_id = last_id
+        return read
+
+    def _replicate_loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._pass += 1
+                wakeups = self._wakeups
+            try:
+                copied = self._copy_batch()
+            except Exception as e:
+                with self._cond:
+                    self.failures += 1
+                print(f"Copying leads to the {self.replica.name} replica failed, will retry: {e}")
+                time.sleep(FANOUT_RETRY_SECONDS)
+                continue
+            if copied == self.batch_size:
+                continue
+            with self._cond:
+                self._caught_up = self._pass
+                self._cond.notify_all()
+                if self._wakeups == wakeups and not self._stopped:
+                    self._cond.wait(FANOUT_POLL_SECONDS)
+
+    def flush(self, timeout=None):
+        """Wait until every lead in the primary has reached the replica; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.notify()
+        with self._cond:
+            # Leads committed before this call are in any pass started after it
+            target = self._pass + 1
+            while self._caught_up < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Flush (up to `timeout` seconds), then stop the copying thread."""
+        caught_up = self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return caught_up
+
+    def next_id(self):
+        return self.primary.next_id()
+
+    def count(self):
+        return self.primary.count()
+
+    def iterate(self, after_id=0):
+        return self.primary.iterate(after_id)
+
+    def get(self, lead_id):
+        return self.primary.get(lead_id)
+
+    def query(self, args, limit=lead_queries.DEFAULT_PAGE_SIZE):
+        return self.primary.query(args, limit)
+
+    def analytics(self, args):
+        return self.primary.analytics(args)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'store': self.name,
+                'primary': self.primary.name,
+                'replica': self.replica.name,
+                'replicated': self.replicated,
+                'failures': self.failures,
+                'last_replicated_id': self.last_replicated_id
+            }
+
+
+def sqlite_store(store):
+    """The SQLiteStore a store writes its leads to (itself, or fanout's primary), or None."""
+    if isinstance(store, FanoutStore):
+        store = store.primary
+    return store if isinstance(store, SQLiteStore) else None
+
+
+def excel_journal(store):
+    """The Excel lead journal a store writes to (itself, or fanout's replica), or None."""
+    if isinstance(store, FanoutStore):
+        store = store.replica
+    return store.journal if isinstance(store, ExcelStore) else None
+
+
+def open_store(kind=LEAD_STORE, database=LEAD_DATABASE):
+    """The store LEAD_STORE (or `kind`) selects, with the files configured above."""
+    if kind == 'sqlite':
+        return SQLiteStore(database)
+    if kind == 'excel':
+        return ExcelStore()
+    if kind == 'jsonl':
+        return JSONLStore(JSONL_FILE)
+    if kind == 'fanout':
+        return FanoutStore(SQLiteStore(database), ExcelStore())
+    raise ValueError(f"LEAD_STORE must be one of: {', '.join(STORE_KINDS)}")
@@ -0,0 +1,232 @@
+"""
+KatalystVC Service Metrics
+Counters and histograms for the lead services, rendered in the Prometheus text
+exposition format on each service's /metrics endpoint. Values live in process
+memory, so with several gunicorn workers each worker reports its own numbers
+(scrape them individually, or sum them in the dashboard).
+
+    with metrics.stage('db_insert'):
+        ...
+    metrics.LEADS_SUBMITTED.inc(topic=metrics.topic_label(data['topic']))
+"""
+
+import contextlib
+import threading
+import time
+
+import lead_schema
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the group-commit batch size buckets (leads per transaction)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+# Topic labels are client input, so only the topics the schema accepts get their
+# own label and anything else is reported as 'other'. With LEAD_TOPICS=* (any
+# topic) the default topics are labelled, keeping the label set bounded.
+KNOWN_TOPICS = lead_schema.allowed_topics() or lead_schema.allowed_topics(lead_schema.DEFAULT_LEAD_TOPICS)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram (of durations in seconds unless given other buckets), optionally split by labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {values[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value that can go up and down, set directly or read from `collect()` when rendered.
+
+    A collect function returning None leaves the gauge out of that scrape.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def samples(self):
+        value = self.collect() if self.collect is not None else self._value
+        return [] if value is None else [f"{self.name} {value}"]
+
+
+class Registry:
+    """The set of metrics a /metrics endpoint renders."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, collect=None):
+        return self.register(Gauge(name, documentation, collect))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'lead_http_request_duration_seconds', 'HTTP request latency by endpoint, method and status.',
+    ('endpoint', 'method', 'status'))
+STAGE_SECONDS = REGISTRY.histogram(
+    'lead_submit_stage_duration_seconds', 'Time spent in each stage of /submit-lead and email delivery.',
+    ('stage',))
+LEADS_SUBMITTED = REGISTRY.counter('leads_submitted_total', 'Leads stored, by topic.', ('topic',))
+EMAILS_SENT = REGISTRY.counter('lead_emails_sent_total', 'Emails accepted by the SMTP server.')
+EMAIL_FAILURES = REGISTRY.counter('lead_email_failures_total', 'Email send attempts that failed.')
+DB_ERRORS = REGISTRY.counter('lead_db_errors_total', 'Lead storage (database or journal) errors.')
+INTERNAL_DIGESTS = REGISTRY.counter('lead_internal_digests_total',
+                                    'Internal digest emails queued or sent in place of per-lead notifications.')
+DUPLICATES = REGISTRY.counter('lead_duplicate_submissions_total',
+                              'Repeat submissions answered with the original lead ID.')
+INVALID_SUBMISSIONS = REGISTRY.counter('lead_invalid_submissions_total',
+                                       'Submissions rejected by the lead schema, by HTTP status (400 or 413).',
+                                       ('status',))
+RATE_LIMITED = REGISTRY.counter('lead_rate_limited_total',
+                                'Submissions rejected with 429, by the limit that was hit (ip or global).',
+                                ('limit',))
+GROUP_COMMIT_BATCH_SIZE = REGISTRY.histogram('lead_group_commit_batch_size',
+                                             'Leads written per group-commit transaction.',
+                                             buckets=BATCH_SIZE_BUCKETS)
+GROUP_COMMIT_WAIT_SECONDS = REGISTRY.histogram('lead_group_commit_wait_seconds',
+                                               'Time a lead waited in the group-commit queue for its batch.')
+
+
+def stage(name):
+    """Context manager timing one stage into lead_submit_stage_duration_seconds."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def topic_label(topic):
+    return topic if topic in KNOWN_TOPICS else 'other'
+
+
+def render():
+    return REGISTRY.render()
+
+
+def instrument_flask(app):
+    """Record every request's latency in lead_http_request_duration_seconds."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                    method=request.method, status=str(response.status_code))
+        return response
+
+    return app
@@ -0,0 +1,484 @@
+"""
+KatalystVC Schema Migrations
+Versioned changes to leads.db, shared by every service that opens it (app.py,
+app_with_email.py, asgi_app.py, lead_import.py). The database's
+PRAGMA user_version is the number of the last migration applied; on startup
+each service calls migrate(), which applies the newer ones in order, each in
+its own write transaction together with the version bump, so a crash or a
+second worker starting at the same time never leaves half a migration behind.
+
+A migration that has to touch every row (filling in a new column) splits the
+work: its schema step runs in migrate() and only adds what is cheap, and its
+backfill runs afterwards in batches of MIGRATION_BACKFILL_BATCH rows, one
+short transaction each, with submissions carrying on in between. Progress is
+kept in schema_migrations, so an interrupted backfill resumes where it
+stopped. start_backfills() runs them on a background thread; the CLI runs
+them in the foreground. ensure_migrated() does both at most once per
+process, so a service can call it on every request when it defers startup
+work (FAST_START):
+
+    python migrations.py status     [--db leads.db]
+    python migrations.py migrate    [--db leads.db]
+    python migrations.py backfill   [--db leads.db] [--batch-size 5000]
+
+Applied migrations and backfills are logged with their duration and recorded
+in schema_migrations.
+
+Adding a migration: append a Migration with the next version number. Never
+edit or renumber one that has shipped.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import db
+import lead_search
+
+MIGRATION_BACKFILL_BATCH = int(os.getenv('MIGRATION_BACKFILL_BATCH', '5000'))
+# Pause between backfill batches, leaving the write lock free for submissions
+MIGRATION_BACKFILL_PAUSE_MS = int(os.getenv('MIGRATION_BACKFILL_PAUSE_MS', '20'))
+
+MIGRATIONS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL,
+        seconds REAL NOT NULL,
+        backfill_through INTEGER,
+        backfill_until INTEGER,
+        backfill_completed_at TEXT,
+        backfill_seconds REAL
+    )
+'''
+
+# name, apply(conn) in the migration's transaction, and for large-table changes
+# backfill(conn, after_id, through_id), which updates the leads in that ID range,
+# and finish(conn), run once the backfill is complete. Only leads that existed
+# when the migration was applied are backfilled; later ones are written by
+# code that already knows the new schema. With no leads to backfill, finish
+# runs in the migration's own transaction, so a new database never has its
+# schema changed by a background thread while the services are starting.
+Migration = namedtuple('Migration', 'version name apply backfill finish', defaults=(None, None))
+
+
+# Migration 1's schema: what the services created with CREATE ... IF NOT EXISTS
+# before migrations existed, copied here as it was when it shipped. It must not
+# follow later edits to db.py, lead_stats.py and the rest; those are new migrations.
+BASELINE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS leads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        company TEXT,
+        role TEXT,
+        phone TEXT,
+        topic TEXT NOT NULL,
+        notes TEXT,
+        consent INTEGER NOT NULL,
+        source_page TEXT,
+        utm_source TEXT,
+        utm_medium TEXT,
+        utm_campaign TEXT,
+        utm_term TEXT,
+        utm_content TEXT,
+        submission_time TEXT NOT NULL,
+        submitted_at REAL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_leads_submission_time ON leads (submission_time, id)',
+    'CREATE INDEX IF NOT EXISTS idx_leads_topic_time ON leads (topic, submission_time, id)',
+    'CREATE INDEX IF NOT EXISTS idx_leads_utm_source_time ON leads (utm_source, submission_time, id)',
+    'CREATE INDEX IF NOT EXISTS idx_leads_utm_campaign_time ON leads (utm_campaign, submission_time, id)',
+    '''
+    CREATE TABLE IF NOT EXISTS lead_rollups (
+        dimension TEXT NOT NULL,
+        value TEXT NOT NULL,
+        day TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (dimension, value, day)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS lead_dedupe_keys (
+        dedupe_key TEXT PRIMARY KEY,
+        lead_id INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_lead_dedupe_keys_expires ON lead_dedupe_keys(expires_at)',
+    '''
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lead_id INTEGER,
+        to_email TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        html_body TEXT,
+        is_html INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        lease_until REAL,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)',
+    '''
+    CREATE TABLE IF NOT EXISTS notification_digest (
+        lead_id INTEGER PRIMARY KEY,
+        queued_at REAL NOT NULL
+    )
+    '''
+]
+
+_ROLLUP_DIMENSIONS = ('topic', 'utm_source', 'utm_medium', 'utm_campaign', 'source_page')
+
+
+def _baseline_rollup_trigger(name, event, row, delta):
+    values = ',\n            '.join(
+        f"('{dimension}', COALESCE({row}.{dimension}, ''), substr({row}.submission_time, 1, 10), {delta})"
+        for dimension in _ROLLUP_DIMENSIONS
+    )
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON leads
+    BEGIN
+        INSERT INTO lead_rollups (dimension, value, day, count) VALUES
+            {values}
+        ON CONFLICT (dimension, value, day) DO UPDATE SET count = count + excluded.count;
+    END
+'''
+
+
+BASELINE_ROLLUP_TRIGGERS = {
+    'leads_rollup_insert': _baseline_rollup_trigger('leads_rollup_insert', 'INSERT', 'NEW', 1),
+    'leads_rollup_delete': _baseline_rollup_trigger('leads_rollup_delete', 'DELETE', 'OLD', -1)
+}
+
+BASELINE_ROLLUP_REBUILD_SQL = 'INSERT INTO lead_rollups (dimension, value, day, count) ' + ' UNION ALL '.join(
+    f"SELECT '{dimension}', COALESCE({dimension}, ''), substr(submission_time, 1, 10), COUNT(*) "
+    f"FROM leads GROUP BY 2, 3"
+    for dimension in _ROLLUP_DIMENSIONS
+)
+
+_BASELINE_SEARCH_INDEXED = ('{row}.id NOT BETWEEN (SELECT backfilled_through + 1 FROM lead_search_state) '
+                            'AND (SELECT pending_through FROM lead_search_state)')
+
+BASELINE_SEARCH_INDEX = [
+    '''
+    CREATE TABLE IF NOT EXISTS lead_search_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        backfilled_through INTEGER NOT NULL,
+        pending_through INTEGER NOT NULL
+    )
+    ''',
+    # Leads already in the table predate the index; migration 4 backfills them
+    'INSERT OR IGNORE INTO lead_search_state (id, backfilled_through, pending_through) '
+    'SELECT 1, 0, COALESCE(MAX(id), 0) FROM leads',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(
+        notes, company, role,
+        content='leads',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    ''',
+    "INSERT INTO leads_fts (leads_fts, rank) VALUES ('rank', 'bm25(1.0, 3.0, 2.0)')",
+    '''
+    CREATE TRIGGER IF NOT EXISTS leads_fts_insert AFTER INSERT ON leads
+    BEGIN
+        INSERT INTO leads_fts (rowid, notes, company, role) VALUES (NEW.id, NEW.notes, NEW.company, NEW.role);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS leads_fts_delete AFTER DELETE ON leads WHEN {_BASELINE_SEARCH_INDEXED.format(row='OLD')}
+    BEGIN
+        INSERT INTO leads_fts (leads_fts, rowid, notes, company, role)
+        VALUES ('delete', OLD.id, OLD.notes, OLD.company, OLD.role);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS leads_fts_update AFTER UPDATE OF notes, company, role ON leads
+    WHEN {_BASELINE_SEARCH_INDEXED.format(row='OLD')}
+    BEGIN
+        INSERT INTO leads_fts (leads_fts, rowid, notes, company, role)
+        VALUES ('delete', OLD.id, OLD.notes, OLD.company, OLD.role);
+        INSERT INTO leads_fts (rowid, notes, company, role) VALUES (NEW.id, NEW.notes, NEW.company, NEW.role);
+    END
+    '''
+]
+
+
+def _exists(conn, name):
+    return conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone() is not None
+
+
+def _baseline(conn):
+    # A no-op on databases the services had already set up
+    for statement in BASELINE_TABLES:
+        conn.execute(statement)
+    # Outboxes created before multipart emails have no html_body column
+    if 'html_body' not in _columns(conn, 'email_outbox'):
+        conn.execute('ALTER TABLE email_outbox ADD COLUMN html_body TEXT')
+
+    # New rollup triggers are followed by a recount, so leads from before them are counted
+    missing = [name for name in BASELINE_ROLLUP_TRIGGERS if not _exists(conn, name)]
+    for name in missing:
+        conn.execute(BASELINE_ROLLUP_TRIGGERS[name])
+    if 'leads_rollup_insert' in missing:
+        conn.execute('DELETE FROM lead_rollups')
+        conn.execute(BASELINE_ROLLUP_REBUILD_SQL)
+
+    if not _exists(conn, 'leads_fts'):
+        for statement in BASELINE_SEARCH_INDEX:
+            conn.execute(statement)
+
+
+COVERING_INDEXES = [
+    # /leads?email= (matched the way lead_dedupe normalizes addresses), newest first
+    'CREATE INDEX IF NOT EXISTS idx_leads_email_time ON leads (lower(trim(email)), submission_time, id)',
+    # The KPI pipeline's per-page, per-day lead counts read only these two columns
+    'CREATE INDEX IF NOT EXISTS idx_leads_source_page_time ON leads (source_page, submission_time)'
+]
+
+
+def _covering_indexes(conn):
+    for statement in COVERING_INDEXES:
+        conn.execute(statement)
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _add_submitted_at(conn):
+    # New databases get the column from BASELINE_TABLES; ADD COLUMN only
+    # rewrites the schema, not the rows
+    if 'submitted_at' not in _columns(conn, 'leads'):
+        conn.execute('ALTER TABLE leads ADD COLUMN submitted_at REAL')
+
+
+def _backfill_submitted_at(conn, after_id, through_id):
+    conn.execute(f'UPDATE leads SET submitted_at = {db.EPOCH_SQL.format("submission_time")} '
+                 f'WHERE id > ? AND id <= ? AND submitted_at IS NULL', (after_id, through_id))
+
+
+def _index_submitted_at(conn):
+    # Built after the backfill so the batches don't maintain it row by row
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_leads_submitted_at ON leads (submitted_at, id)')
+
+
+def _start_search_backfill(conn):
+    # Nothing to change: lead_search_state already records which leads predate
+    # the full-text index; this migration's backfill indexes them
+    pass
+
+
+def _backfill_search_index(conn, after_id, through_id):
+    lead_search.index_through(conn, through_id)
+
+
+def _optimize_search_index(conn):
+    if lead_search.backfill_status(conn)['pending_through']:
+        conn.execute("INSERT INTO leads_fts (leads_fts) VALUES ('optimize')")
+
+
+MIGRATIONS = [
+    Migration(1, 'baseline schema', _baseline),
+    Migration(2, 'covering indexes for email lookups and per-page counts', _covering_indexes),
+    Migration(3, 'typed submitted_at timestamp', _add_submitted_at, _backfill_submitted_at, _index_submitted_at),
+    Migration(4, 'full-text index backfill for leads that predate it', _start_search_backfill,
+              _backfill_search_index, _optimize_search_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Apply every migration newer than the database's user_version.
+
+    Returns [{'version', 'name', 'seconds'}] for the ones applied here (empty
+    if the database was already current or another worker got there first).
+    Backfills are left for run_backfills().
+    """
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for migration in migrations:
+        if migration.version <= schema_version(conn):
+            continue
+        start = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if migration.version <= schema_version(conn):  # Another worker applied it while we waited
+                conn.rollback()
+                continue
+            conn.execute(MIGRATIONS_TABLE_SQL)
+            migration.apply(conn)
+            until = conn.execute('SELECT COALESCE(MAX(id), 0) FROM leads').fetchone()[0] \
+                if migration.backfill else None
+            completed_at = None
+            if until == 0:
+                # Nothing to backfill: finish now rather than on the backfill thread
+                if migration.finish:
+                    migration.finish(conn)
+                completed_at = datetime.now().isoformat()
+            seconds = round(time.perf_counter() - start, 3)
+            conn.execute('INSERT OR REPLACE INTO schema_migrations (version, name, applied_at, seconds, '
+                         'backfill_through, backfill_until, backfill_completed_at, backfill_seconds) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (migration.version, migration.name, datetime.now().isoformat(), seconds,
+                          0 if migration.backfill else None, until, completed_at,
+                          0.0 if completed_at else None))
+            conn.execute(f'PRAGMA user_version = {int(migration.version)}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"Applied migration {migration.version} ({migration.name}) in {seconds}s")
+        applied.append({'version': migration.version, 'name': migration.name, 'seconds': seconds})
+    return applied
+
+
+def pending_backfills(conn, migrations=MIGRATIONS):
+    """Applied migrations whose backfill hasn't completed, with how far each has got."""
+    by_version = {migration.version: migration for migration in migrations}
+    rows = conn.execute('SELECT version, backfill_through FROM schema_migrations '
+                        'WHERE backfill_through IS NOT NULL AND backfill_completed_at IS NULL ORDER BY version')
+    return [(by_version[version], through) for version, through in rows if version in by_version]
+
+
+def run_backfills(conn, batch_size=MIGRATION_BACKFILL_BATCH, pause_ms=MIGRATION_BACKFILL_PAUSE_MS,
+                  migrations=MIGRATIONS):
+    """Run every pending backfill to completion, one short transaction per batch.
+
+    Safe to run from several processes at once: each batch re-reads the
+    progress under the write lock. Returns [{'version', 'name', 'seconds'}]
+    for the backfills completed here.
+    """
+    completed = []
+    for migration, _ in pending_backfills(conn, migrations):
+        start = time.perf_counter()
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                through, until, done = conn.execute(
+                    'SELECT backfill_through, backfill_until, backfill_completed_at FROM schema_migrations '
+                    'WHERE version = ?', (migration.version,)).fetchone()
+                if done:
+                    conn.rollback()
+                    break
+                if through >= until:
+                    if migration.finish:
+                        migration.finish(conn)
+                    seconds = round(time.perf_counter() - start, 3)
+                    conn.execute('UPDATE schema_migrations SET backfill_completed_at = ?, backfill_seconds = ? '
+                                 'WHERE version = ?', (datetime.now().isoformat(), seconds, migration.version))
+                    conn.commit()
+                    print(f"Backfilled migration {migration.version} ({migration.name}) in {seconds}s")
+                    completed.append({'version': migration.version, 'name': migration.name, 'seconds': seconds})
+                    break
+                last_id = min(through + batch_size, until)
+                migration.backfill(conn, through, last_id)
+                conn.execute('UPDATE schema_migrations SET backfill_through = ? WHERE version = ?',
+                             (last_id, migration.version))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if pause_ms:
+                time.sleep(pause_ms / 1000)
+    return completed
+
+
+def _backfill_loop(database):
+    conn = db.connect(database)
+    try:
+        run_backfills(conn)
+    except sqlite3.Error as e:
+        print(f"Migration backfill stopped, will resume on next start: {e}")
+    finally:
+        db.close(conn)
+
+
+def start_backfills(database):
+    """Run pending backfills on a daemon thread (returns None if there are none)."""
+    conn = db.connect(database)
+    try:
+        if not pending_backfills(conn):
+            return None
+    finally:
+        db.close(conn)
+    thread = threading.Thread(target=_backfill_loop, args=(database,), name='migration-backfill', daemon=True)
+    thread.start()
+    return thread
+
+
+_migrated = set()  # Databases this process has already brought up to date
+_migrated_lock = threading.Lock()
+
+
+def ensure_migrated(database):
+    """migrate() and start_backfills() for `database`, once per process.
+
+    Later calls return without touching the database, so this is cheap
+    enough to run before every request.
+    """
+    if database in _migrated:
+        return
+    with _migrated_lock:
+        if database in _migrated:
+            return
+        migrate(db.get_connection(database))
+        start_backfills(database)
+        _migrated.add(database)
+
+
+def status(conn):
+    """Schema version and the recorded migrations, for the CLI and /health."""
+    report = {'schema_version': schema_version(conn), 'latest_version': LATEST_VERSION, 'migrations': []}
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'schema_migrations'").fetchone():
+        report['migrations'] = [
+            {'version': row[0], 'name': row[1], 'applied_at': row[2], 'seconds': row[3],
+             'backfill': None if row[4] is None else
+             {'through_lead_id': row[4], 'until_lead_id': row[5], 'completed_at': row[6], 'seconds': row[7]}}
+            for row in conn.execute('SELECT version, name, applied_at, seconds, backfill_through, backfill_until, '
+                                    'backfill_completed_at, backfill_seconds FROM schema_migrations '
+                                    'ORDER BY version')
+        ]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('status', 'migrate', 'backfill'))
+    parser.add_argument('--db', default='leads.db')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BACKFILL_BATCH)
+    parser.add_argument('--pause-ms', type=int, default=MIGRATION_BACKFILL_PAUSE_MS)
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    if args.command in ('migrate', 'backfill'):
+        migrate(conn)
+    if args.command == 'backfill':
+        run_backfills(conn, args.batch_size, args.pause_ms)
+    print(json.dumps(status(conn), indent=2))
+    db.close(conn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+KatalystVC Internal Notification Digest
+Optional batching of the per-lead internal notification emails. With
+INTERNAL_DIGEST_MINUTES set, a submitted lead's ID is queued in
+notification_digest (in the lead's own transaction) instead of an internal
+email, and a flusher thread turns the queue into one summary email in the
+outbox every INTERNAL_DIGEST_MINUTES, or as soon as INTERNAL_DIGEST_MAX_LEADS
+leads are waiting. Leads whose topic is listed in INTERNAL_DIGEST_URGENT_TOPICS
+still get their own email straight away. Confirmation emails to the lead are
+never digested. queue_lead_emails() makes that choice for a submitted lead
+and queues whatever it sends in the lead's transaction.
+
+LeadDigestBuffer is the in-memory equivalent for the Excel API, which sends
+its emails inline and has no outbox.
+"""
+
+import os
+import threading
+import time
+
+import db
+import metrics
+import outbox
+from email_templates import (lead_template_data, render_confirmation, render_internal_digest,
+                             render_internal_notification)
+
+INTERNAL_DIGEST_MINUTES = float(os.getenv('INTERNAL_DIGEST_MINUTES', '0'))  # 0 = one email per lead
+INTERNAL_DIGEST_MAX_LEADS = int(os.getenv('INTERNAL_DIGEST_MAX_LEADS', '50'))
+INTERNAL_DIGEST_URGENT_TOPICS = frozenset(
+    topic.strip() for topic in os.getenv('INTERNAL_DIGEST_URGENT_TOPICS', '').split(',') if topic.strip()
+)
+DIGEST_ENABLED = INTERNAL_DIGEST_MINUTES > 0
+
+# How often the flusher re-checks the queue age (it is also woken at MAX_LEADS)
+DIGEST_POLL_SECONDS = 5.0
+# How long LeadDigestBuffer waits before resending a digest that failed
+DIGEST_RETRY_SECONDS = float(os.getenv('DIGEST_RETRY_SECONDS', '60'))
+
+QUEUE_SQL = 'INSERT OR IGNORE INTO notification_digest (lead_id, queued_at) VALUES (?, ?)'
+PENDING_SQL = 'SELECT COUNT(*), MIN(queued_at) FROM notification_digest'
+
+_wakeup = threading.Event()
+_queued = 0
+_queued_lock = threading.Lock()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def should_digest(topic):
+    """True if this lead's internal notification goes into the digest."""
+    return DIGEST_ENABLED and topic not in INTERNAL_DIGEST_URGENT_TOPICS
+
+
+def queue_lead(cursor, lead_id):
+    """Queue a lead for the next digest using the caller's cursor (commits with the lead)."""
+    cursor.execute(QUEUE_SQL, (lead_id, time.time()))
+
+
+def queue_lead_emails(cursor, lead_id, data, submission_time, internal_email, digest=None):
+    """Queue a lead's emails on the caller's cursor, so they commit with the lead.
+
+    The confirmation always goes to the outbox; the internal notification
+    goes there too, or into the digest queue when `digest` (by default
+    should_digest()) says so. The flusher reads digested leads back from the
+    leads table, so leads kept elsewhere must pass digest=False.
+    """
+    if digest is None:
+        digest = should_digest(data['topic'])
+    with metrics.stage('render_templates'):
+        confirmation = render_confirmation(data['firstName'], data['topic'])
+        if not digest:
+            notification = render_internal_notification(lead_template_data(lead_id, data, submission_time))
+
+    with metrics.stage('enqueue_emails'):
+        outbox.enqueue_email(cursor, data['email'], confirmation.subject, confirmation.text,
+                             lead_id=lead_id, html_body=confirmation.html)
+        if digest:
+            queue_lead(cursor, lead_id)
+        else:
+            outbox.enqueue_email(cursor, internal_email, notification.subject, notification.text,
+                                 lead_id=lead_id, html_body=notification.html)
+
+
+def lead_queued(count=1):
+    """Call after committing queued leads; wakes the flusher once a full digest is waiting."""
+    global _queued
+    with _queued_lock:
+        _queued += count
+        full = _queued >= INTERNAL_DIGEST_MAX_LEADS
+    if full:
+        _wakeup.set()
+
+
+def pending(conn):
+    """(leads waiting, seconds the oldest has waited) for /health."""
+    count, oldest = conn.execute(PENDING_SQL).fetchone()
+    return count, (time.time() - oldest) if oldest is not None else 0.0
+
+
+def lead_row_data(row):
+    """Template data for a leads row (the column names are the template fields)."""
+    data = dict(row)
+    data['consent'] = bool(data['consent'])
+    return data
+
+
+def flush(conn, internal_email, force=False, max_leads=INTERNAL_DIGEST_MAX_LEADS,
+          max_age_seconds=INTERNAL_DIGEST_MINUTES * 60):
+    """Move waiting leads into digest emails in the outbox if a digest is due.
+
+    A digest is due when max_leads are waiting or the oldest has waited
+    max_age_seconds (or always with force=True). Each email covers at most
+    max_leads leads. `conn` must be in autocommit mode (isolation_level=None).
+    Returns the number of digest emails queued.
+    """
+    global _queued
+    emails = 0
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        count, oldest = conn.execute(PENDING_SQL).fetchone()
+        due = count and (force or count >= max_leads or oldest <= time.time() - max_age_seconds)
+        while due:
+            lead_ids = [row[0] for row in conn.execute(
+                'SELECT lead_id FROM notification_digest ORDER BY lead_id LIMIT ?', (max_leads,))]
+            if not lead_ids:
+                break
+            placeholders = ', '.join('?' * len(lead_ids))
+            rows = conn.execute(f'SELECT * FROM leads WHERE id IN ({placeholders}) ORDER BY id', lead_ids).fetchall()
+            if rows:
+                email = render_internal_digest([lead_row_data(row) for row in rows])
+                outbox.enqueue_email(conn.cursor(), internal_email, email.subject, email.text,
+                                     html_body=email.html)
+                emails += 1
+            conn.execute(f'DELETE FROM notification_digest WHERE lead_id IN ({placeholders})', lead_ids)
+            due = len(lead_ids) == max_leads
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    if emails:
+        with _queued_lock:
+            _queued = 0
+        metrics.INTERNAL_DIGESTS.inc(emails)
+        print(f"Queued {emails} internal digest email(s)")
+    return emails
+
+
+def _flusher_loop(database, internal_email, on_flush, stop_event):
+    conn = db.connect(database, isolation_level=None)
+    poll = min(DIGEST_POLL_SECONDS, INTERNAL_DIGEST_MINUTES * 60)
+    try:
+        while not stop_event.is_set():
+            _wakeup.wait(poll)
+            _wakeup.clear()
+            try:
+                if flush(conn, internal_email, force=stop_event.is_set()):
+                    on_flush()
+            except Exception as e:
+                print(f"Digest flusher error: {e}")
+    finally:
+        db.close(conn)
+
+
+def start_flusher(database, internal_email, on_flush=outbox.notify):
+    """Start the digest flusher thread once per process; on_flush runs after each digest is queued."""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            stop_event = threading.Event()
+            _flusher = threading.Thread(target=_flusher_loop, args=(database, internal_email, on_flush, stop_event),
+                                        name='notification-digest', daemon=True)
+            _flusher.stop_event = stop_event
+            _flusher.start()
+    return _flusher
+
+
+def stop_flusher(timeout=5):
+    """Stop the flusher thread, sending whatever is queued first."""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is not None:
+            _flusher.stop_event.set()
+            _wakeup.set()
+            _flusher.join(timeout)
+            _flusher = None
+
+
+class LeadDigestBuffer:
+    """In-process digest for services that send email inline (the Excel API).
+
+    add() buffers a lead's template data; a background thread calls
+    `send(rendered_email)` with one digest every `minutes` or as soon as
+    `max_leads` are buffered. `send` raises if the digest was not sent; its
+    leads then stay buffered and are retried after DIGEST_RETRY_SECONDS.
+    Buffered leads are lost if the process dies, but the leads themselves
+    are already stored.
+    """
+
+    def __init__(self, send, minutes=INTERNAL_DIGEST_MINUTES, max_leads=INTERNAL_DIGEST_MAX_LEADS):
+        self.send = send
+        self.max_age = minutes * 60
+        self.max_leads = max_leads
+        self._leads = []
+        self._oldest = None
+        self._retry_at = None  # Set after a failed send; nothing is sent before it
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lead-digest', daemon=True)
+        self._thread.start()
+
+    def add(self, lead_data):
+        with self._lock:
+            first = not self._leads
+            if first:
+                self._oldest = time.monotonic()
+            self._leads.append(lead_data)
+            full = len(self._leads) >= self.max_leads
+        if first or full:
+            self._wakeup.set()  # Re-arm the timer for the new oldest lead, or flush now
+
+    def pending(self):
+        with self._lock:
+            return len(self._leads)
+
+    def flush(self):
+        """Send everything buffered now, max_leads per email. Returns the number of emails.
+
+        Leads in a digest that failed to send go back to the front of the buffer.
+        """
+        with self._lock:
+            leads, oldest = self._leads, self._oldest
+            self._leads, self._oldest = [], None
+        emails = 0
+        failed = []
+        for start in range(0, len(leads), self.max_leads):
+            batch = leads[start:start + self.max_leads]
+            try:
+                self.send(render_internal_digest(batch))
+                emails += 1
+            except Exception as e:
+                print(f"Digest send failed, keeping {len(batch)} leads for a retry: {e}")
+                failed.extend(batch)
+        with self._lock:
+            if failed:
+                self._leads[:0] = failed
+                self._oldest = oldest
+                self._retry_at = time.monotonic() + DIGEST_RETRY_SECONDS
+            elif leads:
+                self._retry_at = None
+        if emails:
+            metrics.INTERNAL_DIGESTS.inc(emails)
+        return emails
+
+    def _run(self):
+        while True:
+            with self._lock:
+                oldest, retry_at = self._oldest, self._retry_at
+            timeout = None
+            if oldest is not None:
+                timeout = max(0.0, max(oldest + self.max_age, retry_at or 0.0) - time.monotonic())
+            self._wakeup.wait(DIGEST_POLL_SECONDS if timeout is None else min(timeout, DIGEST_POLL_SECONDS))
+            self._wakeup.clear()
+            with self._lock:
+                now = time.monotonic()
+                due = self._leads and (self._retry_at is None or now >= self._retry_at) and (
+                    len(self._leads) >= self.max_leads or now - self._oldest >= self.max_age)
+            if due:
+                self.flush()
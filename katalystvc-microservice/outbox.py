@@ -0,0 +1,186 @@
+"""
+KatalystVC Email Outbox
+A durable outbox table stored next to the leads in SQLite, drained by a pool of
+background sender threads. Messages are written in the same transaction as the
+lead they belong to, so a committed lead always has its emails queued.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import db
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '2'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_BACKOFF_SECONDS', '30'))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv('OUTBOX_BACKOFF_MAX_SECONDS', '3600'))
+OUTBOX_LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE_SECONDS', '120'))
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '1'))
+
+# Message states
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+# Shared with the asyncio sender in asgi_app.py
+ENQUEUE_SQL = """
+    INSERT INTO email_outbox (
+        lead_id, to_email, subject, body, html_body, is_html, status, next_attempt_at, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SELECT_DUE_SQL = """
+    SELECT * FROM email_outbox
+    WHERE (status = ? AND next_attempt_at <= ?)
+       OR (status = ? AND lease_until < ?)
+    ORDER BY next_attempt_at, id
+    LIMIT 1
+"""
+LEASE_SQL = "UPDATE email_outbox SET status = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?"
+MARK_SENT_SQL = "UPDATE email_outbox SET status = ?, lease_until = NULL, last_error = NULL, sent_at = ? WHERE id = ?"
+MARK_DEAD_SQL = "UPDATE email_outbox SET status = ?, lease_until = NULL, last_error = ? WHERE id = ?"
+MARK_RETRY_SQL = "UPDATE email_outbox SET status = ?, lease_until = NULL, last_error = ?, next_attempt_at = ? WHERE id = ?"
+STATS_SQL = 'SELECT status, COUNT(*) AS n FROM email_outbox GROUP BY status'
+
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def enqueue_email(cursor, to_email, subject, body, lead_id=None, is_html=False, not_before=None,
+                  html_body=None):
+    """Queue an email using the caller's cursor so it commits with the lead.
+
+    `html_body` is sent as the HTML alternative to the plain-text `body`.
+    `not_before` (a time.time() value) holds the message back until then,
+    which lets bulk callers spread a large batch out over time.
+    """
+    cursor.execute(
+        ENQUEUE_SQL,
+        (lead_id, to_email, subject, body, html_body, 1 if is_html else 0, PENDING,
+         time.time() if not_before is None else not_before, datetime.now().isoformat())
+    )
+    return cursor.lastrowid
+
+
+def notify():
+    """Wake the sender workers after new messages have been committed."""
+    _wakeup.set()
+
+
+def backoff_delay(attempts):
+    """Exponential backoff for the given number of failed attempts."""
+    return min(OUTBOX_BACKOFF_SECONDS * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def claim_next(conn):
+    """Lease the next due message, or return None if nothing is due.
+
+    A message is due when it is pending and its retry time has passed, or when
+    it was leased by a worker that never reported back (crash, kill -9).
+    """
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(SELECT_DUE_SQL, (PENDING, now, SENDING, now)).fetchone()
+        if row is not None:
+            conn.execute(LEASE_SQL, (SENDING, now + OUTBOX_LEASE_SECONDS, row['id']))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return row
+
+
+def mark_sent(conn, message_id):
+    """Record a successful delivery."""
+    conn.execute(MARK_SENT_SQL, (SENT, datetime.now().isoformat(), message_id))
+    conn.commit()
+
+
+def mark_failed(conn, message_id, attempts, error):
+    """Schedule a retry, or move the message to the dead-letter state."""
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        conn.execute(MARK_DEAD_SQL, (DEAD, str(error), message_id))
+        print(f"Outbox message {message_id} dead after {attempts} attempts: {error}")
+    else:
+        conn.execute(MARK_RETRY_SQL, (PENDING, str(error), time.time() + backoff_delay(attempts), message_id))
+        print(f"Outbox message {message_id} failed (attempt {attempts}), will retry: {error}")
+    conn.commit()
+
+
+def process_one(conn, deliver):
+    """Claim and deliver a single message. Returns False if the queue was idle."""
+    row = claim_next(conn)
+    if row is None:
+        return False
+
+    attempts = row['attempts'] + 1
+    try:
+        deliver(row['to_email'], row['subject'], row['body'], bool(row['is_html']), row['html_body'])
+    except Exception as e:
+        mark_failed(conn, row['id'], attempts, e)
+    else:
+        mark_sent(conn, row['id'])
+    return True
+
+
+def _worker_loop(database, deliver, stop_event):
+    conn = db.connect(database, isolation_level=None)
+    try:
+        while not stop_event.is_set():
+            try:
+                busy = process_one(conn, deliver)
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                busy = False
+            if not busy:
+                _wakeup.wait(OUTBOX_POLL_SECONDS)
+                _wakeup.clear()
+    finally:
+        db.close(conn)
+
+
+def start_workers(database, deliver, count=OUTBOX_WORKERS):
+    """Start the background sender threads once per process.
+
+    `deliver(to_email, subject, body, is_html, html_body)` must raise on
+    failure so the message can be retried.
+    """
+    with _workers_lock:
+        if _workers:
+            return _workers
+        stop_event = threading.Event()
+        for i in range(count):
+            thread = threading.Thread(
+                target=_worker_loop,
+                args=(database, deliver, stop_event),
+                name=f"outbox-sender-{i}",
+                daemon=True
+            )
+            thread.stop_event = stop_event
+            thread.start()
+            _workers.append(thread)
+    return _workers
+
+
+def stop_workers(timeout=5):
+    """Signal the sender threads to exit and wait for them."""
+    with _workers_lock:
+        for thread in _workers:
+            thread.stop_event.set()
+        _wakeup.set()
+        for thread in _workers:
+            thread.join(timeout)
+        _workers.clear()
+
+
+def outbox_stats(conn):
+    """Count messages per state."""
+    rows = conn.execute(STATS_SQL).fetchall()
+    stats = {PENDING: 0, SENDING: 0, SENT: 0, DEAD: 0}
+    for row in rows:
+        stats[row['status']] = row['n']
+    return stats
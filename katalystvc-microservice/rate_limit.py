@@ -0,0 +1,312 @@
+"""
+KatalystVC Rate Limiting
+Token buckets that keep a flood of /submit-lead requests from turning into
+SQLite writes and SMTP sends. Each client IP gets a bucket, and one global
+bucket caps the whole service; a request over either limit is answered with
+429 and a Retry-After header before the body is even parsed.
+
+Limits are "<count>/<second|minute|hour>" strings: the bucket holds `count`
+tokens (the burst) and refills at count per period. "0" or "" turns a limit
+off.
+
+    RATE_LIMIT_PER_IP    default 10/minute
+    RATE_LIMIT_GLOBAL    default 50/second
+    SMTP_RATE_LIMIT      default 30/minute, outbound email per process; over the
+                         limit, sends wait their turn instead of failing
+
+Behind a reverse proxy or load balancer every request arrives from the
+proxy's address, so RATE_LIMIT_TRUSTED_PROXIES must be set to the number of
+proxies in front of the service for the per-IP limit to see the visitor's
+address in X-Forwarded-For (set it to 0 when clients connect directly). While
+it is unset the service logs a warning at startup, and again on the first
+request that carries X-Forwarded-For.
+
+Buckets live in process memory by default. With several gunicorn workers, set
+RATE_LIMIT_DB to a SQLite file to share them: each decision is then one UPSERT
+on that file (kept separate from leads.db so it never competes with lead
+writes). If the shared state is unavailable the request is let through.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+
+RATE_LIMIT_PER_IP = os.getenv('RATE_LIMIT_PER_IP', '10/minute')
+RATE_LIMIT_GLOBAL = os.getenv('RATE_LIMIT_GLOBAL', '50/second')
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '')  # Shared bucket state for multi-worker setups
+# Number of reverse proxies in front of the service whose X-Forwarded-For entries are trusted
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+# Unset means nobody has said whether there is a proxy; set to 0 to silence the warnings
+RATE_LIMIT_PROXIES_CONFIGURED = 'RATE_LIMIT_TRUSTED_PROXIES' in os.environ
+
+# Idle in-memory buckets are dropped once there are this many
+MAX_BUCKETS = 100000
+
+# The shared state must answer quickly or not at all
+SHARED_BUSY_TIMEOUT_MS = 50
+
+PERIODS = {'second': 1, 'sec': 1, 's': 1, 'minute': 60, 'min': 60, 'm': 60, 'hour': 3600, 'hr': 3600, 'h': 3600}
+
+GLOBAL_KEY = '*'
+
+BUCKETS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        bucket_key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        allowed INTEGER NOT NULL
+    ) WITHOUT ROWID
+'''
+# Refill, then take a token if there is one, in a single atomic statement.
+# Params: key, capacity, now, rate; the refilled level is min(capacity, tokens + elapsed * rate).
+TAKE_SQL = '''
+    INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at, allowed)
+    VALUES (?1, ?2 - 1, ?3, 1)
+    ON CONFLICT (bucket_key) DO UPDATE SET
+        allowed = min(?2, tokens + max(0, ?3 - updated_at) * ?4) >= 1,
+        tokens = min(?2, tokens + max(0, ?3 - updated_at) * ?4)
+                 - (min(?2, tokens + max(0, ?3 - updated_at) * ?4) >= 1),
+        updated_at = max(updated_at, ?3)
+    RETURNING tokens, allowed
+'''
+
+
+class RateLimitConfigError(ValueError):
+    """A limit string isn't "<count>/<period>"."""
+
+
+def parse_rate(value):
+    """(capacity, tokens per second) for a limit string, or None if it is off."""
+    value = (value or '').strip().lower()
+    if value in ('', '0', 'off', 'none'):
+        return None
+    count, _, period = value.partition('/')
+    period = period.strip().rstrip('s') or 'second'
+    try:
+        count = float(count)
+    except ValueError:
+        count = None
+    if count is None or count < 0 or period not in PERIODS:
+        raise RateLimitConfigError(f"Rate limit must look like 10/minute, got {value!r}")
+    if count == 0:
+        return None
+    return count, count / PERIODS[period]
+
+
+def retry_after_header(seconds):
+    """Whole seconds for a Retry-After header (at least 1)."""
+    return str(max(1, math.ceil(seconds)))
+
+
+class TokenBuckets:
+    """Thread-safe in-memory token buckets, one per key, sharing one rate."""
+
+    def __init__(self, capacity, rate, max_buckets=MAX_BUCKETS):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_buckets = max_buckets
+        self._buckets = {}  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Take a token for key. Returns 0.0 if allowed, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self._buckets[key] = [self.capacity, now]
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def reserve(self, key, now=None):
+        """Take a token for key even if it isn't there yet; returns how long to wait before using it.
+
+        Callers that queue rather than drop (outbound email) sleep for the
+        returned delay, so concurrent callers are spaced out in arrival order.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate) - 1
+            bucket[0], bucket[1] = tokens, now
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def _prune(self, now):
+        # Buckets that have refilled completely are indistinguishable from new ones
+        full_after = self.capacity / self.rate
+        for key in [key for key, (_, updated_at) in self._buckets.items() if now - updated_at >= full_after]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_buckets:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedTokenBuckets:
+    """Token buckets in a SQLite file, shared by every worker process that opens it.
+
+    Each decision is one UPSERT in autocommit mode. Threads in a process take
+    turns on one connection behind a lock, which costs microseconds, rather
+    than contending for SQLite's write lock, whose busy handler sleeps in
+    milliseconds; only other processes are left to contend for the file.
+    Times are wall-clock (time.time()) since processes don't share a
+    monotonic clock.
+    """
+
+    def __init__(self, capacity, rate, database, prefix=''):
+        self.capacity = capacity
+        self.rate = rate
+        self.database = database
+        self.prefix = prefix
+        self._conn, self._lock = _shared_connection(database)
+
+    def take(self, key, now=None):
+        """Same contract as TokenBuckets.take."""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, allowed = self._conn.execute(
+                TAKE_SQL, (self.prefix + key, self.capacity, now, self.rate)).fetchone()
+        return 0.0 if allowed else (1 - tokens) / self.rate
+
+    def prune(self, now=None):
+        """Delete buckets that have refilled completely (they'd start full anyway)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.execute('DELETE FROM rate_limit_buckets WHERE bucket_key LIKE ? AND updated_at <= ?',
+                               (self.prefix + '%', now - self.capacity / self.rate))
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _shared_connection(database):
+    """This process's (connection, lock) for a shared state file, creating the table on first use."""
+    with _shared_lock:
+        entry = _shared.get(database)
+        if entry is None:
+            conn = sqlite3.connect(database, timeout=SHARED_BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # Losing bucket levels in a crash is harmless
+            conn.execute(f'PRAGMA busy_timeout={SHARED_BUSY_TIMEOUT_MS}')
+            conn.execute(BUCKETS_TABLE_SQL)
+            entry = _shared[database] = (conn, threading.Lock())
+    return entry
+
+
+def make_buckets(limit, database=RATE_LIMIT_DB, prefix=''):
+    """TokenBuckets (or SharedTokenBuckets when `database` is set) for a limit string, or None if off."""
+    rate = parse_rate(limit)
+    if rate is None:
+        return None
+    if database:
+        return SharedTokenBuckets(rate[0], rate[1], database, prefix)
+    return TokenBuckets(*rate)
+
+
+_proxy_config_checked = False
+_forwarded_for_warned = False
+
+
+def _warn_forwarded_for_ignored(remote_addr):
+    global _forwarded_for_warned
+    _forwarded_for_warned = True
+    print(f"WARNING: requests from {remote_addr} carry X-Forwarded-For but RATE_LIMIT_TRUSTED_PROXIES "
+          f"is not set, so every client behind that proxy shares one per-IP rate limit bucket. "
+          f"Set RATE_LIMIT_TRUSTED_PROXIES to the number of proxies in front of the service.")
+
+
+def client_ip(remote_addr, forwarded_for=None, trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES):
+    """The address to rate-limit by.
+
+    X-Forwarded-For is client-controlled, so it is only used with
+    trusted_proxies set, taking the entry that many hops from the right.
+    """
+    if forwarded_for:
+        if trusted_proxies:
+            hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+            if hops:
+                return hops[-min(trusted_proxies, len(hops))]
+        elif not RATE_LIMIT_PROXIES_CONFIGURED and not _forwarded_for_warned:
+            _warn_forwarded_for_ignored(remote_addr)
+    return remote_addr or 'unknown'
+
+
+def check_proxy_config(per_ip_enabled):
+    """Log once at startup when a per-IP limit is on but nobody has said how many proxies there are."""
+    global _proxy_config_checked
+    if per_ip_enabled and not RATE_LIMIT_PROXIES_CONFIGURED and not _proxy_config_checked:
+        _proxy_config_checked = True
+        print("WARNING: RATE_LIMIT_TRUSTED_PROXIES is not set; the per-IP rate limit keys on the socket "
+              "address. Behind a reverse proxy or load balancer that is the proxy's address, shared by "
+              "every visitor. Set it to the number of proxies in front of the service (0 if none).")
+
+
+class SubmitRateLimiter:
+    """The per-IP and global /submit-lead limits."""
+
+    def __init__(self, per_ip=RATE_LIMIT_PER_IP, global_limit=RATE_LIMIT_GLOBAL, database=RATE_LIMIT_DB):
+        self.limits = {'per_ip': per_ip, 'global': global_limit}
+        self.database = database
+        self.per_ip = make_buckets(per_ip, database, prefix='ip:')
+        self.global_bucket = make_buckets(global_limit, database, prefix='global:')
+        self._checks = 0
+        check_proxy_config(self.per_ip is not None)
+
+    @property
+    def enabled(self):
+        return self.per_ip is not None or self.global_bucket is not None
+
+    def check(self, ip):
+        """None if the request may proceed, else (scope, retry_after_seconds).
+
+        The IP bucket is checked first, so a flooding client can't drain the
+        global bucket for everyone else. Shared-state errors fail open.
+        """
+        try:
+            if self.per_ip is not None:
+                wait = self.per_ip.take(ip)
+                if wait:
+                    return 'ip', wait
+            if self.global_bucket is not None:
+                wait = self.global_bucket.take(GLOBAL_KEY)
+                if wait:
+                    return 'global', wait
+        except sqlite3.Error as e:
+            print(f"Rate limit state unavailable, allowing request: {e}")
+            return None
+        self._checks += 1
+        if self._checks % 10000 == 0 and isinstance(self.per_ip, SharedTokenBuckets):
+            try:
+                self.per_ip.prune()
+            except sqlite3.Error:
+                pass
+        return None
+
+    def stats(self):
+        """Limits and in-memory bucket count for /health."""
+        stats = {'per_ip': self.limits['per_ip'] if self.per_ip is not None else None,
+                 'global': self.limits['global'] if self.global_bucket is not None else None,
+                 'shared_state': self.database or None,
+                 'trusted_proxies': RATE_LIMIT_TRUSTED_PROXIES if RATE_LIMIT_PROXIES_CONFIGURED else None}
+        if isinstance(self.per_ip, TokenBuckets):
+            stats['tracked_ips'] = len(self.per_ip)
+        return stats
+
+
+def rejection_body(scope):
+    """/submit-lead response body for a rate-limited request."""
+    return {'error': 'Too many requests, please try again later', 'limit': scope}
@@ -0,0 +1,175 @@
+"""
+KatalystVC SMTP Connection Pool
+Keeps a bounded set of authenticated SMTP sessions open and shares them across
+request and worker threads, so each email no longer pays for its own TCP
+connect, STARTTLS handshake and login. An optional send rate (see
+rate_limit.py) spaces messages out so a burst doesn't get the account
+throttled by the provider; sends over the rate wait rather than fail.
+smtplib (and the ssl module it loads) is imported on the first connection,
+not when a service imports this module.
+"""
+
+import threading
+import time
+
+import metrics
+import rate_limit
+
+
+class SMTPConnectionPool:
+    """A bounded, thread-safe pool of logged-in smtplib.SMTP sessions."""
+
+    def __init__(self, host, port, user, password, use_tls=True, max_size=4,
+                 timeout=30, noop_after=30, max_idle=300, send_rate=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.max_size = max_size
+        self.timeout = timeout
+        self.noop_after = noop_after  # Idle seconds before a session is health-checked
+        self.max_idle = max_idle      # Idle seconds before a session is dropped outright
+        self.send_rate = send_rate
+        self._throttle = rate_limit.make_buckets(send_rate, database='')  # None = unlimited
+
+        self._cond = threading.Condition()
+        self._idle = []  # (server, last_used) pairs, most recently used last
+        self._in_use = 0
+        self._opened = 0
+        self._reconnects = 0
+        self._sent = 0
+        self._throttled = 0
+
+    def _connect(self):
+        import smtplib
+
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if server.has_extn('auth'):
+                server.login(self.user, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        with self._cond:
+            self._opened += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(server):
+        try:
+            code, _ = server.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check out a healthy session, opening one if the pool has room."""
+        with self._cond:
+            while not self._idle and self._in_use >= self.max_size:
+                self._cond.wait()
+            self._in_use += 1
+            entry = self._idle.pop() if self._idle else None
+
+        try:
+            if entry is not None:
+                server, last_used = entry
+                idle_for = time.monotonic() - last_used
+                if idle_for < self.noop_after or (idle_for < self.max_idle and self._is_alive(server)):
+                    return server
+                self._close(server)
+                with self._cond:
+                    self._reconnects += 1
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, server, broken=False):
+        """Return a session to the pool, or drop it if it is no longer usable."""
+        if broken:
+            self._close(server)
+        with self._cond:
+            self._in_use -= 1
+            if not broken:
+                self._idle.append((server, time.monotonic()))
+            self._cond.notify()
+
+    def wait_for_send_slot(self):
+        """Block until the send rate allows another message (no-op without one)."""
+        if self._throttle is None:
+            return
+        delay = self._throttle.reserve('smtp')
+        if delay > 0:
+            with self._cond:
+                self._throttled += 1
+            with metrics.stage('smtp_rate_wait'):
+                time.sleep(delay)
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Send a message on a pooled session, waiting for the send rate first.
+
+        A 421 or other transient 4xx reply, or a dropped connection, discards
+        the session and retries once on a fresh one. Anything else is raised.
+        """
+        import smtplib
+
+        self.wait_for_send_slot()
+        for attempt in range(2):
+            server = self.acquire()
+            try:
+                server.sendmail(from_addr, to_addrs, msg)
+            except smtplib.SMTPServerDisconnected:
+                self.release(server, broken=True)
+                if attempt:
+                    raise
+            except smtplib.SMTPResponseException as e:
+                transient = 400 <= e.smtp_code < 500
+                self.release(server, broken=transient)
+                if not transient or attempt:
+                    raise
+            except Exception:
+                self.release(server, broken=True)
+                raise
+            else:
+                self.release(server)
+                with self._cond:
+                    self._sent += 1
+                return
+            with self._cond:
+                self._reconnects += 1
+
+    def close_all(self):
+        """Quit every idle session (in-use sessions are closed on release)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+    def stats(self):
+        """Pool counters for the /health endpoint."""
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'opened': self._opened,
+                'reconnects': self._reconnects,
+                'sent': self._sent,
+                'send_rate': self.send_rate or None,
+                'throttled': self._throttled
+            }